@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the compact conversation tree with the previous dict walk.
+
+For every conversation in conversations.json this measures:
+- retained memory of the raw json.load dict tree vs the compact tree built from it
+- traversal time of the displayed path: the original dict walk of build_blocks_from_conversation
+  (root scan over the mapping + first-child walk with a visited set) vs tree walk
+
+Usage:
+    python benchmarks/bench_conversation_model.py [path/to/conversations.json] [--top N]
+"""
+
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from import_chatgpt_en import CONVERSATIONS_JSON_PATH, build_conversation_tree, get_conversation_path
+
+REPEAT = 20  # Traversal repetitions per conversation (timings are averaged)
+MAX_TRAVERSE_DEPTH = 1000  # Depth limit of the original walk
+
+def dict_walk_path(conversation_data):
+    """Path walk on the raw dicts as done before the compact tree: root scan + first-child walk"""
+    mapping = conversation_data.get('mapping', {})
+    if not mapping:
+        return []
+
+    root_id = next((nid for nid, node in mapping.items() if not node.get('parent')), None)
+    if not root_id:
+        try:
+            root_id = min(mapping.keys(),
+                          key=lambda k: mapping[k].get('message', {}).get('create_time', float('inf')))
+        except (ValueError, TypeError):
+            return []
+
+    path = []
+    current_id = root_id
+    visited = set()
+    depth = 0
+    while current_id in mapping and current_id not in visited and depth < MAX_TRAVERSE_DEPTH:
+        visited.add(current_id)
+        depth += 1
+        path.append(current_id)
+        children = mapping[current_id].get('children', [])
+        current_id = children[0] if children and isinstance(children, list) else None
+    return path
+
+def retained_size(build):
+    """Memory still allocated by the object returned from build() (bytes)"""
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del obj
+    return size
+
+def time_per_call(func, *args):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        func(*args)
+    return (time.perf_counter() - start) / REPEAT
+
+def measure(conversation):
+    raw_json = json.dumps(conversation, ensure_ascii=False)
+
+    raw_bytes = retained_size(lambda: json.loads(raw_json))
+
+    # Tree only: the raw dicts are dropped after building, as the importer does after each conversation
+    tree_bytes = retained_size(lambda: build_conversation_tree(json.loads(raw_json)))
+
+    tree = build_conversation_tree(conversation)
+    return {
+        "title": conversation.get('title') or 'Untitled',
+        "nodes": len(tree),
+        "raw_bytes": raw_bytes,
+        "tree_bytes": tree_bytes,
+        "dict_walk_s": time_per_call(dict_walk_path, conversation),
+        "tree_build_s": time_per_call(build_conversation_tree, conversation),
+        "tree_walk_s": time_per_call(get_conversation_path, tree),
+    }
+
+def main():
+    args = sys.argv[1:]
+    top = 10
+    if '--top' in args:
+        i = args.index('--top')
+        top = int(args[i + 1])
+        del args[i:i + 2]
+    path = args[0] if args else CONVERSATIONS_JSON_PATH
+
+    with open(path, 'r', encoding='utf-8') as f:
+        conversations = json.load(f)
+    print(f"📊 {len(conversations)} conversations from {path}")
+
+    results = [measure(c) for c in conversations]
+    totals = {key: sum(r[key] for r in results) for key in results[0] if key != 'title'} if results else {}
+    if not totals:
+        return
+
+    print(f"\n{'nodes':>7} {'raw KiB':>9} {'tree KiB':>9} {'orig walk µs':>13} {'tree build µs':>14} {'tree walk µs':>13}  title")
+    for r in sorted(results, key=lambda r: r['nodes'], reverse=True)[:top]:
+        print(f"{r['nodes']:>7} {r['raw_bytes'] / 1024:>9.1f} {r['tree_bytes'] / 1024:>9.1f} "
+              f"{r['dict_walk_s'] * 1e6:>13.1f} {r['tree_build_s'] * 1e6:>14.1f} {r['tree_walk_s'] * 1e6:>13.1f}  {r['title'][:40]}")
+
+    print(f"\nTotal nodes: {totals['nodes']}")
+    print(f"Retained memory: raw dicts {totals['raw_bytes'] / 1048576:.2f} MiB -> "
+          f"compact tree {totals['tree_bytes'] / 1048576:.2f} MiB "
+          f"({totals['tree_bytes'] / max(totals['raw_bytes'], 1):.0%})")
+    print(f"Path traversal: original dict walk (root scan + first child) {totals['dict_walk_s'] * 1e3:.2f} ms, "
+          f"tree walk {totals['tree_walk_s'] * 1e3:.2f} ms (one-time tree build {totals['tree_build_s'] * 1e3:.2f} ms)")
+
+if __name__ == "__main__":
+    main()
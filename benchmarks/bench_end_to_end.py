@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end throughput of the full main() pipeline against the local mock Notion server.
+
+A synthetic export (generated on first use) is imported once per configuration; every run is a separate process
+with a fresh working directory, talking to a fresh mock server with realistic latency and the Notion rate limit.
+Reported per run:
+- conversations/min and requests per conversation (by endpoint, 429 responses)
+- wall time split into time.sleep, time inside HTTP requests and the rest, plus process CPU time
+- peak RSS of the importer process
+- projected duration of a 30k-conversation import
+
+Usage:
+    python benchmarks/bench_end_to_end.py [--export DIR] [--conversations 200] [--seed 42]
+        [--rate 3] [--burst 10] [--latency-ms 250] [--jitter-ms 100]
+        [--config "UPLOAD_WORKERS=1" --config "UPLOAD_WORKERS=8 APPEND_BATCH_SIZE=50"] [--output results.json]
+
+Each --config is one run with the given importer globals overridden (Python literals); without --config the defaults run once.
+"""
+
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.join(BENCHMARK_DIR, '..')
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+PROJECTED_CONVERSATIONS = 30000  # Size of the import the projection is made for
+
+def parse_config(text):
+    """'NAME=value NAME2=value' -> {name: Python literal}"""
+    overrides = {}
+    for item in text.split():
+        name, _, value = item.partition('=')
+        try:
+            overrides[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            overrides[name] = value
+    return overrides
+
+def run_child(options_path, result_path):
+    """Importer process: run main() with timing hooks, write measurements to result_path"""
+    import resource
+    import threading
+
+    import requests
+
+    with open(options_path, 'r', encoding='utf-8') as f:
+        options = json.load(f)
+    os.environ['NOTION_API_BASE_URL'] = options['base_url']
+    import import_chatgpt_en as importer
+
+    importer.NOTION_API_KEY = 'ntn_' + 'benchmark' * 3
+    importer.NOTION_DATABASE_ID = 'b' * 32
+    importer.CHATGPT_EXPORT_PATH = options['export']
+    importer.CONVERSATIONS_JSON_PATH = os.path.join(options['export'], 'conversations.json')
+    for name, value in options['overrides'].items():
+        if not hasattr(importer, name):
+            raise SystemExit(f"Unknown importer setting: {name}")
+        setattr(importer, name, value)
+
+    totals = {"sleep_s": 0.0, "request_s": 0.0, "requests": 0}
+    lock = threading.Lock()
+    original_sleep = time.sleep
+    original_request = requests.Session.request
+
+    def timed_sleep(seconds):
+        start = time.perf_counter()
+        original_sleep(seconds)
+        with lock:
+            totals["sleep_s"] += time.perf_counter() - start
+
+    def timed_request(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original_request(self, *args, **kwargs)
+        finally:
+            with lock:
+                totals["request_s"] += time.perf_counter() - start
+                totals["requests"] += 1
+
+    importer.time.sleep = timed_sleep
+    requests.Session.request = timed_request
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    importer.main()
+    totals["wall_s"] = time.perf_counter() - wall_start
+    totals["cpu_s"] = time.process_time() - cpu_start
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    totals["peak_rss_mib"] = peak / 1048576 if sys.platform == 'darwin' else peak / 1024
+    with open(result_path, 'w', encoding='utf-8') as f:
+        json.dump(totals, f)
+
+def run_config(args, overrides):
+    """One import run against a fresh mock server, returns the measurements"""
+    from mock_notion_server import start_server
+
+    server = start_server(rate=args.rate, burst=args.burst, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms)
+    try:
+        with tempfile.TemporaryDirectory(prefix='bench_e2e_') as workdir:
+            options_path = os.path.join(workdir, 'options.json')
+            result_path = os.path.join(workdir, 'result.json')
+            log_path = os.path.join(workdir, 'import.log')
+            with open(options_path, 'w', encoding='utf-8') as f:
+                json.dump({"base_url": server.base_url, "export": os.path.abspath(args.export), "overrides": overrides}, f)
+            with open(log_path, 'w', encoding='utf-8') as log:
+                process = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', options_path, result_path],
+                                         cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+            if process.returncode != 0 or not os.path.exists(result_path):
+                with open(log_path, 'r', encoding='utf-8') as log:
+                    print(log.read()[-3000:])
+                raise SystemExit(f"❌ Import run failed (exit code {process.returncode})")
+            with open(result_path, 'r', encoding='utf-8') as f:
+                result = json.load(f)
+            with open(log_path, 'r', encoding='utf-8') as log:
+                import_log = log.read()
+        with server.state.lock:
+            result["server"] = json.loads(json.dumps(server.state.stats))
+    finally:
+        server.shutdown()
+        server.server_close()
+    result["overrides"] = overrides
+    result["failed_conversations"] = import_log.count("❌ Import failed") + import_log.count("❌ Unexpected error")
+    return result
+
+def report(result, conversations):
+    server = result["server"]
+    wall = result["wall_s"]
+    requests_total = sum(server["requests"].values())
+    other = max(wall - result["sleep_s"] - result["request_s"], 0.0)
+    per_conversation = wall / max(conversations, 1)
+
+    label = " ".join(f"{k}={v}" for k, v in result["overrides"].items()) or "defaults"
+    print(f"\n⚙️  {label}")
+    print(f"   Conversations/min: {conversations / wall * 60:.1f} ({wall:.1f}s for {conversations}, {result['failed_conversations']} failed)")
+    print(f"   Requests/conversation: {requests_total / max(conversations, 1):.1f} "
+          f"({requests_total} requests, {server['rate_limited']} rate limited)")
+    for endpoint, count in sorted(server["requests"].items(), key=lambda item: -item[1]):
+        print(f"      {endpoint}: {count}")
+    print(f"   Time: sleep {result['sleep_s']:.1f}s ({result['sleep_s'] / wall:.0%}), "
+          f"HTTP {result['request_s']:.1f}s ({result['request_s'] / wall:.0%}), other {other:.1f}s; CPU {result['cpu_s']:.1f}s")
+    print("   (sleep and HTTP time are summed over threads, parallel uploads can push them above wall time)")
+    print(f"   Peak RSS: {result['peak_rss_mib']:.1f} MiB")
+    print(f"   Projected {PROJECTED_CONVERSATIONS} conversations: {per_conversation * PROJECTED_CONVERSATIONS / 3600:.1f} h")
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end import throughput against the mock Notion server")
+    parser.add_argument('--export', default=os.path.join(tempfile.gettempdir(), 'chatgpt_synthetic_export'),
+                        help="Export folder (generated when it has no conversations.json)")
+    parser.add_argument('--conversations', type=int, default=200, help="Conversations to generate for a new export")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--rate', type=float, default=3.0, help="Mock server rate limit (req/s)")
+    parser.add_argument('--burst', type=int, default=10)
+    parser.add_argument('--latency-ms', type=float, default=250.0)
+    parser.add_argument('--jitter-ms', type=float, default=100.0)
+    parser.add_argument('--config', action='append', default=[], help="Importer globals to override for one run, e.g. \"UPLOAD_WORKERS=8\"")
+    parser.add_argument('--output', help="Write all results as JSON")
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+
+    conversations_path = os.path.join(args.export, 'conversations.json')
+    if not os.path.exists(conversations_path):
+        from generate_synthetic_export import ExportGenerator
+        print(f"🧪 Generating synthetic export ({args.conversations} conversations) in {args.export}")
+        os.makedirs(args.export, exist_ok=True)
+        ExportGenerator(args.export, args.seed, max_turns=40, asset_ratio=0.15, long_ratio=0.02).write(args.conversations)
+    with open(conversations_path, 'r', encoding='utf-8') as f:
+        conversations = len(json.load(f))
+
+    print(f"📊 {conversations} conversations from {args.export}")
+    print(f"   Mock Notion: {args.rate} req/s (burst {args.burst}), latency {args.latency_ms}±{args.jitter_ms} ms")
+    results = []
+    for config in args.config or ['']:
+        result = run_config(args, parse_config(config))
+        report(result, conversations)
+        results.append(result)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"conversations": conversations, "rate": args.rate, "latency_ms": args.latency_ms, "results": results}, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
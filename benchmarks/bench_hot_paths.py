@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmarks of the CPU hot paths (pytest-benchmark).
+
+Covered: clean_text_content, split_long_text, validate_block_content, build_blocks_from_conversation,
+analyze_request_payload, get_safe_language_type. Inputs come from the synthetic export generator with a fixed
+seed, so numbers are comparable between commits. Besides per-call latency every benchmark records the
+throughput of its input in MB/s (extra_info of the saved runs).
+
+Usage:
+    pip install pytest-benchmark
+
+    # Run and store a baseline (benchmarks/.baselines/<machine>/NNNN_<commit>.json)
+    python -m pytest benchmarks/bench_hot_paths.py --benchmark-storage=benchmarks/.baselines --benchmark-autosave
+
+    # Compare with the last stored run, fail on a mean regression above 10%
+    python -m pytest benchmarks/bench_hot_paths.py --benchmark-storage=benchmarks/.baselines \
+        --benchmark-compare --benchmark-compare-fail=mean:10%
+
+    # Same through compare_hot_paths.py, which also fails when this machine has no baseline yet
+    python benchmarks/compare_hot_paths.py --save
+    python benchmarks/compare_hot_paths.py
+"""
+
+import json
+import os
+import random
+import sys
+
+import pytest
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..'))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from generate_synthetic_export import ExportGenerator, code_snippet, long_message, markdown_reply, paragraph
+from import_chatgpt_en import (analyze_request_payload, build_blocks_from_conversation, clean_text_content,
+                               get_safe_language_type, split_long_text, validate_block_content)
+
+SEED = 1234  # Fixed input data, change only together with the stored baselines
+
+def record_throughput(benchmark, size_bytes):
+    """Store input size and MB/s of the mean call time in the benchmark's extra_info"""
+    benchmark.extra_info['input_bytes'] = size_bytes
+    if benchmark.stats:
+        benchmark.extra_info['MB/s'] = round(size_bytes / benchmark.stats.stats.mean / 1e6, 2)
+
+def text_bytes(text):
+    return len(text.encode('utf-8'))
+
+@pytest.fixture(scope='module')
+def texts():
+    """Plain / markdown / long texts with CJK and emoji (short, medium, long)"""
+    rng = random.Random(SEED)
+    return {
+        'short': paragraph(rng, 2),
+        'medium': "\n\n".join(markdown_reply(rng) for _ in range(10)),
+        'long': long_message(rng),
+    }
+
+@pytest.fixture(scope='module')
+def blocks():
+    """Mixed blocks as produced by the renderers (before cleaning)"""
+    rng = random.Random(SEED)
+    result = []
+    for i in range(500):
+        kind = i % 5
+        if kind == 0:
+            result.append({"type": "paragraph", "paragraph": {"rich_text": [{"type": "text", "text": {"content": paragraph(rng, rng.randint(1, 6))}}]}})
+        elif kind == 1:
+            result.append({"type": "code", "code": {"rich_text": [{"type": "text", "text": {"content": code_snippet(rng, 10)}}],
+                                                    "language": rng.choice(['python', 'js', 'unknown', 'objc'])}})
+        elif kind == 2:
+            result.append({"type": "heading_2", "heading_2": {"rich_text": [{"type": "text", "text": {"content": paragraph(rng, 1)}}]}})
+        elif kind == 3:
+            result.append({"type": "bulleted_list_item", "bulleted_list_item": {"rich_text": [{"type": "text", "text": {"content": paragraph(rng, 1)}}]}})
+        else:
+            result.append({"type": "image", "image": {"type": "file_upload", "file_upload": {"id": f"upload-{i}"}}})
+    return result
+
+@pytest.fixture(scope='module')
+def conversation(tmp_path_factory):
+    """One generated conversation of 40 turns, without files (no uploads during the benchmark)"""
+    generator = ExportGenerator(str(tmp_path_factory.mktemp('export')), SEED, max_turns=40, asset_ratio=0.0, long_ratio=0.02)
+    conversations = [generator.conversation(i) for i in range(20)]
+    return max(conversations, key=lambda c: len(c['mapping']))
+
+@pytest.mark.parametrize('size', ['short', 'medium', 'long'])
+def test_clean_text_content(benchmark, texts, size):
+    benchmark(clean_text_content, texts[size])
+    record_throughput(benchmark, text_bytes(texts[size]))
+
+@pytest.mark.parametrize('size', ['short', 'medium', 'long'])
+def test_split_long_text(benchmark, texts, size):
+    benchmark(split_long_text, texts[size])
+    record_throughput(benchmark, text_bytes(texts[size]))
+
+def test_validate_block_content(benchmark, blocks):
+    benchmark(lambda: [validate_block_content(block) for block in blocks])
+    record_throughput(benchmark, text_bytes(json.dumps(blocks, ensure_ascii=False)))
+
+def test_build_blocks_from_conversation(benchmark, conversation):
+    benchmark(lambda: list(build_blocks_from_conversation(conversation, {})))
+    benchmark.extra_info['nodes'] = len(conversation['mapping'])
+    record_throughput(benchmark, text_bytes(json.dumps(conversation, ensure_ascii=False)))
+
+def test_analyze_request_payload(benchmark, blocks):
+    payload = {"children": blocks[:100]}
+    benchmark(analyze_request_payload, payload)
+    record_throughput(benchmark, text_bytes(json.dumps(payload, ensure_ascii=False)))
+
+def test_get_safe_language_type(benchmark):
+    languages = ['python', 'Python', 'js', 'TS', 'unknown', 'objective-c', 'c++', 'brainfuck', '', None, ' sql ', 'yml'] * 100
+    benchmark(lambda: [get_safe_language_type(language) for language in languages])
+    record_throughput(benchmark, sum(text_bytes(language or '') for language in languages))
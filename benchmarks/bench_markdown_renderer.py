@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the single-pass markdown renderer with the previous plain-text split.
+
+For synthetic assistant messages of increasing size this measures:
+- time of the old path: label + text split into MAX_TEXT_LENGTH paragraph chunks
+- time of iter_markdown_blocks (headings, lists, quotes, fenced code, paragraphs)
+- number of blocks each path produces
+
+Both paths build unvalidated blocks and then run every block through prepare_block
+(validation, cleaning and oversize splitting), as the import does before appending.
+
+Both columns should grow linearly with message size.
+
+Usage:
+    python benchmarks/bench_markdown_renderer.py [--sizes 10000,100000,1000000]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from import_chatgpt_en import iter_markdown_blocks, make_text_block, prepare_block, split_long_text
+
+REPEAT = 5  # Repetitions per size (timings are averaged)
+
+SAMPLE = """## Section heading
+Some explanatory text that runs over a couple of lines
+and keeps going for a bit.
+
+1. first step
+2. second step
+- a bullet
+- another bullet
+
+> a quoted remark
+
+```python
+def handler(event):
+    return event["body"]
+```
+
+---
+"""
+
+def make_message(size):
+    """Repeat the markdown sample until the message reaches size characters"""
+    return (SAMPLE * (size // len(SAMPLE) + 1))[:size]
+
+def time_per_call(func, text):
+    start = time.perf_counter()
+    # prepare_block reports oversized blocks it splits, keep that out of the table
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(REPEAT):
+            count = sum(1 for _ in func(text))
+    return (time.perf_counter() - start) / REPEAT, count
+
+def plain_blocks(text):
+    for chunk in split_long_text(f"[🤖]Assistant:\n{text}"):
+        yield from prepare_block(make_text_block('paragraph', chunk))
+
+def markdown_blocks(text):
+    for block in iter_markdown_blocks(text):
+        yield from prepare_block(block)
+
+def main():
+    args = sys.argv[1:]
+    sizes = [10_000, 100_000, 1_000_000]
+    if '--sizes' in args:
+        sizes = [int(s) for s in args[args.index('--sizes') + 1].split(',')]
+
+    print(f"{'chars':>9} {'plain ms':>9} {'blocks':>7} {'markdown ms':>12} {'blocks':>7} {'µs/KiB':>7}")
+    for size in sizes:
+        text = make_message(size)
+        plain_s, plain_count = time_per_call(plain_blocks, text)
+        markdown_s, markdown_count = time_per_call(markdown_blocks, text)
+        print(f"{size:>9} {plain_s * 1e3:>9.2f} {plain_count:>7} {markdown_s * 1e3:>12.2f} {markdown_count:>7} "
+              f"{markdown_s * 1e6 / (size / 1024):>7.1f}")
+
+if __name__ == "__main__":
+    main()
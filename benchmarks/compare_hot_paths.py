@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Store or check the baseline of the hot path microbenchmarks (bench_hot_paths.py).
+
+Baselines are machine specific (benchmarks/.baselines/<machine>/NNNN_<commit>.json, machine = OS, Python
+implementation and version), so they are created on the machine that runs the comparison:
+- --save runs the suite and stores the run as the new baseline
+- without --save the suite is compared with the last stored baseline and the script fails when the mean of a
+  benchmark regresses above the threshold, or when this machine has no baseline yet (nothing to compare against)
+
+Usage:
+    python benchmarks/compare_hot_paths.py --save
+    python benchmarks/compare_hot_paths.py [--threshold mean:10%]
+"""
+
+import argparse
+import glob
+import os
+import subprocess
+import sys
+
+from pytest_benchmark.utils import get_machine_id
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_DIR = os.path.join(BENCHMARK_DIR, '.baselines')
+SUITE = os.path.join(BENCHMARK_DIR, 'bench_hot_paths.py')
+
+def find_baselines():
+    """Stored runs of this machine, oldest first"""
+    return sorted(glob.glob(os.path.join(BASELINE_DIR, get_machine_id(), '*.json')))
+
+def main():
+    parser = argparse.ArgumentParser(description="Store or check the hot path benchmark baseline")
+    parser.add_argument('--save', action='store_true', help="Run the suite and store it as the new baseline")
+    parser.add_argument('--threshold', default='mean:10%', help="Regression that fails the comparison (pytest-benchmark --benchmark-compare-fail)")
+    args = parser.parse_args()
+
+    command = [sys.executable, '-m', 'pytest', SUITE, '-p', 'no:cacheprovider', f"--benchmark-storage={BASELINE_DIR}"]
+    if args.save:
+        command.append('--benchmark-autosave')
+    else:
+        baselines = find_baselines()
+        if not baselines:
+            print(f"❌ No baseline for {get_machine_id()} in {BASELINE_DIR}, create one first with:", file=sys.stderr)
+            print(f"   python {os.path.relpath(__file__)} --save", file=sys.stderr)
+            return 1
+        print(f"📊 Comparing with {os.path.relpath(baselines[-1])} (fail on {args.threshold})")
+        command += ['--benchmark-compare', f"--benchmark-compare-fail={args.threshold}"]
+
+    result = subprocess.run(command)
+    if result.returncode == 0 and args.save:
+        print(f"✅ Baseline stored: {os.path.relpath(find_baselines()[-1])}")
+    return result.returncode
+
+if __name__ == "__main__":
+    sys.exit(main())
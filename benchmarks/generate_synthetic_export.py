@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+Generate a synthetic ChatGPT export (conversations.json + asset files) for scale testing without private data.
+
+Conversations are written one by one (memory stays flat for 100k conversations) and cover what the importer consumes:
+- branched mappings (regenerated replies, current_node on the last branch), hidden system root messages
+- assistant markdown replies with headings / lists / code fences, very long messages
+- code tool calls + execution_output, browsing results and quotes, system errors, thoughts / reasoning recaps
+- multimodal user messages with file-service:// images and metadata.attachments (pdf / csv)
+- voice mode transcripts with sediment:// audio pointers
+- Canvas documents: canmore create / update tool calls with canvas metadata
+- DALL·E generations: dalle.text2im tool calls answered by multimodal tool messages with generated images
+- CJK and emoji text
+
+Asset files use the export naming (file-XXXX-name.ext, referenced by prefix), so find_local_file resolves them.
+Most of them are in the export root; DALL·E outputs go to dalle-generations/ and a share of uploaded images
+to per-user user-XXXX/ folders, as in newer exports.
+The same --seed always produces the same export.
+
+Usage:
+    python benchmarks/generate_synthetic_export.py OUTPUT_DIR [--conversations 1000] [--seed 42]
+        [--max-turns 40] [--asset-ratio 0.15] [--long-ratio 0.02]
+"""
+
+import argparse
+import json
+import os
+import random
+import struct
+import sys
+import uuid
+import zlib
+
+BASE_TIME = 1_700_000_000  # Timestamp of the first conversation
+DALLE_FOLDER = 'dalle-generations'  # Subfolder of generated images
+USER_FOLDER_RATIO = 0.3  # Share of uploaded images written to the user folder instead of the export root
+
+WORDS = ("data model request batch notion page block import export cache index query thread worker latency "
+         "budget limit retry token stream parser buffer schema filter policy render upload canvas branch").split()
+CJK_SENTENCES = [
+    "这个问题可以分成几个步骤来解决。", "请帮我把这段代码改成异步版本。", "我们先看一下数据结构的设计。",
+    "日本語のテキストも含まれています。", "한국어 문장도 테스트합니다.", "性能瓶颈通常在网络请求上。",
+]
+EMOJIS = "😀🚀✨📊🔥✅❗️🎉🤔💡🧪📎"
+LANGUAGES = ["python", "javascript", "typescript", "bash", "sql", "json", "go", "rust"]
+TITLES = ["Batch import design", "数据库索引优化", "Debug flaky test", "旅行计划 ✈️", "Regex help", "Weekly report draft",
+          "Async rewrite", "周报整理", "Image caption ideas", "Voice chat", "Canvas: project proposal"]
+
+def sentence(rng, words=12):
+    """One pseudo-English sentence, sometimes mixed with CJK or emoji"""
+    text = " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+    roll = rng.random()
+    if roll < 0.15:
+        text += " " + rng.choice(CJK_SENTENCES)
+    elif roll < 0.25:
+        text += " " + rng.choice(EMOJIS)
+    return text
+
+def paragraph(rng, sentences=4):
+    return " ".join(sentence(rng, rng.randint(6, 18)) for _ in range(sentences))
+
+def code_snippet(rng, lines=8):
+    body = "\n".join(f"    value_{i} = compute({rng.choice(WORDS)!r}, {rng.randint(0, 999)})" for i in range(lines))
+    return f"def {rng.choice(WORDS)}_{rng.randint(1, 99)}():\n{body}\n    return value_0"
+
+def markdown_reply(rng):
+    """Assistant reply with headings, lists, quotes and fenced code"""
+    parts = [paragraph(rng, rng.randint(1, 3))]
+    for _ in range(rng.randint(0, 3)):
+        kind = rng.random()
+        if kind < 0.25:
+            parts.append(f"{'#' * rng.randint(1, 3)} {sentence(rng, 4)[:-1]}")
+            parts.append(paragraph(rng, rng.randint(1, 4)))
+        elif kind < 0.5:
+            marker = rng.choice(["-", "*", "1."])
+            parts.append("\n".join(f"{marker} {sentence(rng, 6)}" for _ in range(rng.randint(2, 6))))
+        elif kind < 0.75:
+            parts.append(f"```{rng.choice(LANGUAGES)}\n{code_snippet(rng, rng.randint(3, 30))}\n```")
+        elif kind < 0.85:
+            parts.append(f"> {sentence(rng)}")
+        else:
+            parts.append("---")
+    return "\n\n".join(parts)
+
+def long_message(rng):
+    """Very long message (20k-200k characters), as pasted logs or documents"""
+    target = rng.randint(20_000, 200_000)
+    chunks = []
+    size = 0
+    while size < target:
+        chunk = paragraph(rng, 8) if rng.random() < 0.7 else f"```\n{code_snippet(rng, 40)}\n```"
+        chunks.append(chunk)
+        size += len(chunk) + 2
+    return "\n\n".join(chunks)
+
+def png_bytes(width, height):
+    """Valid grayscale PNG"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    raw = b''.join(b'\x00' + bytes(width) for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+def wav_bytes(samples):
+    """Valid 8 kHz mono 8-bit silent WAV"""
+    return (b'RIFF' + struct.pack('<I', 36 + samples) + b'WAVEfmt ' + struct.pack('<IHHIIHH', 16, 1, 1, 8000, 8000, 1, 8)
+            + b'data' + struct.pack('<I', samples) + b'\x80' * samples)
+
+class ExportGenerator:
+    """Builds conversations and writes their asset files"""
+    def __init__(self, output_dir, seed, max_turns, asset_ratio, long_ratio):
+        self.rng = random.Random(seed)
+        self.output_dir = output_dir
+        self.max_turns = max_turns
+        self.asset_ratio = asset_ratio
+        self.long_ratio = long_ratio
+        self.user_folder = f"user-{''.join(self.rng.choice('abcdefghijklmnopqrstuvwxyz0123456789') for _ in range(24))}"
+        self.stats = {"conversations": 0, "nodes": 0, "branches": 0, "long_messages": 0, "files": 0, "subfolder_files": 0, "file_bytes": 0,
+                      "canvas_documents": 0, "dalle_images": 0}
+
+    def new_id(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def file_id(self, separator='-'):
+        return f"file{separator}{''.join(self.rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ23456789') for _ in range(22))}"
+
+    def write_asset(self, reference, name, data, folder=None):
+        """Write asset file in export naming (reference-name), in the export root or a subfolder, returns its size"""
+        directory = self.output_dir
+        if folder:
+            directory = os.path.join(self.output_dir, folder)
+            os.makedirs(directory, exist_ok=True)
+            self.stats["subfolder_files"] += 1
+        with open(os.path.join(directory, f"{reference}-{name}"), 'wb') as f:
+            f.write(data)
+        self.stats["files"] += 1
+        self.stats["file_bytes"] += len(data)
+        return len(data)
+
+    def message(self, role, content, create_time, name=None, recipient='all', metadata=None):
+        return {
+            "id": None,
+            "author": {"role": role, "name": name, "metadata": {}},
+            "create_time": create_time,
+            "update_time": None,
+            "content": content,
+            "status": "finished_successfully",
+            "end_turn": role == 'assistant' or None,
+            "weight": 1.0,
+            "metadata": metadata or {},
+            "recipient": recipient,
+        }
+
+    def text(self, parts):
+        return {"content_type": "text", "parts": parts}
+
+    def user_turn(self, t):
+        """User message: plain text, long paste, image + attachments, or voice"""
+        rng = self.rng
+        roll = rng.random()
+        if roll < self.long_ratio:
+            self.stats["long_messages"] += 1
+            return [self.message('user', self.text([long_message(rng)]), t)]
+        if roll < self.long_ratio + self.asset_ratio:
+            reference = self.file_id()
+            folder = self.user_folder if rng.random() < USER_FOLDER_RATIO else None
+            size = self.write_asset(reference, f"{rng.choice(WORDS)}.png", png_bytes(rng.randint(8, 64), rng.randint(8, 64)), folder)
+            parts = [{"content_type": "image_asset_pointer", "asset_pointer": f"file-service://{reference}",
+                      "size_bytes": size, "width": 64, "height": 64, "fovea": None, "metadata": None},
+                     sentence(rng)]
+            metadata = {"attachments": [{"id": reference, "name": f"{reference}.png", "mime_type": "image/png", "size": size}]}
+            if rng.random() < 0.5:
+                doc_reference = self.file_id()
+                if rng.random() < 0.5:
+                    doc_size = self.write_asset(doc_reference, "report.pdf", b"%PDF-1.4\n" + paragraph(rng).encode('utf-8') + b"\n%%EOF\n")
+                    metadata["attachments"].append({"id": doc_reference, "name": "report.pdf", "mime_type": "application/pdf", "size": doc_size})
+                else:
+                    csv_data = "\n".join(",".join(str(rng.randint(0, 999)) for _ in range(5)) for _ in range(20)).encode('utf-8')
+                    doc_size = self.write_asset(doc_reference, "data.csv", csv_data)
+                    metadata["attachments"].append({"id": doc_reference, "name": "data.csv", "mime_type": "text/csv", "size": doc_size})
+            return [self.message('user', {"content_type": "multimodal_text", "parts": parts}, t, metadata=metadata)]
+        if roll < self.long_ratio + self.asset_ratio * 1.3:
+            reference = self.file_id('_')
+            size = self.write_asset(reference, "audio.wav", wav_bytes(rng.randint(800, 8000)))
+            parts = [{"content_type": "audio_transcription", "text": sentence(rng), "direction": "in"},
+                     {"content_type": "real_time_user_audio_video_asset_pointer", "frames_asset_pointers": [], "video_container_asset_pointer": None,
+                      "audio_asset_pointer": {"content_type": "audio_asset_pointer", "asset_pointer": f"sediment://{reference}",
+                                              "size_bytes": size, "format": "wav"}}]
+            return [self.message('user', {"content_type": "multimodal_text", "parts": parts}, t)]
+        text = paragraph(rng, rng.randint(1, 4))
+        return [self.message('user', self.text([text]), t)]
+
+    def assistant_turn(self, t):
+        """Assistant reply, optionally preceded by reasoning, tool calls or Canvas edits"""
+        rng = self.rng
+        messages = []
+        roll = rng.random()
+        if roll < 0.1:
+            messages.append(self.message('assistant', {"content_type": "thoughts", "thoughts": [
+                {"summary": sentence(rng, 4), "content": paragraph(rng, 2)} for _ in range(rng.randint(1, 3))]}, t))
+            messages.append(self.message('assistant', {"content_type": "reasoning_recap", "content": f"Thought for {rng.randint(2, 90)} seconds"}, t))
+        elif roll < 0.25:
+            messages.append(self.message('assistant', {"content_type": "code", "language": "unknown", "text": code_snippet(rng)}, t, recipient='python'))
+            if rng.random() < 0.1:
+                messages.append(self.message('tool', {"content_type": "system_error", "name": "tool_error", "text": "Execution timed out"}, t, name='python'))
+            else:
+                output = "\n".join(f"{rng.choice(WORDS)}: {rng.random():.6f}" for _ in range(rng.randint(1, 400)))
+                messages.append(self.message('tool', {"content_type": "execution_output", "text": output}, t, name='python'))
+        elif roll < 0.33:
+            messages.append(self.message('tool', {"content_type": "tether_browsing_display", "result": "\n".join(paragraph(rng) for _ in range(rng.randint(1, 12))),
+                                                  "summary": None, "assets": None}, t, name='browser'))
+            messages.append(self.message('tool', {"content_type": "tether_quote", "url": f"https://example.com/{rng.choice(WORDS)}",
+                                                  "domain": "example.com", "title": sentence(rng, 4), "text": paragraph(rng)}, t, name='browser'))
+        elif roll < 0.38:
+            messages.extend(self.canvas_messages(t))
+        elif roll < 0.38 + self.asset_ratio * 0.3:
+            messages.extend(self.dalle_messages(t))
+        if rng.random() < self.long_ratio:
+            self.stats["long_messages"] += 1
+            messages.append(self.message('assistant', self.text([long_message(rng)]), t))
+        else:
+            messages.append(self.message('assistant', self.text([markdown_reply(rng)]), t))
+        return messages
+
+    def canvas_messages(self, t):
+        """canmore create + optional updates of one Canvas document (tool responses carry canvas metadata)"""
+        rng = self.rng
+        textdoc_id = uuid.UUID(int=rng.getrandbits(128), version=4).hex
+        doc_type = rng.choice(["document", "code/python"])
+        name = f"{rng.choice(WORDS)}_{rng.choice(WORDS)}"
+        content = markdown_reply(rng) if doc_type == "document" else code_snippet(rng, 20)
+        self.stats["canvas_documents"] += 1
+        messages = [
+            self.message('assistant', {"content_type": "code", "language": "json",
+                                       "text": json.dumps({"name": name, "type": doc_type, "content": content}, ensure_ascii=False)},
+                         t, recipient='canmore.create_textdoc'),
+            self.message('tool', self.text([f"Successfully created text document '{name}'"]), t, name='canmore.create_textdoc',
+                         metadata={"canvas": {"textdoc_id": textdoc_id, "textdoc_type": doc_type, "version": 1, "title": name, "create_source": "model"}}),
+        ]
+        for version in range(2, rng.randint(2, 5)):
+            if rng.random() < 0.3:
+                updates = [{"pattern": ".*", "multiple": False, "replacement": markdown_reply(rng)}]
+            else:
+                updates = [{"pattern": rng.choice(WORDS), "multiple": rng.random() < 0.5, "replacement": rng.choice(WORDS).upper()}]
+            messages.append(self.message('assistant', {"content_type": "code", "language": "json", "text": json.dumps({"updates": updates})},
+                                         t, recipient='canmore.update_textdoc'))
+            messages.append(self.message('tool', self.text([f"Successfully updated text document with textdoc_id '{textdoc_id}'"]), t,
+                                         name='canmore.update_textdoc', metadata={"canvas": {"textdoc_id": textdoc_id, "textdoc_type": doc_type, "version": version}}))
+        return messages
+
+    def dalle_messages(self, t):
+        """dalle.text2im call + tool message with the generated images (files in dalle-generations/)"""
+        rng = self.rng
+        prompt = sentence(rng, 10)
+        messages = [self.message('assistant', {"content_type": "code", "language": "json", "text": json.dumps({"prompt": prompt, "size": "1024x1024"})},
+                                 t, recipient='dalle.text2im')]
+        parts = []
+        for _ in range(rng.randint(1, 2)):
+            reference = self.file_id()
+            size = self.write_asset(reference, f"{self.new_id()}.png", png_bytes(rng.randint(32, 96), rng.randint(32, 96)), DALLE_FOLDER)
+            parts.append({"content_type": "image_asset_pointer", "asset_pointer": f"file-service://{reference}", "size_bytes": size,
+                          "width": 1024, "height": 1024, "fovea": None,
+                          "metadata": {"dalle": {"gen_id": self.file_id('_'), "prompt": prompt, "seed": rng.getrandbits(32)}}})
+            self.stats["dalle_images"] += 1
+        messages.append(self.message('tool', {"content_type": "multimodal_text", "parts": parts}, t, name='dalle.text2im'))
+        return messages
+
+    def conversation(self, index):
+        """One conversation: root -> hidden system message -> turns, with regenerated sibling branches"""
+        rng = self.rng
+        create_time = BASE_TIME + index * 3600 + rng.random()
+        t = create_time
+        mapping = {}
+
+        def add(message, parent):
+            node_id = self.new_id()
+            if message is not None:
+                message["id"] = node_id
+            mapping[node_id] = {"id": node_id, "message": message, "parent": parent, "children": []}
+            if parent is not None:
+                mapping[parent]["children"].append(node_id)
+            return node_id
+
+        current = add(None, None)
+        current = add(self.message('system', self.text([""]), None, metadata={"is_visually_hidden_from_conversation": True}), current)
+        for _ in range(rng.randint(1, self.max_turns)):
+            t += rng.uniform(5, 600)
+            for message in self.user_turn(t):
+                current = add(message, current)
+            # Regenerated replies: earlier attempts stay as sibling branches, the last one is displayed
+            branch_point = current
+            for attempt in range(1 + (rng.random() < 0.1) * rng.randint(1, 3)):
+                if attempt:
+                    self.stats["branches"] += 1
+                current = branch_point
+                t += rng.uniform(1, 60)
+                for message in self.assistant_turn(t):
+                    current = add(message, current)
+
+        self.stats["conversations"] += 1
+        self.stats["nodes"] += len(mapping)
+        return {
+            "title": rng.choice(TITLES) + (f" #{index}" if rng.random() < 0.5 else ""),
+            "create_time": create_time,
+            "update_time": t,
+            "mapping": mapping,
+            "moderation_results": [],
+            "current_node": current,
+            "plugin_ids": None,
+            "conversation_id": None,
+            "id": None,
+            "is_archived": False,
+            "default_model_slug": rng.choice(["gpt-4o", "o3", "gpt-4-1"]),
+        }
+
+    def write(self, count):
+        """Write conversations.json (one conversation at a time), returns stats"""
+        path = os.path.join(self.output_dir, 'conversations.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('[')
+            for index in range(count):
+                conversation = self.conversation(index)
+                conversation["id"] = conversation["conversation_id"] = self.new_id()
+                if index:
+                    f.write(',\n')
+                json.dump(conversation, f, ensure_ascii=False)
+            f.write(']\n')
+        self.stats["json_bytes"] = os.path.getsize(path)
+        return self.stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic ChatGPT export for scale testing")
+    parser.add_argument('output_dir')
+    parser.add_argument('--conversations', type=int, default=1000, help="Number of conversations (e.g. 1000 / 10000 / 100000)")
+    parser.add_argument('--seed', type=int, default=42, help="Random seed, the same seed produces the same export")
+    parser.add_argument('--max-turns', type=int, default=40, help="Maximum user/assistant turns per conversation")
+    parser.add_argument('--asset-ratio', type=float, default=0.15, help="Fraction of user messages with an image (+ attachments); voice messages and DALL·E replies add 30%% of this each")
+    parser.add_argument('--long-ratio', type=float, default=0.02, help="Fraction of very long messages (20k-200k characters)")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    if os.path.exists(os.path.join(args.output_dir, 'conversations.json')):
+        print(f"⚠️ Overwriting existing export in {args.output_dir}", file=sys.stderr)
+    generator = ExportGenerator(args.output_dir, args.seed, args.max_turns, args.asset_ratio, args.long_ratio)
+    stats = generator.write(args.conversations)
+    print(f"✅ Synthetic export written to {args.output_dir}")
+    for key, value in stats.items():
+        print(f"   {key}: {value}")
+
+if __name__ == "__main__":
+    main()
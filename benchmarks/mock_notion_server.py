@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the Notion API endpoints used by the importer, for offline end-to-end runs.
+
+Endpoints:
+- GET   /v1/databases/{id}              (ETag / If-None-Match -> 304)
+- POST  /v1/pages, PATCH /v1/pages/{id}
+- PATCH /v1/blocks/{id}/children        (returns created block ids, toggles can be appended to)
+- POST  /v1/file_uploads, POST /v1/file_uploads/{id}/send (multipart)
+- GET   /__stats                        (request / error counters as JSON, not part of the Notion API)
+
+Enforced Notion limits (400 validation_error like the real API):
+- 100 children per array, 2 nesting levels per request, 1000 blocks and 500 KB per payload
+- 100 rich_text items per block, 2000 characters per text.content
+- file blocks must reference an uploaded file_upload id, uploads up to 20 MB
+
+Rate limit: token bucket (default 3 req/s, burst 10), 429 rate_limited with Retry-After when exhausted.
+
+Usage:
+    python benchmarks/mock_notion_server.py [--port 8765] [--rate 3] [--burst 10]
+        [--latency-ms 0] [--jitter-ms 0] [--error-rate 0] [--error-statuses 500,502,503] [--seed N]
+
+    NOTION_API_BASE_URL=http://127.0.0.1:8765/v1 python import_chatgpt_en.py
+"""
+
+import argparse
+import datetime
+import email.parser
+import email.policy
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MAX_CHILDREN = 100  # Children per array
+MAX_NESTING = 2  # Nesting levels of children in one request
+MAX_PAYLOAD_BLOCKS = 1000  # Block elements in one request
+MAX_PAYLOAD_BYTES = 500 * 1024  # Request body size
+MAX_RICH_TEXT_ITEMS = 100  # rich_text items per block
+MAX_TEXT_CONTENT = 2000  # Characters per text.content
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024  # Single-part file upload size
+
+BLOCK_TYPES = {
+    'paragraph', 'heading_1', 'heading_2', 'heading_3', 'bulleted_list_item', 'numbered_list_item', 'quote',
+    'to_do', 'toggle', 'callout', 'code', 'divider', 'equation', 'image', 'file', 'pdf', 'audio', 'video',
+    'bookmark', 'table_of_contents',
+}
+CONTAINER_BLOCK_TYPES = {'toggle', 'paragraph', 'bulleted_list_item', 'numbered_list_item', 'quote', 'to_do', 'callout'}
+FILE_BLOCK_TYPES = {'image', 'file', 'pdf', 'audio', 'video'}
+
+DEFAULT_DATABASE_PROPERTIES = {
+    "Title": {"type": "title", "title": {}},
+    "Created Time": {"type": "date", "date": {}},
+    "Updated Time": {"type": "date", "date": {}},
+    "Conversation ID": {"type": "rich_text", "rich_text": {}},
+}
+
+class NotionError(Exception):
+    """Error returned to the client as a Notion error object"""
+    def __init__(self, status, code, message):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+def validation_error(message):
+    return NotionError(400, "validation_error", message)
+
+class TokenBucket:
+    """Average rate with bursts; rate <= 0 disables limiting"""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token; returns 0 on success, otherwise seconds until a token is available"""
+        if self.rate <= 0:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+class MockNotionState:
+    """In-memory databases, pages, appendable blocks and file uploads"""
+    def __init__(self, database_properties=None):
+        self.lock = threading.Lock()
+        self.database_properties = database_properties or DEFAULT_DATABASE_PROPERTIES
+        self.database_edited = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        self.pages = {}  # page id -> database id
+        self.containers = set()  # Page and block ids that accept children
+        self.file_uploads = {}  # file upload id -> status
+        self.stats = {
+            "requests": {}, "status": {}, "rate_limited": 0, "errors_injected": 0,
+            "pages": 0, "blocks": 0, "bytes_received": 0, "bytes_uploaded": 0,
+        }
+
+    def count(self, key, value, amount=1):
+        with self.lock:
+            self.stats[key][value] = self.stats[key].get(value, 0) + amount
+
+    def add(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+def validate_rich_text(rich_text, path):
+    if not isinstance(rich_text, list):
+        raise validation_error(f"{path} should be an array, instead was `{json.dumps(rich_text)[:50]}`.")
+    if len(rich_text) > MAX_RICH_TEXT_ITEMS:
+        raise validation_error(f"{path}.length should be ≤ `{MAX_RICH_TEXT_ITEMS}`, instead was `{len(rich_text)}`.")
+    for i, item in enumerate(rich_text):
+        content = item.get('text', {}).get('content', '') if isinstance(item, dict) else None
+        if not isinstance(content, str):
+            raise validation_error(f"{path}[{i}].text.content should be a string.")
+        if len(content) > MAX_TEXT_CONTENT:
+            raise validation_error(f"{path}[{i}].text.content.length should be ≤ `{MAX_TEXT_CONTENT}`, instead was `{len(content)}`.")
+
+def validate_children(state, children, path, depth, counter):
+    """Check a children array against Notion limits (counter[0] accumulates blocks in the payload)"""
+    if not isinstance(children, list):
+        raise validation_error(f"{path} should be an array.")
+    if len(children) > MAX_CHILDREN:
+        raise validation_error(f"{path}.length should be ≤ `{MAX_CHILDREN}`, instead was `{len(children)}`.")
+    if depth > MAX_NESTING:
+        raise validation_error(f"{path} exceeds the maximum nesting depth of {MAX_NESTING}.")
+    for i, block in enumerate(children):
+        block_path = f"{path}[{i}]"
+        block_type = block.get('type') if isinstance(block, dict) else None
+        if block_type not in BLOCK_TYPES or not isinstance(block.get(block_type), dict):
+            raise validation_error(f"{block_path} should be a known block type, instead was `{block_type}`.")
+        counter[0] += 1
+        if counter[0] > MAX_PAYLOAD_BLOCKS:
+            raise validation_error(f"body contains more than {MAX_PAYLOAD_BLOCKS} block elements.")
+        content = block[block_type]
+        if 'rich_text' in content:
+            validate_rich_text(content['rich_text'], f"{block_path}.{block_type}.rich_text")
+        if 'caption' in content:
+            validate_rich_text(content['caption'], f"{block_path}.{block_type}.caption")
+        if block_type in FILE_BLOCK_TYPES and content.get('type') == 'file_upload':
+            upload_id = content.get('file_upload', {}).get('id')
+            if state.file_uploads.get(upload_id) != 'uploaded':
+                raise validation_error(f"{block_path}.{block_type}.file_upload.id `{upload_id}` is not an uploaded file.")
+        if 'children' in content:
+            validate_children(state, content['children'], f"{block_path}.{block_type}.children", depth + 1, counter)
+
+def create_blocks(state, children):
+    """Assign ids to the top-level blocks, remembering those that accept children"""
+    results = []
+    for block in children:
+        block_id = str(uuid.uuid4())
+        if block['type'] in CONTAINER_BLOCK_TYPES:
+            with state.lock:
+                state.containers.add(block_id)
+        results.append({"object": "block", "id": block_id, "type": block['type'], "has_children": bool(block[block['type']].get('children'))})
+    return results
+
+class MockNotionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MockNotion/1.0'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload, extra_headers=None):
+        body = json.dumps(payload).encode('utf-8') if status != 304 else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.state.count('status', str(status))
+
+    def send_error_object(self, error, extra_headers=None):
+        self.send_json(error.status, {"object": "error", "status": error.status, "code": error.code, "message": error.message}, extra_headers)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.server.state.add('bytes_received', len(body))
+        return body
+
+    def read_json(self, body):
+        if len(body) > MAX_PAYLOAD_BYTES:
+            raise validation_error(f"Request body too large ({len(body)} bytes, limit {MAX_PAYLOAD_BYTES}).")
+        try:
+            return json.loads(body or b'{}')
+        except ValueError:
+            raise NotionError(400, "invalid_json", "Error parsing JSON body.")
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PATCH(self):
+        self.dispatch('PATCH')
+
+    def dispatch(self, method):
+        server = self.server
+        body = self.read_body()
+        path = self.path.split('?', 1)[0]
+
+        if path == '/__stats':
+            with server.state.lock:
+                stats = json.loads(json.dumps(server.state.stats))
+            self.send_json(200, stats)
+            return
+
+        route, handler = self.route(method, path)
+        server.state.count('requests', f"{method} {route}")
+
+        # Same order as the real API: rate limit, auth, then (slow) processing
+        retry_after = server.bucket.acquire()
+        if retry_after:
+            server.state.add('rate_limited')
+            self.send_error_object(NotionError(429, "rate_limited", "You have been rate limited. Please try again in a few minutes."),
+                                   {"Retry-After": str(max(1, math.ceil(retry_after)))})
+            return
+        if server.latency_ms or server.jitter_ms:
+            time.sleep(max(0.0, server.latency_ms + random.uniform(-server.jitter_ms, server.jitter_ms)) / 1000)
+        if server.error_rate and random.random() < server.error_rate:
+            server.state.add('errors_injected')
+            status = random.choice(server.error_statuses)
+            self.send_error_object(NotionError(status, {502: "bad_gateway", 503: "service_unavailable", 504: "gateway_timeout"}.get(status, "internal_server_error"),
+                                               "Injected error."))
+            return
+
+        try:
+            if not self.headers.get('Authorization', '').startswith('Bearer '):
+                raise NotionError(401, "unauthorized", "API token is invalid.")
+            if not self.headers.get('Notion-Version'):
+                raise NotionError(400, "missing_version", "Notion-Version header failed validation.")
+            if handler is None:
+                raise NotionError(400, "invalid_request_url", f"Invalid request URL: {method} {path}")
+            handler(*route_args(path), body)
+        except NotionError as e:
+            self.send_error_object(e)
+
+    def route(self, method, path):
+        """Map request to (route name for stats, handler method)"""
+        routes = [
+            ('GET', r'^/v1/databases/[^/]+$', 'databases/{id}', self.get_database),
+            ('POST', r'^/v1/pages$', 'pages', self.create_page),
+            ('PATCH', r'^/v1/pages/[^/]+$', 'pages/{id}', self.update_page),
+            ('PATCH', r'^/v1/blocks/[^/]+/children$', 'blocks/{id}/children', self.append_children),
+            ('POST', r'^/v1/file_uploads$', 'file_uploads', self.create_file_upload),
+            ('POST', r'^/v1/file_uploads/[^/]+/send$', 'file_uploads/{id}/send', self.send_file_upload),
+        ]
+        for route_method, pattern, name, handler in routes:
+            if route_method == method and re.match(pattern, path):
+                return name, handler
+        return path, None
+
+    def get_database(self, database_id, body):
+        state = self.server.state
+        etag = f'"{state.database_edited}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_json(304, {}, {"ETag": etag})
+            return
+        self.send_json(200, {"object": "database", "id": database_id, "last_edited_time": state.database_edited,
+                             "properties": state.database_properties}, {"ETag": etag})
+
+    def create_page(self, body):
+        state = self.server.state
+        payload = self.read_json(body)
+        database_id = (payload.get('parent') or {}).get('database_id')
+        if not database_id:
+            raise validation_error("body.parent.database_id should be defined.")
+        properties = payload.get('properties') or {}
+        for name, prop in properties.items():
+            if name not in state.database_properties:
+                raise validation_error(f"{name} is not a property that exists.")
+            if 'title' in prop:
+                validate_rich_text(prop['title'], f"body.properties.{name}.title")
+            if 'rich_text' in prop:
+                validate_rich_text(prop['rich_text'], f"body.properties.{name}.rich_text")
+        children = payload.get('children') or []
+        counter = [0]
+        validate_children(state, children, "body.children", 1, counter)
+
+        page_id = str(uuid.uuid4())
+        with state.lock:
+            state.pages[page_id] = database_id
+            state.containers.add(page_id)
+        create_blocks(state, children)
+        state.add('pages')
+        state.add('blocks', counter[0])
+        self.send_json(200, {"object": "page", "id": page_id, "parent": {"type": "database_id", "database_id": database_id}})
+
+    def update_page(self, page_id, body):
+        state = self.server.state
+        self.read_json(body)
+        if page_id not in state.pages:
+            raise NotionError(404, "object_not_found", f"Could not find page with ID: {page_id}.")
+        self.send_json(200, {"object": "page", "id": page_id})
+
+    def append_children(self, block_id, body):
+        state = self.server.state
+        payload = self.read_json(body)
+        if block_id not in state.containers:
+            raise NotionError(404, "object_not_found", f"Could not find block with ID: {block_id}.")
+        children = payload.get('children')
+        counter = [0]
+        validate_children(state, children, "body.children", 1, counter)
+        results = create_blocks(state, children)
+        state.add('blocks', counter[0])
+        self.send_json(200, {"object": "list", "results": results, "has_more": False, "next_cursor": None})
+
+    def create_file_upload(self, body):
+        state = self.server.state
+        payload = self.read_json(body)
+        upload_id = str(uuid.uuid4())
+        with state.lock:
+            state.file_uploads[upload_id] = 'pending'
+        host = self.headers.get('Host') or f"{self.server.server_address[0]}:{self.server.server_address[1]}"
+        self.send_json(200, {"object": "file_upload", "id": upload_id, "status": "pending",
+                             "filename": payload.get('filename'), "content_type": payload.get('content_type'),
+                             "upload_url": f"http://{host}/v1/file_uploads/{upload_id}/send"})
+
+    def send_file_upload(self, upload_id, body):
+        state = self.server.state
+        if state.file_uploads.get(upload_id) != 'pending':
+            raise validation_error(f"File upload {upload_id} is not pending.")
+        file_part = parse_multipart_file(self.headers.get('Content-Type', ''), body, 'file')
+        if file_part is None:
+            raise validation_error("body.file should be defined.")
+        size = len(file_part)
+        if size > MAX_UPLOAD_BYTES:
+            raise validation_error(f"File size {size} exceeds the single-part upload limit of {MAX_UPLOAD_BYTES} bytes.")
+        with state.lock:
+            state.file_uploads[upload_id] = 'uploaded'
+        state.add('bytes_uploaded', size)
+        self.send_json(200, {"object": "file_upload", "id": upload_id, "status": "uploaded", "content_length": size})
+
+def parse_multipart_file(content_type, body, field_name):
+    """Content of a multipart/form-data file field, None if missing"""
+    if not content_type.startswith('multipart/form-data'):
+        return None
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body)
+    for part in message.iter_parts():
+        if part.get_param('name', header='content-disposition') == field_name and part.get_filename():
+            return part.get_payload(decode=True)
+    return None
+
+def route_args(path):
+    """Ids in the path (segments after a collection name), passed to the handler"""
+    parts = path.strip('/').split('/')[1:]
+    return [part for i, part in enumerate(parts) if i % 2 == 1]
+
+class MockNotionServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, rate=3.0, burst=10, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0,
+                 error_statuses=(500, 502, 503), verbose=False, database_properties=None):
+        super().__init__(address, MockNotionHandler)
+        self.state = MockNotionState(database_properties)
+        self.bucket = TokenBucket(rate, burst)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_statuses = list(error_statuses)
+        self.verbose = verbose
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+def start_server(port=0, **options):
+    """Start the mock server on a background thread (port 0 picks a free port), returns the server"""
+    server = MockNotionServer(('127.0.0.1', port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the Notion API endpoints used by the importer")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--rate', type=float, default=3.0, help="Average requests per second (0 disables rate limiting)")
+    parser.add_argument('--burst', type=int, default=10, help="Requests allowed in a burst above the average rate")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Added latency per request")
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help="Random +/- variation of the latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with an injected 5xx error")
+    parser.add_argument('--error-statuses', default='500,502,503', help="Comma-separated statuses used for injected errors")
+    parser.add_argument('--seed', type=int, default=None, help="Random seed for latency jitter and error injection")
+    parser.add_argument('--verbose', action='store_true', help="Log every request")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    server = MockNotionServer(('127.0.0.1', args.port), rate=args.rate, burst=args.burst, latency_ms=args.latency_ms,
+                              jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                              error_statuses=[int(s) for s in args.error_statuses.split(',') if s],
+                              verbose=args.verbose)
+    print(f"🧪 Mock Notion API listening on {server.base_url}")
+    print(f"   Rate limit: {args.rate} req/s (burst {args.burst}), latency {args.latency_ms}±{args.jitter_ms} ms, error rate {args.error_rate}")
+    print(f"   Run the importer with NOTION_API_BASE_URL={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        with server.state.lock:
+            print(f"\n📊 {json.dumps(server.state.stats, ensure_ascii=False)}")
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,23 @@ import os
 import mimetypes
 import sys
 import tempfile
+import hashlib
+import itertools
+import math
+import bisect
+import logging
+import threading
+import heapq
+import cProfile
+import pstats
+import tracemalloc
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+from urllib.parse import urlparse
 from tqdm import tqdm
 import re
 
@@ -68,70 +85,814 @@ def validate_config():
     
     return True
 
+def detect_database_properties(properties):
+    """根据数据库属性结构推断标题 / 时间 / 对话ID 属性名"""
+    # 查找各种类型的属性
+    title_property = None
+    created_time_property = None
+    updated_time_property = None
+    conversation_id_property = None
+    conversation_id_type = None
+    
+    for prop_name, prop_info in properties.items():
+        prop_type = prop_info.get('type')
+        prop_name_lower = prop_name.lower()
+        
+        if prop_type == 'title':
+            title_property = prop_name
+        elif prop_type in ['date', 'created_time']:
+            if 'created' in prop_name_lower or 'create' in prop_name_lower:
+                created_time_property = prop_name
+            elif 'updated' in prop_name_lower or 'update' in prop_name_lower or 'modified' in prop_name_lower:
+                updated_time_property = prop_name
+        elif prop_type in ['rich_text', 'number']:
+            if ('conversation' in prop_name_lower and 'id' in prop_name_lower) or prop_name_lower == 'conversation id':
+                conversation_id_property = prop_name
+                conversation_id_type = prop_type
+    
+    return {
+        'title_property': title_property or 'Title',
+        'created_time_property': created_time_property,
+        'updated_time_property': updated_time_property, 
+        'conversation_id_property': conversation_id_property,
+        'conversation_id_type': conversation_id_type,
+        'properties': properties
+    }
+
+def load_database_schema_cache():
+    """加载磁盘上的数据库结构缓存（database_id -> 缓存的检测结果）"""
+    if not os.path.exists(DATABASE_SCHEMA_CACHE_FILE):
+        return {}
+    try:
+        with open(DATABASE_SCHEMA_CACHE_FILE, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except Exception as e:
+        print(f"警告: 无法读取数据库结构缓存: {e}")
+        return {}
+
+def save_database_schema_cache(cache):
+    """写入数据库结构缓存（先写临时文件再替换，并行运行时也安全）"""
+    try:
+        cache_dir = os.path.dirname(os.path.abspath(DATABASE_SCHEMA_CACHE_FILE))
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, DATABASE_SCHEMA_CACHE_FILE)
+    except Exception as e:
+        print(f"警告: 无法写入数据库结构缓存: {e}")
+
+def apply_database_property_overrides(db_info):
+    """应用覆盖文件中显式指定的属性名，优先于自动检测"""
+    if not os.path.exists(DATABASE_PROPERTY_OVERRIDES_FILE):
+        return db_info
+    try:
+        with open(DATABASE_PROPERTY_OVERRIDES_FILE, 'r', encoding='utf-8') as f:
+            overrides = json.load(f)
+    except Exception as e:
+        print(f"警告: 无法读取属性覆盖文件: {e}")
+        return db_info
+
+    db_info = dict(db_info)
+    for key in ('title_property', 'created_time_property', 'updated_time_property', 'conversation_id_property', 'conversation_id_type'):
+        if key in overrides:
+            db_info[key] = overrides[key]
+
+    # 覆盖了对话ID属性但未指定类型：从数据库结构中取类型
+    if 'conversation_id_property' in overrides and 'conversation_id_type' not in overrides:
+        prop_info = db_info.get('properties', {}).get(db_info['conversation_id_property'] or '', {})
+        db_info['conversation_id_type'] = prop_info.get('type')
+    return db_info
+
 def get_database_info(headers, database_id):
-    """获取数据库信息，检查属性结构"""
+    """获取数据库信息，检查属性结构（带磁盘结构缓存）"""
+    cache = load_database_schema_cache()
+    cached = cache.get(database_id)
+    force_refresh = os.getenv("REFRESH_DB_SCHEMA") == "1"
+
+    # 缓存仍然新鲜：完全跳过网络请求
+    if cached and not force_refresh and time.time() - cached.get('cached_at', 0) < DATABASE_SCHEMA_CACHE_TTL:
+        print("   📦 使用缓存的数据库结构")
+        return apply_database_property_overrides(cached['db_info'])
+
+    request_headers = dict(headers)
+    if cached and cached.get('etag') and not force_refresh:
+        request_headers['If-None-Match'] = cached['etag']
+
     try:
-        response = requests.get(
+        response = notion_request(
+            'GET',
             f"{NOTION_API_BASE_URL}/databases/{database_id}",
-            headers=headers,
+            headers=request_headers,
             timeout=30
         )
-        response.raise_for_status()
-        db_info = response.json()
-        
-        properties = db_info.get('properties', {})
-        
-        # 查找各种类型的属性
-        title_property = None
-        created_time_property = None
-        updated_time_property = None
-        conversation_id_property = None
-        conversation_id_type = None
-        
-        for prop_name, prop_info in properties.items():
-            prop_type = prop_info.get('type')
-            prop_name_lower = prop_name.lower()
-            
-            if prop_type == 'title':
-                title_property = prop_name
-            elif prop_type in ['date', 'created_time']:
-                if 'created' in prop_name_lower or 'create' in prop_name_lower:
-                    created_time_property = prop_name
-                elif 'updated' in prop_name_lower or 'update' in prop_name_lower or 'modified' in prop_name_lower:
-                    updated_time_property = prop_name
-            elif prop_type in ['rich_text', 'number']:
-                if ('conversation' in prop_name_lower and 'id' in prop_name_lower) or prop_name_lower == 'conversation id':
-                    conversation_id_property = prop_name
-                    conversation_id_type = prop_type
-        
-        return {
-            'title_property': title_property or 'Title',
-            'created_time_property': created_time_property,
-            'updated_time_property': updated_time_property, 
-            'conversation_id_property': conversation_id_property,
-            'conversation_id_type': conversation_id_type,
-            'properties': properties
+        if response.status_code == 304 and cached:
+            db_info = cached['db_info']
+            etag = cached.get('etag')
+            last_edited_time = cached.get('last_edited_time')
+        else:
+            response.raise_for_status()
+            db_data = response.json()
+            etag = response.headers.get('ETag')
+            last_edited_time = db_data.get('last_edited_time')
+
+            # 结构未变化：复用之前的检测结果
+            if cached and not force_refresh and last_edited_time and cached.get('last_edited_time') == last_edited_time:
+                db_info = cached['db_info']
+            else:
+                db_info = detect_database_properties(db_data.get('properties', {}))
+
+        cache[database_id] = {
+            'etag': etag,
+            'last_edited_time': last_edited_time,
+            'cached_at': time.time(),
+            'db_info': db_info
         }
+        save_database_schema_cache(cache)
+        return apply_database_property_overrides(db_info)
         
     except requests.exceptions.RequestException as e:
         error_msg = e.response.text if e.response else str(e)
         print(f"⚠️ 警告: 无法获取数据库信息: {error_msg}")
-        return {
+        if cached:
+            print("   📦 回退到缓存的数据库结构")
+            return apply_database_property_overrides(cached['db_info'])
+        return apply_database_property_overrides({
             'title_property': 'Title',
             'created_time_property': None,
             'updated_time_property': None,
             'conversation_id_property': None,
             'properties': {}
-        }
+        })
 
 # --- 全局变量 ---
 CONVERSATIONS_JSON_PATH = os.path.join(CHATGPT_EXPORT_PATH, 'conversations.json')
-NOTION_API_BASE_URL = "https://api.notion.com/v1"
+NOTION_API_BASE_URL = os.getenv("NOTION_API_BASE_URL") or "https://api.notion.com/v1"  # 可用环境变量覆盖，例如指向本地 benchmarks/mock_notion_server.py 离线运行
 PROCESSED_LOG_FILE = 'processed_ids.log'
+CONVERSATION_ID_INDEX_FILE = 'conversation_id_index.log'  # 数字类型ID属性已分配的编号：数字 -> 原始对话ID（跨运行解决哈希冲突）
+CONVERSATION_ID_NUMBER_DIGITS = 15  # Notion 数字为双精度浮点，15 位以内可精确表示
+DATABASE_SCHEMA_CACHE_FILE = 'database_schema_cache.json'  # 检测到的数据库结构，跨运行/并行进程复用
+DATABASE_SCHEMA_CACHE_TTL = 24 * 3600  # 在此时间（秒）内跳过数据库请求；REFRESH_DB_SCHEMA=1 强制刷新
+DATABASE_PROPERTY_OVERRIDES_FILE = 'database_property_overrides.json'  # 可选：显式指定属性名，如 {"title_property": "Name"}
 MAX_TEXT_LENGTH = 1000  # Notion文本块最大长度限制（减少以避免400错误）
-MAX_TRAVERSE_DEPTH = 1000  # 防止无限循环的最大遍历深度
 DEBUG_FIRST_FAILURE = True  # 调试模式：显示第一个失败请求的详细信息
 DEBUG_DETAILED_ERRORS = True  # 新增：详细错误分析（正式运行时关闭，调试时开启）
+CREATE_PAGE_WITH_CHILDREN = True  # 创建页面时携带第一批块（校验失败时回退为空页面+追加）
+INITIAL_CHILDREN_LIMIT = 100  # Notion 单次请求最多 100 个 children
+APPEND_BATCH_SIZE = 20  # 每个追加批次的块数
+BATCH_PAYLOAD_LIMIT = 50000  # 每批次块 JSON 总字符数上限
+QUARANTINE_FILE = 'quarantined_blocks.jsonl'  # 二分回退中定位出的失败块
+COMPACT_BLOCKS = True  # 将同一说话者的连续段落打包为一个块（多个 rich_text 项）
+NOTION_MAX_RICH_TEXT_ITEMS = 100  # Notion 限制：每个块最多 100 个 rich_text 项
+COMPACT_BLOCK_MAX_CHARS = 12000  # 打包块的最大字符数（保证每批次能容纳多个块）
+RENDER_MARKDOWN = True  # 助手回复按 Markdown 渲染为原生 Notion 标题 / 列表 / 引用 / 代码块
+TEXT_BLOCK_TYPES = ('paragraph', 'heading_1', 'heading_2', 'heading_3', 'bulleted_list_item', 'numbered_list_item', 'quote')  # 只含 rich_text 的块类型
+MARKDOWN_FENCE_PATTERN = re.compile(r'^ {0,3}(`{3,}|~{3,})\s*([^\s`]*)')  # 代码围栏，捕获围栏和语言
+MARKDOWN_HEADING_PATTERN = re.compile(r'^ {0,3}(#{1,6})\s+(.*)$')
+MARKDOWN_DIVIDER_PATTERN = re.compile(r'^ {0,3}([-*_])(?:\s*\1){2,}\s*$')
+MARKDOWN_BULLET_PATTERN = re.compile(r'^\s*[-*+]\s+(.*)$')
+MARKDOWN_NUMBERED_PATTERN = re.compile(r'^\s*\d{1,9}[.)]\s+(.*)$')
+MARKDOWN_QUOTE_PATTERN = re.compile(r'^ {0,3}>\s?(.*)$')
+IMPORT_ALL_BRANCHES = False  # 同时导入重新生成/编辑产生的其他分支，放入折叠的 toggle 块（或环境变量 IMPORT_ALL_BRANCHES=1）
+IMPORT_CANVAS_DOCUMENTS = True  # 从 canmore 创建/更新消息重建 Canvas 文档最终版本，作为 toggle 块导入
+UPLOAD_WORKERS = 4  # 并行上传文件的线程数（每个对话的上传计划在构建页面前执行）
+MAX_UPLOAD_FILE_SIZE = 20 * 1024 * 1024  # Notion 单次上传限制 (20 MB)，更大的文件直接跳过
+PERFORMANCE_REPORT_FILE = 'performance_report.json'  # 运行结束时写入的各阶段耗时报告
+NOTION_MAX_RETRIES = 5  # 被限流 (429) 的请求最多重试次数，每次等待 Retry-After 秒
+HTTP_TRACE_FILE = 'http_trace.jsonl'  # 每个 Notion 请求一行 JSON（端点、状态码、字节数、延迟、重试）；'' 表示不写文件
+HTTP_TRACE_MAX_BYTES = 10 * 1024 * 1024  # 跟踪文件达到此大小后轮转 (http_trace.jsonl.1, .2, ...)
+HTTP_TRACE_BACKUPS = 3  # 保留的轮转跟踪文件数
+HTTP_LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)  # 延迟直方图各桶上限 (毫秒)
+PROFILE_MODE = ''  # 性能剖析: 'cpu' (cProfile) / 'mem' (tracemalloc)，或使用环境变量 PROFILE=cpu|mem
+PROFILE_CONVERSATION_ID = ''  # 只剖析这一个对话 ID（或使用环境变量 PROFILE_CONVERSATION_ID）
+PROFILE_MEM_INTERVAL = 100  # PROFILE=mem: 每处理 N 个对话做一次内存快照
+PROFILE_TOP_N = 20  # 剖析报告中列出的函数 / 内存分配位置数
+PROFILE_OUTPUT_PREFIX = 'profile'  # 输出文件: profile_cpu.pstats、profile_cpu.collapsed（火焰图输入）、profile_mem.txt
+METRICS_PORT = 0  # 导入期间在 http://127.0.0.1:PORT/metrics 提供 Prometheus 指标（0 表示关闭，或使用环境变量 METRICS_PORT）
+METRICS_TEXTFILE = ''  # 导入期间定期重写的 Prometheus textfile collector 文件，如 /var/lib/node_exporter/textfile/chatgpt_notion.prom（或使用环境变量 METRICS_TEXTFILE）
+METRICS_TEXTFILE_INTERVAL = 15  # textfile 重写间隔（秒）
+METRICS_RATE_WINDOW = 60  # 计算实际请求速率的时间窗口（秒）
+PLAN_REQUEST_RATE = 3  # --plan: 估算所用的持续请求速率（请求/秒，Notion 的平均限额）
+PLAN_REQUEST_LATENCY = 0.3  # --plan: 假定的单次请求延迟（秒）
+PLAN_TOP_N = 10  # --plan: 列出的最耗时对话数
+PLAN_REPORT_FILE = 'import_plan.json'  # --plan: 每个对话的请求数 / 字节数（'' 表示不写文件）
+CONVERSATION_METRICS_FILE = 'conversation_metrics.jsonl'  # 每个导入的对话一行指标（块、请求、重试、回退、字节、耗时）；'' 表示不写文件
+CONVERSATION_REPORT_FILE = 'conversation_report.json'  # 最慢 / 问题最多的对话及其指标；'' 表示不写文件
+CONVERSATION_REPORT_TOP_N = 10  # 每个排行列出的对话数
+MESSAGE_SUMMARY_CHARS = 300  # summarize 动作保留的开头字符数（规则中的 max_chars 优先）
+MESSAGE_SUMMARY_LINKS = 10  # summarize 动作最多保留的来源（标题 + 链接）数
+MESSAGE_FILTER_POLICY_FILE = 'message_filter_policy.json'  # 可选：替代 MESSAGE_FILTER_POLICY 的规则列表（[] 表示不过滤）
+# 消息过滤策略：按顺序匹配，第一条命中的规则生效。匹配键：role / author_name / content_type（单个值或列表）、
+# metadata（必须为真的标记）、min_chars（文本长度下限）；动作：skip 跳过 / truncate 截断（max_chars）/ summarize 摘要
+# （保留来源标题 / 链接，没有时保留开头 max_chars 个字符，默认 MESSAGE_SUMMARY_CHARS）
+# 默认不过滤（所有消息照常导入）。示例策略（写入 message_filter_policy.json，或赋值给 MESSAGE_FILTER_POLICY）：
+# [
+#     {"metadata": "is_visually_hidden_from_conversation", "action": "skip"},
+#     {"role": "tool", "author_name": ["browser", "web", "web.run"], "min_chars": 500, "action": "summarize"},
+#     {"content_type": "tether_browsing_display", "min_chars": 500, "action": "summarize"},
+#     {"content_type": ["tether_quote", "execution_output"], "min_chars": 3000, "action": "truncate", "max_chars": 2000}
+# ]
+MESSAGE_FILTER_POLICY = []
+
+# 性能报告统计的运行阶段 -> 每次耗时（秒）；block_build / cleaning 每个对话（或分支段落）记录一次，上传线程并行，各阶段可能重叠
+PERFORMANCE_PHASES = ('json_load', 'block_build', 'cleaning', 'file_lookup', 'upload', 'page_create', 'append', 'sleep', 'rate_limit', 'retry')
+PHASE_TIMINGS = {phase: array('d') for phase in PERFORMANCE_PHASES}
+PHASE_FRAMES = threading.local()  # 当前线程正在计时的阶段：每层 [开始时间, 需扣除的秒数]
+
+def open_phase():
+    """开始为当前线程的一个阶段计时，返回其计时帧"""
+    frame = [time.perf_counter(), 0.0]
+    PHASE_FRAMES.__dict__.setdefault('stack', []).append(frame)
+    return frame
+
+def close_phase(phase, frame):
+    """记录 open_phase 开始的阶段；rate_limit 等待单独记录，并从外层阶段中扣除（报告中不重复计算）"""
+    elapsed = time.perf_counter() - frame[0]
+    stack = PHASE_FRAMES.stack
+    stack.pop()
+    if phase == 'rate_limit':
+        for outer in stack:
+            outer[1] += elapsed
+    PHASE_TIMINGS[phase].append(elapsed - frame[1])
+
+@contextmanager
+def timed_phase(phase):
+    """把 with 块的耗时记录到指定运行阶段"""
+    frame = open_phase()
+    try:
+        yield
+    finally:
+        close_phase(phase, frame)
+
+def throttle(seconds, phase='sleep'):
+    """等待（time.sleep）：请求之间的间隔记录为 sleep 阶段，429 的 Retry-After 等待记录为 rate_limit 阶段"""
+    with timed_phase(phase):
+        time.sleep(seconds)
+
+def percentile(ordered, fraction):
+    """已排序数据的百分位数（最近秩法）"""
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def summarize_phase_timings():
+    """各阶段的次数、总耗时、均值和 p50/p95/p99/最大值（秒）"""
+    summary = {}
+    for phase, samples in PHASE_TIMINGS.items():
+        if not samples:
+            continue
+        ordered = sorted(samples)
+        total = sum(ordered)
+        summary[phase] = {
+            "count": len(ordered),
+            "total_s": round(total, 4),
+            "mean_s": round(total / len(ordered), 6),
+            "p50_s": round(percentile(ordered, 0.50), 6),
+            "p95_s": round(percentile(ordered, 0.95), 6),
+            "p99_s": round(percentile(ordered, 0.99), 6),
+            "max_s": round(ordered[-1], 6)
+        }
+    return summary
+
+def print_performance_report(wall_time, success_count, fail_count):
+    """输出各阶段耗时分布，并写入 PERFORMANCE_REPORT_FILE"""
+    summary = summarize_phase_timings()
+    if not summary:
+        return
+    print(f"⏱️ 阶段耗时 (总耗时 {wall_time:.1f}s):")
+    print(f"   {'阶段':<10} {'次数':>6} {'总计 s':>8} {'占比':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for phase, stats in sorted(summary.items(), key=lambda item: item[1]['total_s'], reverse=True):
+        print(f"   {phase:<12} {stats['count']:>8} {stats['total_s']:>10.1f} {stats['total_s'] / max(wall_time, 1e-9):>6.0%} "
+              f"{stats['p50_s'] * 1000:>9.1f} {stats['p95_s'] * 1000:>9.1f} {stats['p99_s'] * 1000:>9.1f}")
+
+    report = {
+        "generated_at": datetime.datetime.now().isoformat(),
+        "wall_time_s": round(wall_time, 3),
+        "conversations": {"succeeded": success_count, "failed": fail_count},
+        "phases": summary,
+        "content_types": CONTENT_HANDLER_STATS,
+        "message_filter": {**MESSAGE_FILTER_STATS, "requests_saved": round(get_filter_requests_saved(), 1)},
+        "http": summarize_http_trace()
+    }
+    try:
+        with open(PERFORMANCE_REPORT_FILE, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"   📄 性能报告已写入 {PERFORMANCE_REPORT_FILE}")
+    except Exception as e:
+        print(f"警告: 无法写入性能报告: {e}")
+
+# 所有请求共用一个会话（复用连接），每次调用都被跟踪：端点 -> 计数、延迟样本、直方图桶
+NOTION_SESSION = requests.Session()
+HTTP_TRACE_STATS = {}
+HTTP_RECENT_REQUESTS = deque()  # 最近 METRICS_RATE_WINDOW 秒内每次请求（含重试）的完成时间
+HTTP_TRACE_LOCK = threading.Lock()  # 上传线程并行记录
+HTTP_TRACE_LOGGER = None
+UUID_SEGMENT_PATTERN = re.compile(r'[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}')
+
+def get_http_trace_logger():
+    """按大小轮转的 JSONL 跟踪日志（第一次请求时创建，在 HTTP_TRACE_LOCK 下创建，上传线程不会重复添加 handler）"""
+    global HTTP_TRACE_LOGGER
+    if HTTP_TRACE_LOGGER is None:
+        with HTTP_TRACE_LOCK:
+            if HTTP_TRACE_LOGGER is None:
+                logger = logging.getLogger('notion_http_trace')
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                if HTTP_TRACE_FILE and not logger.handlers:
+                    handler = RotatingFileHandler(HTTP_TRACE_FILE, maxBytes=HTTP_TRACE_MAX_BYTES, backupCount=HTTP_TRACE_BACKUPS, encoding='utf-8')
+                    handler.setFormatter(logging.Formatter('%(message)s'))
+                    logger.addHandler(handler)
+                HTTP_TRACE_LOGGER = logger
+    return HTTP_TRACE_LOGGER
+
+def get_endpoint(method, url):
+    """用于统计的端点名：方法 + 相对 API 的路径，ID 替换为 {id}"""
+    path = url[len(NOTION_API_BASE_URL):] if url.startswith(NOTION_API_BASE_URL) else urlparse(url).path
+    return f"{method} {UUID_SEGMENT_PATTERN.sub('{id}', path.split('?', 1)[0])}"
+
+def get_body_size(request_kwargs):
+    """请求体字节数（json 参数、str / bytes、流式文件对象）"""
+    if request_kwargs.get('json') is not None:
+        return len(json.dumps(request_kwargs['json']).encode('utf-8'))
+    body = request_kwargs.get('data')
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode('utf-8'))
+    if hasattr(body, '__len__'):
+        return len(body)
+    try:
+        return os.fstat(body.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+def get_retry_after(response, retries):
+    """429 后重试前的等待时间：Retry-After 头（秒），否则指数退避"""
+    try:
+        return max(float(response.headers.get('Retry-After')), 0.0)
+    except (TypeError, ValueError):
+        return min(2 ** retries, 30)
+
+def rewind_body(body):
+    """重发前把流式请求体（文件上传）倒回开头；无法倒回时返回 False"""
+    if not hasattr(body, 'read'):
+        return True
+    try:
+        if hasattr(body, 'rewind'):
+            body.rewind()
+        else:
+            body.seek(0)
+        return True
+    except (AttributeError, OSError, ValueError):
+        return False
+
+def notion_request(method, url, **request_kwargs):
+    """通过共享会话发送请求；429 按 Retry-After 等待后重试（最多 NOTION_MAX_RETRIES 次），每次调用都记录跟踪"""
+    endpoint = get_endpoint(method, url)
+    body_size = get_body_size(request_kwargs)
+    response = None
+    error = None
+    latency = 0.0
+    retries = 0
+    rate_limit_wait = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                response = NOTION_SESSION.request(method, url, **request_kwargs)
+            finally:
+                latency += time.perf_counter() - start
+            if response.status_code != 429 or retries >= NOTION_MAX_RETRIES or not rewind_body(request_kwargs.get('data')):
+                return response
+            wait = get_retry_after(response, retries)
+            tqdm.write(f"   ⏳ 被限流 ({endpoint})，{wait:.1f} 秒后重试")
+            throttle(wait, 'rate_limit')
+            rate_limit_wait += wait
+            retries += 1
+    except requests.exceptions.RequestException as e:
+        error = str(e)
+        raise
+    finally:
+        record_http_trace(endpoint, response, error, latency, retries, rate_limit_wait, body_size * (retries + 1))
+
+def prune_recent_requests(now):
+    """移除早于 METRICS_RATE_WINDOW 的请求完成时间（调用方持有 HTTP_TRACE_LOCK）"""
+    while HTTP_RECENT_REQUESTS and HTTP_RECENT_REQUESTS[0] < now - METRICS_RATE_WINDOW:
+        HTTP_RECENT_REQUESTS.popleft()
+
+def record_http_trace(endpoint, response, error, latency, retries, rate_limit_wait, bytes_sent):
+    """写入一行跟踪记录，并累加端点统计"""
+    status = response.status_code if response is not None else None
+    bytes_received = len(response.content) if response is not None else 0
+    latency_ms = latency * 1000
+    record = {
+        "time": datetime.datetime.now().isoformat(),
+        "endpoint": endpoint,
+        "status": status,
+        "bytes_sent": bytes_sent,
+        "bytes_received": bytes_received,
+        "latency_ms": round(latency_ms, 1),
+        "retries": retries,
+        "rate_limit_wait_s": round(rate_limit_wait, 3)
+    }
+    if error:
+        record["error"] = error[:500]
+    get_http_trace_logger().info(json.dumps(record, ensure_ascii=False))
+
+    with HTTP_TRACE_LOCK:
+        stats = HTTP_TRACE_STATS.get(endpoint)
+        if stats is None:
+            stats = HTTP_TRACE_STATS[endpoint] = {
+                "count": 0, "errors": 0, "rate_limited": 0, "retries": 0, "rate_limit_wait_s": 0.0,
+                "bytes_sent": 0, "bytes_received": 0, "latencies": array('d'), "buckets": [0] * (len(HTTP_LATENCY_BUCKETS_MS) + 1)
+            }
+        stats["count"] += 1
+        stats["errors"] += status is None or status >= 400
+        stats["rate_limited"] += retries + (status == 429)
+        stats["retries"] += retries
+        stats["rate_limit_wait_s"] += rate_limit_wait
+        stats["bytes_sent"] += bytes_sent
+        stats["bytes_received"] += bytes_received
+        stats["latencies"].append(latency_ms)
+        stats["buckets"][bisect.bisect_left(HTTP_LATENCY_BUCKETS_MS, latency_ms)] += 1
+        count_conversation_event('requests', retries + 1)
+        count_conversation_event('retries', retries)
+        count_conversation_event('bytes_sent', bytes_sent)
+        now = time.monotonic()
+        HTTP_RECENT_REQUESTS.extend([now] * (retries + 1))
+        prune_recent_requests(now)
+
+def summarize_http_trace():
+    """按端点汇总：次数、错误、429、字节数、延迟 p50/p95/p99（毫秒）和直方图"""
+    summary = {}
+    with HTTP_TRACE_LOCK:
+        for endpoint, stats in HTTP_TRACE_STATS.items():
+            ordered = sorted(stats["latencies"])
+            bucket_labels = [f"le_{bound}ms" for bound in HTTP_LATENCY_BUCKETS_MS] + ["inf"]
+            summary[endpoint] = {
+                **{key: value for key, value in stats.items() if key not in ("latencies", "buckets")},
+                "p50_ms": round(percentile(ordered, 0.50), 1),
+                "p95_ms": round(percentile(ordered, 0.95), 1),
+                "p99_ms": round(percentile(ordered, 0.99), 1),
+                "histogram": dict(zip(bucket_labels, stats["buckets"]))
+            }
+    return summary
+
+def print_http_trace_summary():
+    """输出每个端点的请求统计和延迟直方图"""
+    summary = summarize_http_trace()
+    if not summary:
+        return
+    print("🌐 各端点 HTTP 请求:")
+    for endpoint, stats in sorted(summary.items(), key=lambda item: item[1]['count'], reverse=True):
+        print(f"   {endpoint}: {stats['count']} 次, 错误 {stats['errors']}, 429 {stats['rate_limited']} (等待 {stats['rate_limit_wait_s']:.1f}s), "
+              f"发送 {stats['bytes_sent'] / 1048576:.2f} MB, 接收 {stats['bytes_received'] / 1048576:.2f} MB, "
+              f"p50/p95/p99 {stats['p50_ms']:.0f}/{stats['p95_ms']:.0f}/{stats['p99_ms']:.0f} ms")
+        print("      " + " | ".join(f"{label}: {count}" for label, count in stats['histogram'].items() if count))
+    if HTTP_TRACE_FILE:
+        print(f"   📄 请求跟踪: {HTTP_TRACE_FILE}")
+
+# 性能剖析状态（由 run_profiled 设置；直接调用 main() 时所有钩子都不做任何事）
+PROFILE_STATE = {"mode": None, "conversation_id": None, "profiler": None, "previous_snapshot": None, "conversations": 0, "report": []}
+
+def get_profile_settings():
+    """(模式, 对话 ID)，配置优先于环境变量"""
+    mode = (PROFILE_MODE or os.getenv("PROFILE") or '').strip().lower()
+    return mode, PROFILE_CONVERSATION_ID or os.getenv("PROFILE_CONVERSATION_ID") or None
+
+def run_profiled(func):
+    """在 PROFILE 选择的剖析器下运行 func (main)，结束时（包括 sys.exit / Ctrl+C）写出报告"""
+    mode, conversation_id = get_profile_settings()
+    if mode not in ('cpu', 'mem'):
+        if mode:
+            print(f"⚠️ 未知的 PROFILE 模式 '{mode}'，可选 cpu 或 mem")
+        return func()
+
+    PROFILE_STATE.update(mode=mode, conversation_id=conversation_id)
+    scope = f"对话 {conversation_id}" if conversation_id else "整个导入"
+    print(f"🔬 性能剖析已启用: {mode}（{scope}）")
+    if mode == 'cpu':
+        # cProfile 只记录主线程，上传线程池中的工作不在剖析结果中
+        PROFILE_STATE['profiler'] = cProfile.Profile()
+        if not conversation_id:
+            PROFILE_STATE['profiler'].enable()
+    else:
+        tracemalloc.start()
+    try:
+        return func()
+    finally:
+        if mode == 'cpu':
+            PROFILE_STATE['profiler'].disable()
+            write_cpu_profile(PROFILE_STATE['profiler'])
+        else:
+            if not conversation_id:
+                take_memory_snapshot("结束")
+            write_memory_report()
+            tracemalloc.stop()
+        PROFILE_STATE.update(mode=None, profiler=None, previous_snapshot=None)
+
+def profile_checkpoint(label):
+    """PROFILE=mem: 在导入的阶段节点做内存快照（单对话模式下只在该对话前后做快照）"""
+    if PROFILE_STATE['mode'] == 'mem' and not PROFILE_STATE['conversation_id']:
+        take_memory_snapshot(label)
+
+def profile_conversation_start(conversation_id):
+    """单对话模式: 开始剖析目标对话"""
+    if not PROFILE_STATE['mode'] or conversation_id != PROFILE_STATE['conversation_id']:
+        return
+    if PROFILE_STATE['mode'] == 'cpu':
+        PROFILE_STATE['profiler'].enable()
+    else:
+        take_memory_snapshot(f"对话 {conversation_id} 之前")
+
+def profile_conversation_end(conversation_id):
+    """单对话模式: 停止剖析目标对话；否则每 PROFILE_MEM_INTERVAL 个对话做一次内存快照"""
+    mode = PROFILE_STATE['mode']
+    if not mode:
+        return
+    if PROFILE_STATE['conversation_id']:
+        if conversation_id == PROFILE_STATE['conversation_id']:
+            if mode == 'cpu':
+                PROFILE_STATE['profiler'].disable()
+            else:
+                take_memory_snapshot(f"对话 {conversation_id} 之后")
+        return
+    PROFILE_STATE['conversations'] += 1
+    if mode == 'mem' and PROFILE_STATE['conversations'] % PROFILE_MEM_INTERVAL == 0:
+        take_memory_snapshot(f"{PROFILE_STATE['conversations']} 个对话")
+
+def format_trace_frame(stat):
+    frame = stat.traceback[0]
+    return f"{frame.filename}:{frame.lineno}"
+
+def take_memory_snapshot(label):
+    """tracemalloc 快照: 当前 / 峰值内存、最大的分配位置以及相对上一个快照的增长"""
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"=== {label}: 当前 {current / 1048576:.1f} MiB, 峰值 {peak / 1048576:.1f} MiB", "最大的分配位置:"]
+    for stat in snapshot.statistics('lineno')[:PROFILE_TOP_N]:
+        lines.append(f"  {stat.size / 1024:10.1f} KiB {stat.count:9} 块  {format_trace_frame(stat)}")
+    previous = PROFILE_STATE['previous_snapshot']
+    if previous is not None:
+        lines.append("相对上一个快照的增长:")
+        for stat in snapshot.compare_to(previous, 'lineno')[:PROFILE_TOP_N]:
+            lines.append(f"  {stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+9} 块  {format_trace_frame(stat)}")
+    PROFILE_STATE['previous_snapshot'] = snapshot
+    PROFILE_STATE['report'].append(lines)
+    tqdm.write(f"   🧠 内存快照（{label}）: {current / 1048576:.1f} MiB（峰值 {peak / 1048576:.1f} MiB）")
+
+def write_memory_report():
+    """写出所有内存快照，并输出最后一个快照"""
+    report = PROFILE_STATE['report']
+    if not report:
+        print("⚠️ 没有内存快照（PROFILE_CONVERSATION_ID 指定的对话未被处理？）")
+        return
+    path = f"{PROFILE_OUTPUT_PREFIX}_mem.txt"
+    with open(path, 'w', encoding='utf-8') as f:
+        for lines in report:
+            f.write("\n".join(lines) + "\n\n")
+    print("\n" + "\n".join(report[-1]))
+    print(f"🔬 内存剖析报告（{len(report)} 个快照）: {path}")
+
+def function_label(func):
+    """pstats 函数键 (文件, 行号, 名称) -> 火焰图中的帧名"""
+    filename, lineno, name = func
+    return f"{os.path.basename(filename)}:{lineno}({name})" if lineno else name
+
+def iter_collapsed_stacks(raw_stats, max_depth=64):
+    """由 cProfile 调用图重建折叠栈（flamegraph.pl / speedscope 格式），单位微秒。
+    cProfile 只记录调用边，因此函数的时间按各调用路径所占的累计时间比例分摊"""
+    callees = {}
+    for func, (_cc, _nc, _tt, _ct, callers) in raw_stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    pending = [(func, (function_label(func),), 1.0) for func, entry in raw_stats.items() if not entry[4]]
+    while pending:
+        func, path, share = pending.pop()
+        self_time = int(raw_stats[func][2] * share * 1e6)
+        if self_time > 0:
+            yield ";".join(path), self_time
+        if len(path) >= max_depth:
+            continue
+        for callee, edge_time in callees.get(func, ()):
+            callee_time = raw_stats[callee][3]
+            label = function_label(callee)
+            # 递归调用已计入路径上的第一帧；小于 10µs 的路径不再展开
+            if not callee_time or label in path or edge_time * share < 1e-5:
+                continue
+            pending.append((callee, path + (label,), share * edge_time / callee_time))
+
+def write_cpu_profile(profiler):
+    """写出 pstats 文件和火焰图折叠栈，并输出累计时间最高的函数"""
+    stats = pstats.Stats(profiler)
+    if not stats.stats:
+        print("⚠️ 没有 CPU 剖析数据（PROFILE_CONVERSATION_ID 指定的对话未被处理？）")
+        return
+    stats_path = f"{PROFILE_OUTPUT_PREFIX}_cpu.pstats"
+    collapsed_path = f"{PROFILE_OUTPUT_PREFIX}_cpu.collapsed"
+    stats.dump_stats(stats_path)
+    with open(collapsed_path, 'w', encoding='utf-8') as f:
+        for stack, microseconds in iter_collapsed_stacks(stats.stats):
+            f.write(f"{stack} {microseconds}\n")
+    print(f"\n🔬 CPU 剖析: {stats_path}（pstats / snakeviz），{collapsed_path}（flamegraph.pl / speedscope）")
+    stats.sort_stats('cumulative').print_stats(PROFILE_TOP_N)
+
+# 运行指标（Prometheus 格式）：HTTP 指标来自 HTTP_TRACE_STATS，其余由导入流程在主线程中更新（upload_bytes 由上传线程在 HTTP_TRACE_LOCK 下累加）
+RUN_METRICS = {"conversations_success": 0, "conversations_failed": 0, "conversations_pending": 0, "blocks_appended": 0, "uploads_pending": 0,
+               "upload_bytes": 0}
+METRICS_STATE = {"server": None, "writer": None, "stop": None, "textfile": None}
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """GET /metrics -> 当前指标"""
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # 不打乱进度条
+
+def format_metric_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+def append_metric(lines, name, metric_type, help_text, samples):
+    """samples: [(后缀, 标签, 值)]"""
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {metric_type}")
+    for suffix, labels, value in samples:
+        lines.append(f"{name}{suffix}{format_metric_labels(labels)} {value}")
+
+def render_metrics():
+    """当前运行指标，Prometheus 文本格式"""
+    with HTTP_TRACE_LOCK:
+        http_stats = {endpoint: {**stats, "latency_sum_s": sum(stats["latencies"]) / 1000, "buckets": list(stats["buckets"])}
+                      for endpoint, stats in HTTP_TRACE_STATS.items()}
+        # 没有新请求时也要移除窗口外的记录，否则速率停留在最后的值
+        prune_recent_requests(time.monotonic())
+        recent_requests = len(HTTP_RECENT_REQUESTS)
+        upload_bytes = RUN_METRICS["upload_bytes"]
+
+    lines = []
+    append_metric(lines, "chatgpt_notion_conversations_total", "counter", "Conversations processed, by result",
+                  [("", {"result": "success"}, RUN_METRICS["conversations_success"]),
+                   ("", {"result": "failed"}, RUN_METRICS["conversations_failed"])])
+    append_metric(lines, "chatgpt_notion_conversations_pending", "gauge", "Conversations still to be processed in this run",
+                  [("", None, RUN_METRICS["conversations_pending"])])
+    append_metric(lines, "chatgpt_notion_blocks_appended_total", "counter", "Blocks written to Notion pages (page creation and append requests)",
+                  [("", None, RUN_METRICS["blocks_appended"])])
+    append_metric(lines, "chatgpt_notion_uploads_pending", "gauge", "Planned file uploads of the current conversation not finished yet",
+                  [("", None, RUN_METRICS["uploads_pending"])])
+    append_metric(lines, "chatgpt_notion_upload_bytes_total", "counter", "File bytes sent to Notion (multipart send and pre-signed PUT uploads)",
+                  [("", None, upload_bytes)])
+    append_metric(lines, "chatgpt_notion_request_rate", "gauge", f"Notion requests per second over the last {METRICS_RATE_WINDOW}s (retries included)",
+                  [("", None, round(recent_requests / METRICS_RATE_WINDOW, 3))])
+    append_metric(lines, "chatgpt_notion_requests_total", "counter", "Notion API requests by endpoint",
+                  [("", {"endpoint": endpoint}, stats["count"]) for endpoint, stats in http_stats.items()])
+    append_metric(lines, "chatgpt_notion_request_errors_total", "counter", "Notion API requests that failed or returned an error status",
+                  [("", {"endpoint": endpoint}, stats["errors"]) for endpoint, stats in http_stats.items()])
+    append_metric(lines, "chatgpt_notion_rate_limited_total", "counter", "429 responses by endpoint",
+                  [("", {"endpoint": endpoint}, stats["rate_limited"]) for endpoint, stats in http_stats.items()])
+    append_metric(lines, "chatgpt_notion_rate_limit_wait_seconds_total", "counter", "Time spent waiting for Retry-After",
+                  [("", {"endpoint": endpoint}, round(stats["rate_limit_wait_s"], 3)) for endpoint, stats in http_stats.items()])
+    append_metric(lines, "chatgpt_notion_request_bytes_sent_total", "counter", "Request body bytes by endpoint",
+                  [("", {"endpoint": endpoint}, stats["bytes_sent"]) for endpoint, stats in http_stats.items()])
+
+    samples = []
+    for endpoint, stats in http_stats.items():
+        cumulative = 0
+        for bound, count in zip(HTTP_LATENCY_BUCKETS_MS, stats["buckets"]):
+            cumulative += count
+            samples.append(("_bucket", {"endpoint": endpoint, "le": f"{bound / 1000:g}"}, cumulative))
+        samples.append(("_bucket", {"endpoint": endpoint, "le": "+Inf"}, stats["count"]))
+        samples.append(("_sum", {"endpoint": endpoint}, round(stats["latency_sum_s"], 6)))
+        samples.append(("_count", {"endpoint": endpoint}, stats["count"]))
+    append_metric(lines, "chatgpt_notion_request_duration_seconds", "histogram", "Notion API request latency (429 retries included)", samples)
+    return "\n".join(lines) + "\n"
+
+def write_metrics_textfile(path):
+    """原子地重写 textfile（先写临时文件再替换，collector 不会读到一半的文件）"""
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(render_metrics())
+        os.replace(temp_path, path)
+    except OSError as e:
+        tqdm.write(f"   ⚠️ 警告: 无法写入指标文件 {path}: {e}")
+
+def start_metrics_exporters(pending_conversations):
+    """按配置启动 HTTP 指标端点和 / 或 textfile 写入线程"""
+    RUN_METRICS["conversations_pending"] = pending_conversations
+    port = METRICS_PORT or int(os.getenv("METRICS_PORT") or 0)
+    textfile = METRICS_TEXTFILE or os.getenv("METRICS_TEXTFILE")
+    if port:
+        try:
+            server = ThreadingHTTPServer(('127.0.0.1', port), MetricsRequestHandler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+            METRICS_STATE["server"] = server
+            print(f"📈 Prometheus 指标: http://127.0.0.1:{port}/metrics")
+        except OSError as e:
+            print(f"⚠️ 警告: 无法启动指标端点（端口 {port}）: {e}")
+    if textfile:
+        stop = threading.Event()
+
+        def write_periodically():
+            while not stop.wait(METRICS_TEXTFILE_INTERVAL):
+                write_metrics_textfile(textfile)
+
+        write_metrics_textfile(textfile)
+        METRICS_STATE["writer"] = threading.Thread(target=write_periodically, name='metrics-textfile', daemon=True)
+        METRICS_STATE["writer"].start()
+        METRICS_STATE.update(stop=stop, textfile=textfile)
+        print(f"📈 Prometheus 指标文件: {textfile}（每 {METRICS_TEXTFILE_INTERVAL}s 更新）")
+
+def stop_metrics_exporters():
+    """停止指标端点和写入线程，textfile 写入最终值"""
+    if METRICS_STATE["server"]:
+        METRICS_STATE["server"].shutdown()
+        METRICS_STATE["server"].server_close()
+    if METRICS_STATE["stop"]:
+        METRICS_STATE["stop"].set()
+        METRICS_STATE["writer"].join()
+        write_metrics_textfile(METRICS_STATE["textfile"])
+    METRICS_STATE.update(server=None, writer=None, stop=None)
+
+# 每个对话的指标: current 为正在导入的对话的计数（导入循环之外为 None），slowest / troubled 为报告用的前 N 名堆
+CONVERSATION_COUNTERS = ('blocks_built', 'blocks_dropped', 'requests', 'retries', 'fallbacks', 'single_block_fallbacks', 'bytes_sent')
+CONVERSATION_METRICS = {"current": None, "slowest": [], "troubled": [], "sequence": 0}
+
+def start_conversation_metrics(conversation_id, title):
+    CONVERSATION_METRICS["current"] = {"id": conversation_id, "title": title, **dict.fromkeys(CONVERSATION_COUNTERS, 0), "start": time.perf_counter()}
+
+def count_conversation_event(key, amount=1):
+    """计入正在导入的对话（上传线程调用时由 HTTP_TRACE_LOCK 保护）"""
+    record = CONVERSATION_METRICS["current"]
+    if record is not None:
+        record[key] += amount
+
+def get_trouble_score(record):
+    """问题程度: 失败的对话排在最前，其次按回退、重试和丢弃的块"""
+    return (not record["success"], record["fallbacks"] + record["single_block_fallbacks"] + record["retries"] + record["blocks_dropped"])
+
+def finish_conversation_metrics(success):
+    """结束当前对话: 写出指标行，并保留最慢 / 问题最多的前 N 个"""
+    record = CONVERSATION_METRICS["current"]
+    CONVERSATION_METRICS["current"] = None
+    if record is None:
+        return
+    record["wall_s"] = round(time.perf_counter() - record.pop("start"), 3)
+    record["success"] = success
+    if CONVERSATION_METRICS_FILE:
+        try:
+            with open(CONVERSATION_METRICS_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({"time": datetime.datetime.now().isoformat(), **record}, ensure_ascii=False) + "\n")
+        except Exception as e:
+            tqdm.write(f"   ⚠️ 警告: 无法写入对话指标文件: {e}")
+
+    # 最小堆只保留前 N 名，内存与对话总数无关（序号避免比较字典）
+    CONVERSATION_METRICS["sequence"] += 1
+    for heap, score in (("slowest", record["wall_s"]), ("troubled", get_trouble_score(record))):
+        entry = (score, CONVERSATION_METRICS["sequence"], record)
+        if len(CONVERSATION_METRICS[heap]) < CONVERSATION_REPORT_TOP_N:
+            heapq.heappush(CONVERSATION_METRICS[heap], entry)
+        else:
+            heapq.heappushpop(CONVERSATION_METRICS[heap], entry)
+
+def format_conversation_metrics(record):
+    status = "🟢" if record["success"] else "🔴"
+    return (f"{status} {record['wall_s']:7.1f}s  {record['requests']:4} 请求  {record['retries']:3} 重试  "
+            f"{record['fallbacks']} 回退 / {record['single_block_fallbacks']} 单块  {record['blocks_built']:5} 块（丢弃 {record['blocks_dropped']}）  "
+            f"{record['bytes_sent'] / 1048576:6.2f} MB  {record['id']}  {record['title'][:40]}")
+
+def print_conversation_report():
+    """输出最慢和问题最多的对话（含 ID），并写出报告文件"""
+    slowest = [record for _, _, record in sorted(CONVERSATION_METRICS["slowest"], key=lambda entry: entry[:2], reverse=True)]
+    troubled = [record for score, _, record in sorted(CONVERSATION_METRICS["troubled"], key=lambda entry: entry[:2], reverse=True) if any(score)]
+    if not slowest:
+        return
+    print(f"🐢 最慢的 {len(slowest)} 个对话:")
+    for record in slowest:
+        print("   " + format_conversation_metrics(record))
+    if troubled:
+        print(f"🧯 问题最多的 {len(troubled)} 个对话（失败、回退、重试、丢弃的块）:")
+        for record in troubled:
+            print("   " + format_conversation_metrics(record))
+    if CONVERSATION_REPORT_FILE:
+        with open(CONVERSATION_REPORT_FILE, 'w', encoding='utf-8') as f:
+            json.dump({"slowest": slowest, "most_problematic": troubled}, f, ensure_ascii=False, indent=2)
+        print(f"   📄 对话报告: {CONVERSATION_REPORT_FILE}（全部对话的指标: {CONVERSATION_METRICS_FILE}）")
 
 # 新增：错误分析函数
 def analyze_request_payload(payload, title=""):
@@ -233,6 +994,53 @@ def log_processed_id(conversation_id):
     except Exception as e:
         print(f"警告: 无法写入日志文件: {e}")
 
+# 已编码对话ID的反向索引（延迟加载）
+CONVERSATION_ID_INDEX = None
+
+def load_conversation_id_index():
+    """加载数字编码对话ID的反向索引（数字 -> 对话ID）"""
+    index = {}
+    if not os.path.exists(CONVERSATION_ID_INDEX_FILE):
+        return index
+    try:
+        with open(CONVERSATION_ID_INDEX_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.strip().split('\t')
+                if len(parts) == 2 and parts[0].isdigit():
+                    index[int(parts[0])] = parts[1]
+    except Exception as e:
+        print(f"警告: 无法读取对话ID索引: {e}")
+    return index
+
+def encode_conversation_id_number(conversation_id):
+    """将对话ID编码为稳定的数字，用于数字类型的ID属性（每次运行结果相同）
+
+    稳定的值让用户可以在 Notion 中按该属性筛选同一对话的页面；导入器本身不查询已有页面，
+    已导入的对话通过 PROCESSED_LOG_FILE 跳过。
+    """
+    global CONVERSATION_ID_INDEX
+    if CONVERSATION_ID_INDEX is None:
+        CONVERSATION_ID_INDEX = load_conversation_id_index()
+
+    # 截断的 SHA-256；若与其他ID冲突，则加盐重新哈希直到找到空闲数字
+    salt = 0
+    while True:
+        seed = conversation_id if salt == 0 else f"{conversation_id}#{salt}"
+        digest = hashlib.sha256(seed.encode('utf-8')).hexdigest()
+        number_value = int(digest[:16], 16) % (10 ** CONVERSATION_ID_NUMBER_DIGITS)
+        owner = CONVERSATION_ID_INDEX.get(number_value)
+        if owner == conversation_id:
+            return number_value
+        if owner is None:
+            CONVERSATION_ID_INDEX[number_value] = conversation_id
+            try:
+                with open(CONVERSATION_ID_INDEX_FILE, 'a', encoding='utf-8') as f:
+                    f.write(f"{number_value}\t{conversation_id}\n")
+            except Exception as e:
+                print(f"警告: 无法写入对话ID索引: {e}")
+            return number_value
+        salt += 1
+
 def split_long_text(text, max_length=MAX_TEXT_LENGTH):
     """将长文本分割成符合Notion限制的块"""
     if len(text) <= max_length:
@@ -259,64 +1067,125 @@ def split_long_text(text, max_length=MAX_TEXT_LENGTH):
     
     return chunks
 
-def upload_file_to_notion(local_file_path, headers):
-    """上传文件到Notion，支持图片等附件 (增强多路径查找)"""
-
-    def find_local_file(path_or_name: str) -> str | None:
-        """在常见子目录(images/ dalle-generations/)中查找文件"""
-        if os.path.isabs(path_or_name) and os.path.exists(path_or_name):
-            return path_or_name
-
-        # 去除可能的前缀 "./"，并规范化路径
-        if path_or_name.startswith("./") or path_or_name.startswith(".\\"):
-            path_or_name = path_or_name[2:]
-
-        # 统一使用规范化后的名字做进一步处理
-        abs_path = os.path.join(CHATGPT_EXPORT_PATH, path_or_name)
-        if os.path.exists(abs_path):
-            return abs_path
-
-        # 常见子目录
-        basename_only = os.path.basename(path_or_name)
-        for sub in ["images", "assets", "dalle-generations", "dalle_generations"]:
-            candidate = os.path.join(CHATGPT_EXPORT_PATH, sub, basename_only)
+# 导出目录下的文件列表 (文件名, 完整路径)，每次运行只遍历一次
+EXPORT_FILE_INDEX = None
+
+def iter_export_files():
+    """导出目录下的所有文件 (文件名, 完整路径)，首次使用时遍历一次目录"""
+    global EXPORT_FILE_INDEX
+    if EXPORT_FILE_INDEX is None:
+        EXPORT_FILE_INDEX = [
+            (fname, os.path.join(root, fname))
+            for root, _dirs, files in os.walk(CHATGPT_EXPORT_PATH)
+            for fname in files
+        ]
+    return EXPORT_FILE_INDEX
+
+def find_local_file(path_or_name: str) -> str | None:
+    """在常见子目录(images/ dalle-generations/)中查找文件"""
+    if os.path.isabs(path_or_name) and os.path.exists(path_or_name):
+        return path_or_name
+
+    # 去除可能的前缀 "./"，并规范化路径
+    if path_or_name.startswith("./") or path_or_name.startswith(".\\"):
+        path_or_name = path_or_name[2:]
+
+    # 统一使用规范化后的名字做进一步处理
+    abs_path = os.path.join(CHATGPT_EXPORT_PATH, path_or_name)
+    if os.path.exists(abs_path):
+        return abs_path
+
+    # 常见子目录
+    basename_only = os.path.basename(path_or_name)
+    for sub in ["images", "assets", "dalle-generations", "dalle_generations"]:
+        candidate = os.path.join(CHATGPT_EXPORT_PATH, sub, basename_only)
+        if os.path.exists(candidate):
+            return candidate
+
+    # 第一轮：针对以 file- 开头的通用规则
+    if basename_only.startswith("file-"):
+        prefix = basename_only.split('.')[0]  # file-XXXXXX
+        for fname, path in iter_export_files():
+            if fname.startswith(prefix):
+                return path
+
+    # 第二轮：更通用的前缀匹配（不限定 file- 前缀），
+    # 以处理根目录下诸如 "image-XXX.png" 或 "pic_XXX.jpg" 等情况
+    generic_prefix = os.path.splitext(basename_only)[0]
+    if len(generic_prefix) > 3:  # 避免前缀过短造成误匹配
+        for fname, path in iter_export_files():
+            if fname.startswith(generic_prefix):
+                return path
+
+    # 第三轮：无扩展名 -> 试探常见图片扩展
+    if '.' not in basename_only:
+        COMMON_EXTS = ['png', 'jpg', 'jpeg', 'webp', 'gif']
+        for ext in COMMON_EXTS:
+            candidate = os.path.join(CHATGPT_EXPORT_PATH, f"{basename_only}.{ext}")
             if os.path.exists(candidate):
                 return candidate
+            # 亦在常见子目录中查找
+            for sub in ["images", "assets", "dalle-generations", "dalle_generations"]:
+                candidate_sub = os.path.join(CHATGPT_EXPORT_PATH, sub, f"{basename_only}.{ext}")
+                if os.path.exists(candidate_sub):
+                    return candidate_sub
+    return None
+
+class MultipartFileStream:
+    """边读文件边生成的 multipart/form-data 请求体（len() 给出 Content-Length，requests 按块读取发送）"""
+
+    def __init__(self, file_obj, file_size, field_name, file_name, content_type):
+        boundary = os.urandom(16).hex()
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        safe_name = file_name.replace('"', '%22')
+        self._sources = [
+            (f'--{boundary}\r\nContent-Disposition: form-data; name="{field_name}"; filename="{safe_name}"\r\n'
+             f'Content-Type: {content_type}\r\n\r\n').encode('utf-8'),
+            file_obj,
+            f'\r\n--{boundary}--\r\n'.encode('utf-8'),
+        ]
+        self._length = len(self._sources[0]) + file_size + len(self._sources[2])
+        self._file_start = file_obj.tell()
+        self._stage = 0
+        self._offset = 0
+
+    def __len__(self):
+        return self._length
+
+    def rewind(self):
+        """回到开头，用于重发（例如被限流后）"""
+        self._sources[1].seek(self._file_start)
+        self._stage = 0
+        self._offset = 0
+
+    def read(self, size=-1):
+        """依次返回头部、文件内容和结尾边界，最多 size 字节"""
+        if size is None or size < 0:
+            size = self._length
+        chunks = []
+        while size > 0 and self._stage < len(self._sources):
+            source = self._sources[self._stage]
+            if isinstance(source, bytes):
+                data = source[self._offset:self._offset + size]
+                self._offset += len(data)
+                if self._offset >= len(source):
+                    self._stage, self._offset = self._stage + 1, 0
+            else:
+                data = source.read(size)
+                if not data:
+                    self._stage += 1
+                    continue
+            chunks.append(data)
+            size -= len(data)
+        return b"".join(chunks)
 
-        # 第一轮：针对以 file- 开头的通用规则
-        if basename_only.startswith("file-"):
-            prefix = basename_only.split('.')[0]  # file-XXXXXX
-            for root, _dirs, files in os.walk(CHATGPT_EXPORT_PATH):
-                for fname in files:
-                    if fname.startswith(prefix):
-                        return os.path.join(root, fname)
-
-        # 第二轮：更通用的前缀匹配（不限定 file- 前缀），
-        # 以处理根目录下诸如 "image-XXX.png" 或 "pic_XXX.jpg" 等情况
-        generic_prefix = os.path.splitext(basename_only)[0]
-        if len(generic_prefix) > 3:  # 避免前缀过短造成误匹配
-            for root, _dirs, files in os.walk(CHATGPT_EXPORT_PATH):
-                for fname in files:
-                    if fname.startswith(generic_prefix):
-                        return os.path.join(root, fname)
-
-        # 第三轮：无扩展名 -> 试探常见图片扩展
-        if '.' not in basename_only:
-            COMMON_EXTS = ['png', 'jpg', 'jpeg', 'webp', 'gif']
-            for ext in COMMON_EXTS:
-                candidate = os.path.join(CHATGPT_EXPORT_PATH, f"{basename_only}.{ext}")
-                if os.path.exists(candidate):
-                    return candidate
-                # 亦在常见子目录中查找
-                for sub in ["images", "assets", "dalle-generations", "dalle_generations"]:
-                    candidate_sub = os.path.join(CHATGPT_EXPORT_PATH, sub, f"{basename_only}.{ext}")
-                    if os.path.exists(candidate_sub):
-                        return candidate_sub
-        return None
+def prepare_file_upload(local_file_path):
+    """查找文件并确定上传用的文件名、大小和 MIME 类型；无法上传（找不到、过大、不支持的类型）时返回 None"""
 
-    actual_path = find_local_file(local_file_path)
+    with timed_phase('file_lookup'):
+        actual_path = find_local_file(local_file_path)
     if actual_path is None:
-        tqdm.write(f"   ⚠️ 图片文件未找到: {local_file_path}")
+        tqdm.write(f"   ⚠️ 文件未找到: {local_file_path}")
         return None
 
     local_file_path = actual_path
@@ -324,9 +1193,8 @@ def upload_file_to_notion(local_file_path, headers):
     file_name = os.path.basename(local_file_path)
     file_size = os.path.getsize(local_file_path)
     
-    # ====== 会员版限制：20 MB ======
-    MAX_FILE_SIZE_BYTES = 20 * 1024 * 1024  # 20MB
-    if file_size > MAX_FILE_SIZE_BYTES:
+    # ====== 会员版限制：20 MB（只读取文件大小，不读取内容）======
+    if file_size > MAX_UPLOAD_FILE_SIZE:
         tqdm.write(f"   ⚠️ 文件过大 (>20MB): {local_file_path}")
         return None
 
@@ -343,6 +1211,14 @@ def upload_file_to_notion(local_file_path, headers):
     }
     if not content_type and ext in EXT_MIME_MAP:
         content_type = EXT_MIME_MAP[ext]
+    # 部分平台 mimetypes 返回的非标准名称（如 Linux 上的 audio/x-wav）
+    MIME_ALIASES = {
+        'audio/x-wav': 'audio/wav',
+        'audio/wave': 'audio/wav',
+        'audio/mp3': 'audio/mpeg',
+        'audio/x-m4a': 'audio/mp4',
+    }
+    content_type = MIME_ALIASES.get(content_type, content_type)
     if not content_type:
         content_type = 'application/octet-stream'
 
@@ -381,7 +1257,7 @@ def upload_file_to_notion(local_file_path, headers):
         # 图片
         'image/jpeg','image/jpg','image/png','image/gif','image/webp','image/svg+xml','image/tiff','image/heic','image/vnd.microsoft.icon',
         # 文档
-        'application/pdf','text/plain','application/json',
+        'application/pdf','text/plain','text/csv','application/json',
         # 音频
         'audio/mpeg','audio/mp4','audio/aac','audio/midi','audio/ogg','audio/wav','audio/x-ms-wma',
         # 视频
@@ -391,6 +1267,15 @@ def upload_file_to_notion(local_file_path, headers):
         tqdm.write(f"   ⚠️ 不支持的 MIME 类型({content_type})，跳过: {file_name}")
         return None
 
+    return local_file_path, file_name, file_size, content_type
+
+def upload_file_to_notion(local_file_path, headers):
+    """上传文件到Notion，支持图片等附件 (增强多路径查找)"""
+    prepared = prepare_file_upload(local_file_path)
+    if prepared is None:
+        return None
+    local_file_path, file_name, file_size, content_type = prepared
+
     # 调试：显示文件准备信息
     if DEBUG_IMAGE_UPLOAD or os.getenv("DEBUG_IMAGE_UPLOAD") == "1":
         tqdm.write(f"   [DEBUG] 准备上传: {file_name} | size={round(file_size/1024,1)}KB | mime={content_type}")
@@ -402,8 +1287,9 @@ def upload_file_to_notion(local_file_path, headers):
         "content_type": content_type
     }
     
+    upload_frame = open_phase()
     try:
-        response = requests.post(upload_url, headers=headers, json=payload, timeout=30)
+        response = notion_request('POST', upload_url, headers=headers, json=payload, timeout=30)
         response.raise_for_status()
         upload_data = response.json()
         
@@ -412,9 +1298,6 @@ def upload_file_to_notion(local_file_path, headers):
             tqdm.write(f"   [DEBUG] 上传返回: {json.dumps(upload_data, ensure_ascii=False)}")
         
         # 第二步：上传文件内容到获取的URL
-        with open(local_file_path, 'rb') as f:
-            file_bytes = f.read()
-
         base_upload_headers = {
             "Content-Type": content_type,
             "Content-Length": str(file_size)
@@ -422,35 +1305,39 @@ def upload_file_to_notion(local_file_path, headers):
 
         upload_url = upload_data["upload_url"]
 
-        # 如果 upload_url 包含 /send，按 Notion API 需要带授权使用 POST
-        if "/send" in upload_url:
-            # 使用 multipart/form-data, requests 自动生成 boundary 与 Content-Type
-            upload_headers = {
-                "Authorization": headers.get("Authorization", ""),
-                "Notion-Version": headers.get("Notion-Version", "2022-06-28")
-            }
-
-            files = {
-                "file": (file_name, file_bytes, content_type)
-            }
+        # 文件以流的形式分块发送，不会整个读入内存（音频等大文件）
+        with open(local_file_path, 'rb') as f:
+            # 如果 upload_url 包含 /send，按 Notion API 需要带授权使用 POST
+            if "/send" in upload_url:
+                # multipart/form-data 请求体边读边发，Content-Length 由 len() 得出
+                body = MultipartFileStream(f, file_size, "file", file_name, content_type)
+                upload_headers = {
+                    "Authorization": headers.get("Authorization", ""),
+                    "Notion-Version": headers.get("Notion-Version", "2022-06-28"),
+                    "Content-Type": body.content_type
+                }
 
-            response = requests.post(
-                upload_url,
-                headers=upload_headers,
-                files=files,
-                timeout=120
-            )
-        else:
-            # 预签名 S3 URL，使用 PUT 无需授权
-            response = requests.put(
-                upload_url,
-                headers=base_upload_headers,
-                data=file_bytes,
-                timeout=120
-            )
+                response = notion_request(
+                    'POST',
+                    upload_url,
+                    headers=upload_headers,
+                    data=body,
+                    timeout=120
+                )
+            else:
+                # 预签名 S3 URL，使用 PUT 无需授权
+                response = notion_request(
+                    'PUT',
+                    upload_url,
+                    headers=base_upload_headers,
+                    data=f,
+                    timeout=120
+                )
+        with HTTP_TRACE_LOCK:
+            RUN_METRICS["upload_bytes"] += file_size
         response.raise_for_status()
         
-        tqdm.write(f"   ✅ 图片上传成功: {file_name}")
+        tqdm.write(f"   ✅ 文件上传成功: {file_name}")
 
         if DEBUG_IMAGE_UPLOAD or os.getenv("DEBUG_IMAGE_UPLOAD") == "1":
             tqdm.write(f"   [DEBUG] FileUpload ID: {upload_data.get('id')}")
@@ -460,202 +1347,1199 @@ def upload_file_to_notion(local_file_path, headers):
         error_msg = e.response.text if e.response else str(e)
         tqdm.write(f"   ❌ 文件上传失败: {error_msg}")
         return None
+    except (OSError, KeyError, ValueError) as e:
+        # 文件读取失败或响应缺少字段（upload_url / id）
+        tqdm.write(f"   ❌ 文件上传失败: {file_name}: {e!r}")
+        return None
+    finally:
+        close_phase('upload', upload_frame)
 
-def build_blocks_from_conversation(conversation_data, headers):
-    """从对话数据构建Notion块，增加了安全保护"""
-    mapping = conversation_data.get('mapping', {})
-    if not mapping:
-        return []
+# 文件引用（导出目录中的文件名或 file-ID）-> Notion 文件上传ID，上传失败为 None；同一文件在本次运行中只上传一次
+UPLOADED_FILE_IDS = {}
 
-    # 找到根节点
-    root_id = next((nid for nid, node in mapping.items() if not node.get('parent')), None)
-    if not root_id:
-        try:
-            # 如果没有明确的根节点，找最早的消息作为起点
-            root_id = min(mapping.keys(), 
-                         key=lambda k: mapping[k].get('message', {}).get('create_time', float('inf')))
-        except (ValueError, TypeError):
-            return []
+# --plan 状态: 当前对话模拟上传的文件大小（字节）；真实导入时 active 为 False
+PLAN_STATE = {"active": False, "uploads": []}
 
+def plan_file_upload(reference):
+    """--plan: 模拟上传（不发送请求），文件按真实上传的规则检查；返回占位上传 ID"""
+    prepared = prepare_file_upload(os.path.join(CHATGPT_EXPORT_PATH, reference))
+    if prepared is None:
+        UPLOADED_FILE_IDS[reference] = None
+    else:
+        PLAN_STATE["uploads"].append(prepared[2])
+        UPLOADED_FILE_IDS[reference] = f"planned-{reference}"
+    return UPLOADED_FILE_IDS[reference]
+
+def get_file_upload_id(reference, headers):
+    """返回文件的上传ID，尚未上传时立即上传（上传计划之外的文件，如分支中的图片）"""
+    if reference not in UPLOADED_FILE_IDS:
+        if PLAN_STATE["active"]:
+            return plan_file_upload(reference)
+        UPLOADED_FILE_IDS[reference] = upload_file_to_notion(os.path.join(CHATGPT_EXPORT_PATH, reference), headers)
+    return UPLOADED_FILE_IDS[reference]
+
+def get_audio_pointers(parts):
+    """多模态内容中的音频指针（语音模式），包括实时音视频部分中嵌套的音频"""
+    pointers = []
+    for part in parts:
+        if not isinstance(part, dict):
+            continue
+        if part.get('content_type') == 'real_time_user_audio_video_asset_pointer':
+            part = part.get('audio_asset_pointer') or {}
+        if part.get('content_type') == 'audio_asset_pointer' and '://' in (part.get('asset_pointer') or ''):
+            pointers.append(part)
+    return pointers
+
+def get_asset_reference(asset_pointer):
+    """资源指针（file-service:// 或 sediment://）对应的文件引用"""
+    return asset_pointer.split('://', 1)[-1].split('/')[-1]
+
+def get_message_file_references(message):
+    """消息引用的所有文件及已知大小：多模态图片与音频指针、metadata.attachments 中的附件（去重，保持顺序）"""
+    references = {}
+    if message.content_type == 'multimodal_text':
+        parts = message.content.get('parts') or []
+        for part in parts:
+            if isinstance(part, dict) and part.get('content_type') == 'image_asset_pointer':
+                asset_pointer = part.get('asset_pointer', '')
+                if asset_pointer.startswith('file-service://') and asset_pointer.split('/')[-1]:
+                    references.setdefault(asset_pointer.split('/')[-1], part.get('size_bytes'))
+        for pointer in get_audio_pointers(parts):
+            references.setdefault(get_asset_reference(pointer['asset_pointer']), pointer.get('size_bytes'))
+    for attachment in message.metadata.get('attachments') or []:
+        if isinstance(attachment, dict) and attachment.get('id'):
+            references.setdefault(attachment['id'], attachment.get('size'))
+    return list(references.items())
+
+def build_upload_plan(tree, nodes):
+    """对话的上传计划：显示路径上所有被引用且尚未上传的文件（去重）"""
+    plan = []
+    for node in nodes:
+        message = tree.messages[node]
+        if not message or not message.content:
+            continue
+        # 被过滤策略跳过或摘要的消息、Canvas 工具调用都不渲染附件，其文件无需上传
+        if message.recipient in CANVAS_TOOL_CALLS and IMPORT_CANVAS_DOCUMENTS:
+            continue
+        filter_rule = match_message_filter(message, len(get_content_text(message.content)))
+        if filter_rule and filter_rule.get('action') in ('skip', 'summarize'):
+            continue
+        for reference, size_bytes in get_message_file_references(message):
+            if reference in UPLOADED_FILE_IDS:
+                continue
+            # 已知大小超过上传限制：不查找、不读取文件，直接跳过
+            if isinstance(size_bytes, int) and size_bytes > MAX_UPLOAD_FILE_SIZE:
+                tqdm.write(f"   ⚠️ 文件过大 (>20MB)，跳过: {reference}")
+                UPLOADED_FILE_IDS[reference] = None
+                continue
+            plan.append(reference)
+    return list(dict.fromkeys(plan))
+
+def upload_planned_files(plan, headers):
+    """并行上传计划中的文件（UPLOAD_WORKERS 个线程），结果写入上传缓存"""
+    if not plan:
+        return
+    tqdm.write(f"   - 📎 正在上传 {len(plan)} 个文件 ({UPLOAD_WORKERS} 个并行)...")
+    RUN_METRICS["uploads_pending"] += len(plan)
+    iter_export_files()  # 在启动线程前建立导出文件索引，工作线程只读取它
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        futures = [executor.submit(upload_file_to_notion, os.path.join(CHATGPT_EXPORT_PATH, reference), headers) for reference in plan]
+        for reference, future in zip(plan, futures):
+            # 单个文件的意外错误只让该文件失败，不中断整个对话
+            try:
+                UPLOADED_FILE_IDS[reference] = future.result()
+            except Exception as e:
+                tqdm.write(f"   ❌ 文件上传失败: {reference}: {e!r}")
+                UPLOADED_FILE_IDS[reference] = None
+            finally:
+                RUN_METRICS["uploads_pending"] -= 1
+
+# 内容处理器读取的 content 键，其余（如图片的宽高、fovea、DALL·E 元数据）在建树时丢弃
+MESSAGE_CONTENT_KEYS = ('parts', 'text', 'language', 'result', 'summary', 'title', 'url', 'domain', 'thoughts', 'content')
+MESSAGE_PART_KEYS = ('content_type', 'text', 'asset_pointer', 'size_bytes', 'audio_asset_pointer')  # 多模态 part 保留的键
+MESSAGE_METADATA_KEYS = ('attachments', 'canvas')  # 另外保留过滤规则中用到的 metadata 键
+ATTACHMENT_KEYS = ('id', 'name', 'size', 'mime_type')
+
+def compact_message_part(part):
+    """多模态 part: 字符串原样保留，字典只保留渲染用到的键（嵌套的音频指针同样处理）"""
+    if isinstance(part, str):
+        return part
+    compact = {key: part[key] for key in MESSAGE_PART_KEYS if key in part}
+    if isinstance(compact.get('content_type'), str):
+        compact['content_type'] = sys.intern(compact['content_type'])
+    if isinstance(compact.get('audio_asset_pointer'), dict):
+        compact['audio_asset_pointer'] = compact_message_part(compact['audio_asset_pointer'])
+    return compact
+
+def compact_message_content(content):
+    """content 只保留内容处理器读取的字段"""
+    compact = {key: content[key] for key in MESSAGE_CONTENT_KEYS if key in content}
+    if isinstance(compact.get('parts'), list):
+        compact['parts'] = [compact_message_part(part) for part in compact['parts'] if isinstance(part, (str, dict))]
+    if isinstance(compact.get('thoughts'), list):
+        compact['thoughts'] = [{key: thought[key] for key in ('summary', 'content') if key in thought}
+                               for thought in compact['thoughts'] if isinstance(thought, dict)]
+    return compact
+
+def compact_message_metadata(metadata):
+    """metadata 只保留附件、Canvas 以及过滤规则引用的键"""
+    keys = MESSAGE_METADATA_KEYS + tuple(rule['metadata'] for rule in load_message_filter_policy() if rule.get('metadata'))
+    compact = {key: metadata[key] for key in keys if key in metadata}
+    if isinstance(compact.get('attachments'), list):
+        compact['attachments'] = [{key: attachment[key] for key in ATTACHMENT_KEYS if key in attachment}
+                                  for attachment in compact['attachments'] if isinstance(attachment, dict)]
+    return compact
+
+class MessageRecord:
+    """紧凑的消息记录：只保留渲染所需字段，role / content_type 字符串驻留（intern）"""
+    __slots__ = ('role', 'author_name', 'recipient', 'content_type', 'content', 'metadata', 'create_time')
+
+    def __init__(self, message):
+        author = message.get('author') or {}
+        content = message.get('content') or None
+        metadata = message.get('metadata')
+        self.role = sys.intern(author.get('role') or 'unknown')
+        self.author_name = sys.intern(author.get('name') or '')
+        self.recipient = sys.intern(message.get('recipient') or 'all')
+        self.content_type = sys.intern(content.get('content_type') or '') if content else ''
+        self.content = compact_message_content(content) if content else None
+        self.metadata = compact_message_metadata(metadata) if isinstance(metadata, dict) else {}
+        self.create_time = message.get('create_time')
+
+class ConversationTree:
+    """以整数节点编号为下标的并行数组表示的对话树（父节点 -1 表示无）"""
+    __slots__ = ('node_ids', 'parents', 'children', 'messages', 'current')
+
+    def __init__(self, node_ids, parents, children, messages, current):
+        self.node_ids = node_ids  # 整数节点编号 -> 原始节点ID
+        self.parents = parents  # 父节点编号的 array('i')
+        self.children = children  # 子节点编号元组，或 None
+        self.messages = messages  # MessageRecord，无消息的节点为 None
+        self.current = current  # current_node 的编号，缺失时为 -1
+
+    def __len__(self):
+        return len(self.node_ids)
+
+def build_conversation_tree(conversation_data):
+    """从原始导出 JSON 一次性构建紧凑对话树（只遍历一遍 mapping）"""
+    mapping = conversation_data.get('mapping') or {}
+    node_ids = list(mapping)
+    index_of = {node_id: n for n, node_id in enumerate(node_ids)}  # 仅在构建时需要
+    parents = array('i', [-1]) * len(node_ids)
+    children = [None] * len(node_ids)
+    messages = [None] * len(node_ids)
+
+    for n, node_id in enumerate(node_ids):
+        node = mapping[node_id] or {}
+        parent_id = node.get('parent')
+        if parent_id in index_of:
+            parents[n] = index_of[parent_id]
+        child_ids = node.get('children')
+        if child_ids and isinstance(child_ids, list):
+            children[n] = tuple(index_of[c] for c in child_ids if c in index_of)
+        if node.get('message'):
+            messages[n] = MessageRecord(node['message'])
+
+    current = index_of.get(conversation_data.get('current_node'), -1)
+    return ConversationTree(node_ids, parents, children, messages, current)
+
+def get_conversation_path(tree):
+    """通过 current_node 和父节点指针重建界面上显示的消息路径（根 -> current_node），返回节点编号"""
+    if not len(tree):
+        return []
+
+    path = []
+    parents = tree.parents
+
+    # 从当前显示的节点向上回溯，开销与路径长度成正比（包含编辑/重新生成后的分支）
+    node = tree.current
+    if node >= 0:
+        # 有效路径不会比节点总数更长，这个上限同时能终止损坏数据导致的环
+        while node >= 0 and len(path) < len(parents):
+            path.append(node)
+            node = parents[node]
+        path.reverse()
+        return path
+
+    # 没有 current_node 的旧版导出：找到根节点后沿第一个子节点前进
+    root = next((n for n, parent in enumerate(parents) if parent < 0), -1)
+    if root < 0:
+        # 如果没有明确的根节点，找最早的消息作为起点
+        messages = tree.messages
+        root = min(range(len(parents)),
+                   key=lambda n: (messages[n] and messages[n].create_time) or float('inf'))
+
+    node = root
+    while node >= 0 and len(path) < len(parents):
+        path.append(node)
+        children = tree.children[node]
+        node = children[0] if children else -1
+    return path
+
+def text_to_blocks(text):
+    """将文本分割为经过验证的段落块"""
     blocks = []
-    current_id = root_id
-    visited = set()  # 防止无限循环
-    depth = 0
-    
-    # Canvas 文档去重集合（按 textdoc_id）
-    seen_canvas_docs = set()
-    
-    # 安全遍历对话树
-    while current_id in mapping and current_id not in visited and depth < MAX_TRAVERSE_DEPTH:
-        visited.add(current_id)
-        depth += 1
-        
-        node = mapping.get(current_id, {})
-        message = node.get('message')
+    for chunk in split_long_text(text):
+        block = {
+            "type": "paragraph",
+            "paragraph": {
+                "rich_text": [{"type": "text", "text": {"content": chunk}}]
+            }
+        }
+        validated_block = validate_block_content(block)
+        if validated_block:
+            blocks.append(validated_block)
+    return blocks
 
-        if message and isinstance(message.get('metadata'), dict) and 'canvas' in message['metadata']:
-            canvas_meta = message['metadata']['canvas']
-            textdoc_id = canvas_meta.get('textdoc_id')
-            if textdoc_id and textdoc_id not in seen_canvas_docs:
-                seen_canvas_docs.add(textdoc_id)
+def code_to_blocks(speaker_label, code_text, language):
+    """说话者标识段落 + 经过验证的代码块"""
+    blocks = text_to_blocks(speaker_label)
+    # 处理长代码分割
+    for chunk in split_long_text(code_text):
+        code_block = {
+            "type": "code",
+            "code": {
+                "rich_text": [{"type": "text", "text": {"content": chunk}}],
+                "language": get_safe_language_type(language)
+            }
+        }
+        validated_code_block = validate_block_content(code_block)
+        if validated_code_block:
+            blocks.append(validated_code_block)
+    return blocks
 
-                canvas_title = canvas_meta.get('title') or canvas_meta.get('textdoc_type', 'Canvas')
-                canvas_type = canvas_meta.get('textdoc_type', 'document')
-                canvas_version = canvas_meta.get('version')
+def render_text_content(content, speaker_label, headers):
+    """text：纯文本消息"""
+    full_content = "".join(part for part in content.get('parts') or [] if isinstance(part, str))
+    if not full_content.strip():
+        return []
+    return text_to_blocks(f"{speaker_label}\n{full_content}")
 
-                desc_lines = [f"Canvas 模块 -> 标题: {canvas_title}"]
-                desc_lines.append(f"类型: {canvas_type} | 版本: {canvas_version} | ID: {textdoc_id}")
+def markdown_text_blocks(block_type, lines):
+    """将累积的文本行生成为块：段落按长度拆分为多个块，标题 / 列表 / 引用拆分为同一块中的多个 rich_text 项"""
+    text = "\n".join(lines).strip()
+    if not block_type or not text:
+        return []
+    if block_type == 'paragraph':
+        return [make_text_block('paragraph', chunk) for chunk in split_long_text(text)]
+    return [{
+        "type": block_type,
+        block_type: {
+            "rich_text": [{"type": "text", "text": {"content": chunk}} for chunk in split_long_text(text)[:NOTION_MAX_RICH_TEXT_ITEMS]]
+        }
+    }]
 
-                desc_text = "\n".join(filter(None, desc_lines))
+def markdown_code_blocks(lines, language):
+    """围栏代码块内容生成为代码块（保留围栏中的语言，超长时拆分为多个代码块）"""
+    code_text = "\n".join(lines)
+    if not code_text.strip():
+        return []
+    return [make_text_block('code', chunk, get_safe_language_type(language)) for chunk in split_long_text(code_text)]
+
+def iter_markdown_blocks(text):
+    """单次遍历的 Markdown 分词器：逐行产出 Notion 标题 / 列表 / 引用 / 代码 / 分割线 / 段落块
+
+    每行只处理一次，文本行先累积再一次性拼接，耗时与消息长度成线性关系。不处理行内格式和嵌套列表（嵌套列表展开为同级）。
+    """
+    pending_type, pending_lines = None, []  # Text block being collected
+    fence, code_language, code_lines = None, None, []
+
+    for line in text.split('\n'):
+        if fence:
+            # 在代码围栏内：只查找相同字符、长度不小于开头的结束围栏
+            stripped = line.strip()
+            if stripped.startswith(fence) and not stripped.strip(fence[0]):
+                yield from markdown_code_blocks(code_lines, code_language)
+                fence = None
+            else:
+                code_lines.append(line)
+            continue
+
+        fence_match = MARKDOWN_FENCE_PATTERN.match(line)
+        if fence_match:
+            yield from markdown_text_blocks(pending_type, pending_lines)
+            pending_type, pending_lines = None, []
+            fence, code_language, code_lines = fence_match.group(1), fence_match.group(2), []
+            continue
+
+        if not line.strip():
+            yield from markdown_text_blocks(pending_type, pending_lines)
+            pending_type, pending_lines = None, []
+            continue
+
+        heading_match = MARKDOWN_HEADING_PATTERN.match(line)
+        divider_match = MARKDOWN_DIVIDER_PATTERN.match(line) if not heading_match else None
+        list_match = None
+        if not heading_match and not divider_match:
+            list_match = MARKDOWN_BULLET_PATTERN.match(line) or MARKDOWN_NUMBERED_PATTERN.match(line)
+        if heading_match or divider_match or list_match:
+            yield from markdown_text_blocks(pending_type, pending_lines)
+            pending_type, pending_lines = None, []
+            if heading_match:
+                level = min(len(heading_match.group(1)), 3)
+                yield from markdown_text_blocks(f"heading_{level}", [heading_match.group(2).rstrip('#').strip()])
+            elif divider_match:
+                yield {"type": "divider", "divider": {}}
+            else:
+                pending_type = 'bulleted_list_item' if list_match.re is MARKDOWN_BULLET_PATTERN else 'numbered_list_item'
+                pending_lines = [list_match.group(1)]
+            continue
+
+        quote_match = MARKDOWN_QUOTE_PATTERN.match(line)
+        if quote_match:
+            if pending_type != 'quote':
+                yield from markdown_text_blocks(pending_type, pending_lines)
+                pending_type, pending_lines = 'quote', []
+            pending_lines.append(quote_match.group(1))
+            continue
+
+        # 普通行：作为列表项或段落的续行，并结束引用
+        if pending_type in (None, 'quote'):
+            yield from markdown_text_blocks(pending_type, pending_lines)
+            pending_type, pending_lines = 'paragraph', []
+        pending_lines.append(line if pending_type == 'paragraph' else line.strip())
+
+    if fence:
+        # 未闭合的围栏：剩余内容都作为代码
+        yield from markdown_code_blocks(code_lines, code_language)
+    yield from markdown_text_blocks(pending_type, pending_lines)
+
+def render_markdown_content(content, speaker_label, headers):
+    """助手的 text 消息：按 Markdown 渲染（RENDER_MARKDOWN 关闭时按纯文本处理）"""
+    if not RENDER_MARKDOWN:
+        return render_text_content(content, speaker_label, headers)
+    full_content = "".join(part for part in content.get('parts') or [] if isinstance(part, str))
+    if not full_content.strip():
+        return []
+    return text_to_blocks(speaker_label) + list(iter_markdown_blocks(full_content))
+
+def render_multimodal_content(content, speaker_label, headers):
+    """multimodal_text：文本+图片+语音（图片和音频上传到 Notion，语音转写作为文本）"""
+    parts = content.get('parts') or []
+    # 语音模式的转写文本与普通文本一起渲染
+    text = "".join(part for part in parts if isinstance(part, str))
+    transcripts = [part['text'] for part in parts
+                   if isinstance(part, dict) and part.get('content_type') == 'audio_transcription' and part.get('text')]
+    if transcripts:
+        text = "\n".join(filter(None, [text] + [f"🎙️ {transcript}" for transcript in transcripts]))
+    blocks = text_to_blocks(f"{speaker_label}\n{text}") if text.strip() else []
+
+    # 处理图片部分
+    for part in parts:
+        if isinstance(part, dict) and part.get('content_type') == 'image_asset_pointer':
+            asset_pointer = part.get('asset_pointer', '')
+            if asset_pointer.startswith('file-service://'):
+                file_name = asset_pointer.split('/')[-1]
+                if file_name:
+                    file_upload_id = get_file_upload_id(file_name, headers)
+                    if file_upload_id:
+                        if DEBUG_IMAGE_UPLOAD or os.getenv("DEBUG_IMAGE_UPLOAD") == "1":
+                            tqdm.write(f"   [DEBUG] 构建 image block, id={file_upload_id}")
+                        blocks.append({
+                            "type": "image",
+                            "image": {
+                                "type": "file_upload",
+                                "file_upload": {"id": file_upload_id}
+                            }
+                        })
+
+    # 处理音频部分
+    for pointer in get_audio_pointers(parts):
+        file_upload_id = get_file_upload_id(get_asset_reference(pointer['asset_pointer']), headers)
+        if file_upload_id:
+            blocks.append({
+                "type": "audio",
+                "audio": {
+                    "type": "file_upload",
+                    "file_upload": {"id": file_upload_id}
+                }
+            })
+    return blocks
 
-                for chunk in split_long_text(desc_text):
-                    block = {
-                        "type": "paragraph",
-                        "paragraph": {
-                            "rich_text": [{"type": "text", "text": {"content": chunk}}]
-                        }
-                    }
-                    validated_block = validate_block_content(block)
-                    if validated_block:
-                        blocks.append(validated_block)
+def get_attachment_block_type(mime_type):
+    """根据 MIME 类型选择 Notion 块类型"""
+    if mime_type == 'application/pdf':
+        return 'pdf'
+    major_type = mime_type.split('/')[0]
+    return major_type if major_type in ('image', 'audio', 'video') else 'file'
 
-        if message and message.get('content'):
-            author_role = message.get('author', {}).get('role', 'unknown')
-            
-            # 角色映射
-            speaker_map = {
-                "user": "👤 用户",
-                "assistant": "🤖 助手", 
-                "tool": f"🛠️ 工具 ({message.get('author', {}).get('name', '')})",
-                "system": "⚙️ 系统"
+def render_attachments(message, headers):
+    """消息附件（metadata.attachments）的文件块，与图片使用同一上传流程；已作为图片指针渲染的文件不重复"""
+    blocks = []
+    attachments = message.metadata.get('attachments')
+    if not attachments:
+        return blocks
+    rendered = set()
+    if message.content_type == 'multimodal_text':
+        for part in message.content.get('parts') or []:
+            if isinstance(part, dict) and part.get('content_type') == 'image_asset_pointer':
+                rendered.add(part.get('asset_pointer', '').split('/')[-1])
+
+    for attachment in attachments:
+        if not isinstance(attachment, dict) or not attachment.get('id') or attachment['id'] in rendered:
+            continue
+        rendered.add(attachment['id'])
+        file_upload_id = get_file_upload_id(attachment['id'], headers)
+        if not file_upload_id:
+            continue
+        name = attachment.get('name') or attachment['id']
+        mime_type = attachment.get('mime_type') or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        block_type = get_attachment_block_type(mime_type)
+        blocks.append({
+            "type": block_type,
+            block_type: {
+                "type": "file_upload",
+                "file_upload": {"id": file_upload_id},
+                "caption": [{"type": "text", "text": {"content": clean_text_content(name)}}]
             }
-            speaker_raw = speaker_map.get(author_role, "❓ 未知")
+        })
+    return blocks
 
-            # 将 "👤 用户" 形式转换为 "[👤]用户:"  前缀
-            def format_speaker_label(raw: str) -> str:
-                if ' ' in raw:
-                    emoji_part, name_part = raw.split(' ', 1)
-                    return f"[{emoji_part}]{name_part}:"
-                # fallback
-                return f"[{raw}]:"
+def render_code_content(content, speaker_label, headers):
+    """code：助手编写的代码（如工具调用）"""
+    if not content.get('text'):
+        return []
+    return code_to_blocks(speaker_label, content['text'], content.get('language'))
 
-            speaker_label = format_speaker_label(speaker_raw)
+def render_execution_output(content, speaker_label, headers):
+    """execution_output：python 工具运行代码的输出"""
+    if not content.get('text'):
+        return []
+    return code_to_blocks(f"{speaker_label}\n📤 执行输出:", content['text'], 'text')
 
-            content = message['content']
-            content_type = content.get('content_type')
-            
-            # 处理纯文本内容
-            if content_type == 'text' and content.get('parts'):
-                full_content = "".join(part for part in content['parts'] if isinstance(part, str))
-                if full_content.strip():
-                    # 处理长文本分割
-                    text_chunks = split_long_text(f"{speaker_label}\n{full_content}")
-                    for chunk in text_chunks:
-                        block = {
-                            "type": "paragraph",
-                            "paragraph": {
-                                "rich_text": [{"type": "text", "text": {"content": chunk}}]
-                            }
-                        }
-                        validated_block = validate_block_content(block)
-                        if validated_block:
-                            blocks.append(validated_block)
-            
-            # 处理多模态内容（文本+图片）
-            elif content_type == 'multimodal_text':
-                # 先处理文本部分
-                prompt_text = "".join(part for part in content['parts'] if isinstance(part, str))
-                if prompt_text.strip():
-                    text_chunks = split_long_text(f"{speaker_label}\n{prompt_text}")
-                    for chunk in text_chunks:
-                        block = {
-                            "type": "paragraph",
-                            "paragraph": {
-                                "rich_text": [{"type": "text", "text": {"content": chunk}}]
-                            }
-                        }
-                        validated_block = validate_block_content(block)
-                        if validated_block:
-                            blocks.append(validated_block)
-                
-                # 处理图片部分
-                for part in content['parts']:
-                    if isinstance(part, dict) and part.get('content_type') == 'image_asset_pointer':
-                        asset_pointer = part.get('asset_pointer', '')
-                        if asset_pointer.startswith('file-service://'):
-                            file_name = asset_pointer.split('/')[-1]
-                            if file_name:
-                                local_image_path = os.path.join(CHATGPT_EXPORT_PATH, file_name)
-                                file_upload_id = upload_file_to_notion(local_image_path, headers)
-                                if file_upload_id:
-                                    if DEBUG_IMAGE_UPLOAD or os.getenv("DEBUG_IMAGE_UPLOAD") == "1":
-                                        tqdm.write(f"   [DEBUG] 构建 image block, id={file_upload_id}")
-                                    blocks.append({
-                                        "type": "image",
-                                        "image": {
-                                            "type": "file_upload",
-                                            "file_upload": {"id": file_upload_id}
-                                        }
-                                    })
-
-            # 处理代码块
-            elif content_type == 'code' and content.get('text'):
-                # 添加说话者标识
-                speaker_block = {
-                    "type": "paragraph",
-                    "paragraph": {
-                        "rich_text": [{"type": "text", "text": {"content": speaker_label}}]
-                    }
-                }
-                validated_speaker_block = validate_block_content(speaker_block)
-                if validated_speaker_block:
-                    blocks.append(validated_speaker_block)
-                
-                # 处理长代码分割
-                code_chunks = split_long_text(content['text'])
-                for chunk in code_chunks:
-                    code_block = {
-                        "type": "code",
-                        "code": {
-                            "rich_text": [{"type": "text", "text": {"content": chunk}}],
-                            "language": get_safe_language_type(content.get('language'))
-                        }
-                    }
-                    validated_code_block = validate_block_content(code_block)
-                    if validated_code_block:
-                        blocks.append(validated_code_block)
-
-            # 处理系统错误
-            elif content_type == 'system_error' and content.get('text'):
-                error_text = f"{speaker_label}\n❗️ 系统错误: {content.get('text')}"
-                text_chunks = split_long_text(error_text)
-                for chunk in text_chunks:
-                    error_block = {
-                        "type": "paragraph",
-                        "paragraph": {
-                            "rich_text": [{"type": "text", "text": {"content": chunk}}]
-                        }
-                    }
-                    validated_error_block = validate_block_content(error_block)
-                    if validated_error_block:
-                        blocks.append(validated_error_block)
+def render_system_error(content, speaker_label, headers):
+    """system_error：系统错误"""
+    if not content.get('text'):
+        return []
+    return text_to_blocks(f"{speaker_label}\n❗️ 系统错误: {content.get('text')}")
+
+def render_browsing_display(content, speaker_label, headers):
+    """tether_browsing_display：提供给模型的网页浏览结果"""
+    result = content.get('result') or content.get('summary') or ''
+    if not result.strip():
+        return []
+    return text_to_blocks(f"{speaker_label}\n🌐 浏览结果:\n{result}")
+
+def render_quote(content, speaker_label, headers):
+    """tether_quote：引用的网页或文件片段"""
+    source = " | ".join(filter(None, [content.get('title'), content.get('url') or content.get('domain')]))
+    quote_text = content.get('text') or ''
+    if not source and not quote_text.strip():
+        return []
+    return text_to_blocks(f"{speaker_label}\n📑 引用: {source}\n{quote_text}")
+
+def render_thoughts(content, speaker_label, headers):
+    """thoughts：推理模型的思考摘要"""
+    thoughts = []
+    for thought in content.get('thoughts') or []:
+        if isinstance(thought, dict):
+            thought_text = "\n".join(filter(None, [thought.get('summary'), thought.get('content')]))
+            if thought_text.strip():
+                thoughts.append(thought_text)
+    if not thoughts:
+        return []
+    return text_to_blocks(f"{speaker_label}\n💭 思考过程:\n" + "\n\n".join(thoughts))
+
+def render_reasoning_recap(content, speaker_label, headers):
+    """reasoning_recap："已思考 N 秒" 提示"""
+    recap = content.get('content')
+    if not isinstance(recap, str) or not recap.strip():
+        return []
+    return text_to_blocks(f"{speaker_label}\n💭 {recap}")
+
+# 内容类型 -> 渲染函数 (content, 说话者标识, headers) -> 块列表；支持新的导出格式只需在此添加一项
+# (角色, 内容类型) 形式的键优先于只按内容类型匹配的键
+CONTENT_TYPE_HANDLERS = {
+    'text': render_text_content,
+    ('assistant', 'text'): render_markdown_content,
+    'multimodal_text': render_multimodal_content,
+    'code': render_code_content,
+    'execution_output': render_execution_output,
+    'system_error': render_system_error,
+    'tether_browsing_display': render_browsing_display,
+    'tether_quote': render_quote,
+    'thoughts': render_thoughts,
+    'reasoning_recap': render_reasoning_recap,
+}
+
+# 按内容类型统计：消息数、生成块数、耗时（未注册的类型只统计消息数）
+CONTENT_HANDLER_STATS = {}
+
+def print_content_handler_stats():
+    """输出按内容类型统计的渲染信息"""
+    if not CONTENT_HANDLER_STATS:
+        return
+    print("📊 内容类型统计:")
+    for content_type, stats in sorted(CONTENT_HANDLER_STATS.items(), key=lambda item: item[1]['messages'], reverse=True):
+        if content_type in CONTENT_TYPE_HANDLERS:
+            print(f"   {content_type}: {stats['messages']} 条消息 -> {stats['blocks']} 个块, {stats['seconds']:.2f}s")
+        else:
+            print(f"   {content_type}: {stats['messages']} 条消息 (无处理函数，已跳过)")
+
+# 已加载的过滤策略（延迟加载）
+MESSAGE_FILTER_RULES = None
+# 被过滤策略处理的消息数，以及估算节省的块数 / 字符数
+MESSAGE_FILTER_STATS = {"skip": 0, "truncate": 0, "summarize": 0, "blocks_saved": 0, "chars_saved": 0}
+
+def load_message_filter_policy():
+    """过滤规则：存在 MESSAGE_FILTER_POLICY_FILE 时从文件读取，否则使用 MESSAGE_FILTER_POLICY"""
+    global MESSAGE_FILTER_RULES
+    if MESSAGE_FILTER_RULES is None:
+        MESSAGE_FILTER_RULES = MESSAGE_FILTER_POLICY
+        if os.path.exists(MESSAGE_FILTER_POLICY_FILE):
+            try:
+                with open(MESSAGE_FILTER_POLICY_FILE, 'r', encoding='utf-8') as f:
+                    MESSAGE_FILTER_RULES = json.load(f)
+            except Exception as e:
+                print(f"警告: 无法读取消息过滤策略文件: {e}")
+    return MESSAGE_FILTER_RULES
+
+def get_content_text(content):
+    """消息内容中的全部文本（用于按长度过滤）"""
+    text = "".join(
+        part if isinstance(part, str) else part.get('text') or ''
+        for part in content.get('parts') or []
+        if isinstance(part, str) or (isinstance(part, dict) and part.get('content_type') == 'audio_transcription')
+    )
+    for key in ('text', 'result'):
+        if isinstance(content.get(key), str):
+            text += content[key]
+    return text
+
+def match_message_filter(message, text_length):
+    """返回第一条匹配该消息的过滤规则，没有则返回 None"""
+    for rule in load_message_filter_policy():
+        if not all(
+            message_value in (rule[key] if isinstance(rule[key], list) else [rule[key]])
+            for key, message_value in (('role', message.role), ('author_name', message.author_name), ('content_type', message.content_type))
+            if key in rule
+        ):
+            continue
+        if rule.get('metadata') and not message.metadata.get(rule['metadata']):
+            continue
+        if text_length < rule.get('min_chars', 0):
+            continue
+        return rule
+    return None
+
+def truncate_content(content, max_chars):
+    """返回文本字段总长度截断到 max_chars 的内容副本"""
+    truncated = dict(content)
+    remaining = max_chars
+    if isinstance(content.get('parts'), list):
+        truncated['parts'] = []
+        for part in content['parts']:
+            if isinstance(part, str):
+                part = part[:remaining]
+                remaining -= len(part)
+            truncated['parts'].append(part)
+    for key in ('text', 'result'):
+        if isinstance(content.get(key), str):
+            truncated[key] = content[key][:remaining]
+            remaining -= len(truncated[key])
+    return truncated
+
+# 浏览结果中的来源标记：【编号†标题†链接】
+BROWSING_SOURCE_PATTERN = re.compile(r'【\d+(?::\d+)?†([^†】]+)†([^†】]+)】')
+
+def summarize_content(content, text, max_chars):
+    """summarize 动作的摘要：引用 / 浏览结果的来源标题和链接，没有来源时为开头 max_chars 个字符（空白合并）"""
+    sources = []
+    if content.get('title') or content.get('url'):
+        sources.append(" | ".join(filter(None, [content.get('title'), content.get('url') or content.get('domain')])))
+    for title, link in BROWSING_SOURCE_PATTERN.findall(text):
+        source = f"{title.strip()} | {link.strip()}"
+        if source not in sources:
+            sources.append(source)
+    if sources:
+        return "\n".join(f"- {source}" for source in sources[:MESSAGE_SUMMARY_LINKS])
+    digest = " ".join(text.split())
+    return digest if len(digest) <= max_chars else digest[:max_chars].rstrip() + "…"
+
+def record_filtered_message(action, original_text, kept_text):
+    """统计被过滤的消息，以及它原本会生成的块数 / 字符数"""
+    original_blocks = len(split_long_text(original_text)) if original_text else 0
+    kept_blocks = len(split_long_text(kept_text)) if kept_text else 0
+    MESSAGE_FILTER_STATS[action] += 1
+    MESSAGE_FILTER_STATS["blocks_saved"] += max(original_blocks - kept_blocks, 0)
+    MESSAGE_FILTER_STATS["chars_saved"] += max(len(original_text) - len(kept_text), 0)
+
+def get_filter_requests_saved():
+    """消息过滤估算节省的追加请求数：打包后请求数受块数和载荷字符数共同限制，取两者中较大的估算值"""
+    return max(MESSAGE_FILTER_STATS['blocks_saved'] / APPEND_BATCH_SIZE, MESSAGE_FILTER_STATS['chars_saved'] / BATCH_PAYLOAD_LIMIT)
+
+def print_message_filter_stats():
+    """输出消息过滤策略节省的块数和请求数"""
+    if not (MESSAGE_FILTER_STATS['skip'] or MESSAGE_FILTER_STATS['truncate'] or MESSAGE_FILTER_STATS['summarize']):
+        return
+    requests_saved = get_filter_requests_saved()
+    print(f"✂️ 消息过滤: 跳过 {MESSAGE_FILTER_STATS['skip']} 条，截断 {MESSAGE_FILTER_STATS['truncate']} 条，摘要 {MESSAGE_FILTER_STATS['summarize']} 条消息")
+    print(f"   约节省 {MESSAGE_FILTER_STATS['blocks_saved']} 个块、{requests_saved:.0f} 次追加请求 ({MESSAGE_FILTER_STATS['chars_saved']} 字符)")
+
+# 角色 -> 说话者名称（{name} 为工具名）
+SPEAKER_ROLES = {
+    "user": "👤 用户",
+    "assistant": "🤖 助手",
+    "tool": "🛠️ 工具 ({name})",
+    "system": "⚙️ 系统"
+}
+SPEAKER_UNKNOWN = "❓ 未知"
+
+def format_speaker_label(raw):
+    """将 "👤 用户" 形式转换为 "[👤]用户:" 前缀"""
+    if ' ' in raw:
+        emoji_part, name_part = raw.split(' ', 1)
+        return f"[{emoji_part}]{name_part}:"
+    # fallback
+    return f"[{raw}]:"
+
+def build_speaker_label_pattern():
+    """只匹配实际生成的说话者前缀（compact_blocks 据此识别消息开头），"[1] 见: ..." 之类的普通文本不匹配"""
+    alternatives = []
+    for raw in (*SPEAKER_ROLES.values(), SPEAKER_UNKNOWN):
+        prefix, placeholder, suffix = format_speaker_label(raw).partition('{name}')
+        alternatives.append(re.escape(prefix) + (r'[^\n]*?' + re.escape(suffix) if placeholder else ''))
+    return re.compile('^(?:' + '|'.join(alternatives) + ')')
+
+SPEAKER_LABEL_PATTERN = build_speaker_label_pattern()  # 说话者前缀，如 "[👤]用户:"
+
+def build_blocks_from_message(message, headers, seen_canvas_docs):
+    """将单条消息（MessageRecord）渲染为Notion块列表"""
+    blocks = []
+    if not message:
+        return blocks
+
+    # 过滤策略在原始消息上评估，早于渲染和清理
+    content_text = get_content_text(message.content) if message.content else ""
+    filter_rule = match_message_filter(message, len(content_text))
+    filter_action = filter_rule.get('action') if filter_rule else None
+    if filter_action == 'skip':
+        record_filtered_message('skip', content_text, "")
+        return blocks
+
+    # Canvas 工具调用由重建的文档表示（见 iter_canvas_sections），不再把 JSON 参数渲染为代码块
+    if message.recipient in CANVAS_TOOL_CALLS and IMPORT_CANVAS_DOCUMENTS:
+        return blocks
+
+    if 'canvas' in message.metadata:
+        canvas_meta = message.metadata['canvas']
+        textdoc_id = canvas_meta.get('textdoc_id')
+        if textdoc_id and textdoc_id not in seen_canvas_docs:
+            seen_canvas_docs.add(textdoc_id)
+
+            canvas_title = canvas_meta.get('title') or canvas_meta.get('textdoc_type', 'Canvas')
+            canvas_type = canvas_meta.get('textdoc_type', 'document')
+            canvas_version = canvas_meta.get('version')
+
+            desc_lines = [f"Canvas 模块 -> 标题: {canvas_title}"]
+            desc_lines.append(f"类型: {canvas_type} | 版本: {canvas_version} | ID: {textdoc_id}")
+
+            desc_text = "\n".join(filter(None, desc_lines))
+
+            blocks.extend(text_to_blocks(desc_text))
+
+    if message.content:
+        author_role = message.role
+        
+        # 角色映射
+        speaker_raw = SPEAKER_ROLES.get(author_role, SPEAKER_UNKNOWN).replace('{name}', message.author_name)
+        speaker_label = format_speaker_label(speaker_raw)
+
+        # 按内容类型分派（CONTENT_TYPE_HANDLERS），并按类型统计消息数、块数和耗时
+        content_type = message.content_type or 'unknown'
+        stats = CONTENT_HANDLER_STATS.setdefault(content_type, {"messages": 0, "blocks": 0, "seconds": 0.0})
+        stats["messages"] += 1
+
+        content = message.content
+        if filter_action == 'summarize':
+            # 摘要块同样计入该内容类型的统计
+            start = time.perf_counter()
+            digest = summarize_content(content, content_text, filter_rule.get('max_chars', MESSAGE_SUMMARY_CHARS))
+            summary = f"{speaker_label}\n✂️ {content_type} 摘要 (原文 {len(content_text)} 字符):\n{digest}"
+            record_filtered_message('summarize', content_text, summary)
+            summary_blocks = text_to_blocks(summary)
+            stats["seconds"] += time.perf_counter() - start
+            stats["blocks"] += len(summary_blocks)
+            blocks.extend(summary_blocks)
+            return blocks
+        if filter_action == 'truncate':
+            content = truncate_content(content, filter_rule.get('max_chars', MAX_TEXT_LENGTH))
+            kept_text = get_content_text(content)
+            record_filtered_message('truncate', content_text, kept_text)
+
+        handler = CONTENT_TYPE_HANDLERS.get((message.role, content_type)) or CONTENT_TYPE_HANDLERS.get(content_type)
+        if handler:
+            start = time.perf_counter()
+            content_blocks = handler(content, speaker_label, headers)
+            stats["seconds"] += time.perf_counter() - start
+            stats["blocks"] += len(content_blocks)
+            blocks.extend(content_blocks)
+            if filter_action == 'truncate' and len(kept_text) < len(content_text):
+                notice_blocks = text_to_blocks(f"✂️ 已截断 {len(content_text) - len(kept_text)} 字符")
+                stats["blocks"] += len(notice_blocks)
+                blocks.extend(notice_blocks)
+
+        # 附件作为文件块跟在消息内容之后
+        blocks.extend(render_attachments(message, headers))
 
-        # 移动到下一个节点
-        children = node.get('children', [])
-        current_id = children[0] if children and isinstance(children, list) else None
-    
-    # 警告：如果达到最大深度
-    if depth >= MAX_TRAVERSE_DEPTH:
-        tqdm.write(f"   ⚠️ 警告: 达到最大遍历深度 ({MAX_TRAVERSE_DEPTH})，对话可能不完整")
-    
     return blocks
 
-def import_conversation_to_notion(title, create_time, update_time, conversation_id, all_blocks, headers, database_id, db_info):
-    """导入单个对话到Notion数据库"""
-    if not all_blocks:
-        tqdm.write(f"   - 跳过空内容对话: {title}")
+def build_blocks_from_nodes(tree, nodes, headers, seen_canvas_docs=None):
+    """按顺序渲染一组节点的消息（生成器，逐条消息产出块）"""
+    if seen_canvas_docs is None:
+        seen_canvas_docs = set()  # Canvas 文档去重集合（按 textdoc_id）
+    messages = tree.messages
+    elapsed = 0.0  # 只统计渲染本身，不含下游消费块的时间
+    for node in nodes:
+        start = time.perf_counter()
+        # 页面在第一批块时就已创建，单条消息渲染出错只替换为提示块，不让整个对话失败（否则重新运行会创建重复页面）
+        try:
+            blocks = build_blocks_from_message(messages[node], headers, seen_canvas_docs)
+        except Exception as e:
+            content_type = messages[node].content_type if messages[node] else ''
+            tqdm.write(f"   ⚠️ 警告: 消息渲染失败 ({content_type or 'unknown'}): {e!r}")
+            count_conversation_event('fallbacks')
+            blocks = text_to_blocks(f"⚠️ 此消息无法渲染 ({content_type or 'unknown'}: {type(e).__name__})")
+        elapsed += time.perf_counter() - start
+        yield from blocks
+    PHASE_TIMINGS['block_build'].append(elapsed)
+
+def get_message_preview(message, limit=50):
+    """消息文本的单行简短预览（用于分支标签）"""
+    content = (message.content if message else None) or {}
+    text = "".join(part for part in content.get('parts') or [] if isinstance(part, str)) or content.get('text') or ""
+    text = " ".join(text.split())
+    return text[:limit] + "..." if len(text) > limit else text
+
+def iter_alternate_branches(tree, path):
+    """迭代遍历显示路径之外的对话树，逐个产出 (分叉节点编号, 分支节点编号列表)
+
+    只产出分叉点之后的部分，与显示路径共享的前缀不会重复。
+    """
+    seen = bytearray(len(tree))  # 每个节点编号的已访问标记
+    for node in path:
+        seen[node] = 1
+
+    # 用栈代替递归：(分叉节点, 分支起始节点)，路径上靠前的分支先处理
+    stack = []
+    for node in reversed(path):
+        for child in reversed(tree.children[node] or ()):
+            if not seen[child]:
+                stack.append((node, child))
+
+    while stack:
+        parent, node = stack.pop()
+        branch = []
+        while not seen[node]:
+            seen[node] = 1
+            branch.append(node)
+            children = [c for c in tree.children[node] or () if not seen[c]]
+            if not children:
+                break
+            # 沿最新的子节点前进，其余子节点各自成为新的分支
+            for alt in reversed(children[:-1]):
+                stack.append((node, alt))
+            node = children[-1]
+        if branch:
+            yield parent, branch
+
+def iter_branch_sections(conversation_data, headers, tree=None):
+    """将其他分支作为 toggle 区块：逐个产出 (标签, 构建分支块的函数)，追加时才延迟构建"""
+    if tree is None:
+        tree = build_conversation_tree(conversation_data)
+    path = get_conversation_path(tree)
+    for n, (parent, branch) in enumerate(iter_alternate_branches(tree, path), 1):
+        preview = get_message_preview(tree.messages[parent])
+        label = f"🔀 分支 {n} ({len(branch)} 条消息，接在: {preview or '对话开头'})"
+        yield label, (lambda branch=branch: build_blocks_from_nodes(tree, branch, headers))
+
+# 创建 / 更新 Canvas 文档的工具调用（参数为 JSON），对应的工具响应消息携带 textdoc_id
+CANVAS_TOOL_CALLS = ('canmore.create_textdoc', 'canmore.update_textdoc')
+
+def parse_canvas_call(message):
+    """解析 canmore 工具调用的 JSON 参数，无法解析时返回 None"""
+    try:
+        arguments = json.loads(message.content.get('text') or '')
+    except (ValueError, TypeError, AttributeError):
+        return None
+    return arguments if isinstance(arguments, dict) else None
+
+def is_canvas_rewrite(update):
+    """是否为整篇重写（pattern 为 .* 的更新会替换整个文档）"""
+    return update.get('pattern') in ('.*', '^.*$', '(?s).*')
+
+def apply_canvas_updates(content, updates):
+    """依次应用 canmore 更新中的正则替换（replacement 按字面文本处理）"""
+    for update in updates:
+        pattern = update.get('pattern')
+        replacement = update.get('replacement') or ''
+        if not isinstance(pattern, str):
+            continue
+        try:
+            content = re.sub(pattern, lambda match: replacement, content, count=0 if update.get('multiple') else 1)
+        except re.error:
+            # 无效的正则：跳过这一处更新
+            continue
+    return content
+
+def collect_canvas_documents(tree, path):
+    """单次遍历显示路径，收集每个 Canvas 文档的最终版本：textdoc_id -> 标题、类型、版本、内容
+
+    整篇重写会丢弃之前的内容和更新，只有最后一次整篇重写之后的更新在最后才应用，中间版本不会被逐一还原。
+    """
+    documents = {}
+    pending = None  # 等待携带 textdoc_id 的工具响应：(工具名, 参数)
+    for node in path:
+        message = tree.messages[node]
+        if not message:
+            continue
+        if message.recipient in CANVAS_TOOL_CALLS:
+            pending = (message.recipient, parse_canvas_call(message))
+            continue
+
+        canvas_meta = message.metadata.get('canvas')
+        if not (pending and isinstance(canvas_meta, dict) and canvas_meta.get('textdoc_id')):
+            continue
+        tool_name, arguments = pending
+        pending = None
+        if not arguments:
+            continue
+
+        textdoc_id = canvas_meta['textdoc_id']
+        if tool_name == 'canmore.create_textdoc':
+            documents[textdoc_id] = {
+                "title": arguments.get('name') or canvas_meta.get('title'),
+                "type": arguments.get('type') or canvas_meta.get('textdoc_type') or 'document',
+                "version": canvas_meta.get('version'),
+                "content": arguments.get('content') or '',
+                "updates": []
+            }
+        elif textdoc_id in documents:
+            document = documents[textdoc_id]
+            document['version'] = canvas_meta.get('version', document['version'])
+            for update in arguments.get('updates') or []:
+                if not isinstance(update, dict):
+                    continue
+                if is_canvas_rewrite(update):
+                    document['content'] = update.get('replacement') or ''
+                    document['updates'] = []
+                else:
+                    document['updates'].append(update)
+
+    for document in documents.values():
+        document['content'] = apply_canvas_updates(document['content'], document.pop('updates'))
+    return documents
+
+def canvas_to_blocks(document):
+    """将 Canvas 文档内容渲染为块：代码文档为代码块，其他按 markdown 渲染（RENDER_MARKDOWN 关闭时为段落）"""
+    content = document['content']
+    if not content.strip():
+        return []
+    if document['type'].startswith('code/'):
+        language = get_safe_language_type(document['type'].split('/', 1)[1])
+        return [make_text_block('code', chunk, language) for chunk in split_long_text(content)]
+    if RENDER_MARKDOWN:
+        return list(iter_markdown_blocks(content))
+    return text_to_blocks(content)
+
+def iter_canvas_sections(tree):
+    """Canvas 文档作为 toggle 区块：逐个产出 (标签, 构建文档块的函数)"""
+    documents = collect_canvas_documents(tree, get_conversation_path(tree))
+    for textdoc_id, document in documents.items():
+        label = f"📄 Canvas: {document['title'] or textdoc_id} (版本 {document['version']})"
+        yield label, (lambda document=document: canvas_to_blocks(document))
+
+def get_conversation_sections(conversation, headers, tree):
+    """追加在页面末尾的 toggle 区块: Canvas 文档，以及（全分支模式下的）其他分支"""
+    sections = iter_canvas_sections(tree) if IMPORT_CANVAS_DOCUMENTS else iter(())
+    if IMPORT_ALL_BRANCHES or os.getenv("IMPORT_ALL_BRANCHES") == "1":
+        sections = itertools.chain(sections, iter_branch_sections(conversation, headers, tree))
+    return sections
+
+def build_blocks_from_conversation(conversation_data, headers, tree=None):
+    """从对话数据构建Notion块，增加了安全保护（返回生成器，块在追加阶段消费时才构建）"""
+    if tree is None:
+        tree = build_conversation_tree(conversation_data)
+
+    # 遍历对话中显示的路径
+    return build_blocks_from_nodes(tree, get_conversation_path(tree), headers)
+
+def quarantine_block(conversation_id, title, block, error_msg):
+    """记录无法追加的块，便于事后排查"""
+    record = {
+        "time": datetime.datetime.now().isoformat(),
+        "conversation_id": conversation_id,
+        "title": title,
+        "error": error_msg,
+        "block": block
+    }
+    try:
+        with open(QUARANTINE_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except Exception as e:
+        tqdm.write(f"   ⚠️ 警告: 无法写入隔离文件: {e}")
+
+def append_blocks_with_bisection(append_url, blocks, headers, conversation_id, title, error_msg=""):
+    """将失败批次递归对半拆分后重新追加，以 O(log n) 次请求定位问题块（保持顺序）"""
+    if len(blocks) == 1:
+        return append_single_failed_block(append_url, blocks[0], headers, conversation_id, title, error_msg)
+
+    successful_blocks = 0
+    mid = len(blocks) // 2
+    # 先左半后右半，保证页面中块的顺序不变
+    for half in (blocks[:mid], blocks[mid:]):
+        try:
+            throttle(0.4)
+            with timed_phase('retry'):
+                notion_request(
+                    'PATCH',
+                    append_url,
+                    headers=headers,
+                    data=json.dumps({"children": half}),
+                    timeout=30
+                ).raise_for_status()
+            successful_blocks += len(half)
+        except requests.exceptions.RequestException as e:
+            half_error = e.response.text if e.response is not None else str(e)
+            successful_blocks += append_blocks_with_bisection(append_url, half, headers, conversation_id, title, half_error)
+    return successful_blocks
+
+def append_single_failed_block(append_url, block, headers, conversation_id, title, error_msg=""):
+    """对定位出的问题块做最后一次尝试：按300字拆分后一次请求发送，仍失败则隔离"""
+    count_conversation_event('single_block_fallbacks')
+    block_type = block.get('type')
+    if block_type in ('paragraph', 'code'):
+        original_txt = "".join(t['text']['content'] for t in block[block_type]['rich_text'])
+        tiny_chunks = split_long_text(original_txt, max_length=300)
+        if len(tiny_chunks) > 1:
+            tiny_blocks = []
+            for tiny in tiny_chunks:
+                tiny_block = {"type": block_type, block_type: {"rich_text": [{"type": "text", "text": {"content": tiny}}]}}
+                if block_type == 'code':
+                    tiny_block['code']['language'] = block['code'].get('language', 'text')
+                tiny_blocks.append(tiny_block)
+            try:
+                throttle(0.4)
+                with timed_phase('retry'):
+                    notion_request(
+                        'PATCH',
+                        append_url,
+                        headers=headers,
+                        data=json.dumps({"children": tiny_blocks}),
+                        timeout=30
+                    ).raise_for_status()
+                return 1
+            except requests.exceptions.RequestException as e:
+                error_msg = e.response.text if e.response is not None else str(e)
+
+    tqdm.write(f"   -   ...🚫 块已隔离 ({block_type})，详见 {QUARANTINE_FILE}")
+    quarantine_block(conversation_id, title, block, error_msg)
+    count_conversation_event('blocks_dropped')
+    return 0
+
+def make_text_block(block_type, content, language=None):
+    """构建只含一个 rich_text 项的段落 / 代码块"""
+    block = {
+        "type": block_type,
+        block_type: {
+            "rich_text": [{"type": "text", "text": {"content": content}}]
+        }
+    }
+    if block_type == 'code':
+        block['code']['language'] = language or 'text'
+    return block
+
+def prepare_block(block):
+    """验证和清理单个块，返回结果块列表；JSON 过大的块进一步分割而不是跳过"""
+    validated_block = validate_block_content(block)
+    if not validated_block:
+        return []
+
+    block_type = validated_block['type']
+    block_json_size = len(json.dumps(validated_block, ensure_ascii=False))
+    if block_json_size <= 1000 or block_type not in ('paragraph', 'code'):
+        # 大小合适，或图片等其他类型的块直接添加
+        return [validated_block]
+
+    tqdm.write(f"   - 🔄 分割过大的块 ({block_json_size} 字符)")
+    language = validated_block['code']['language'] if block_type == 'code' else None
+    original_content = validated_block[block_type]['rich_text'][0]['text']['content']
+    pieces = []
+    for chunk in split_long_text(original_content, max_length=800):
+        if not chunk.strip():
+            continue
+        smaller_block = make_text_block(block_type, chunk, language)
+        # 分割后仍然过大（转义字符较多）：再分割一次
+        if len(json.dumps(smaller_block, ensure_ascii=False)) > 1000:
+            for small_chunk in split_long_text(chunk, max_length=600):
+                if small_chunk.strip():
+                    pieces.append(make_text_block(block_type, small_chunk, language))
+        else:
+            pieces.append(smaller_block)
+    return pieces
+
+def prepare_blocks(all_blocks):
+    """验证和清理所有块（生成器），清理耗时按对话记录为 cleaning 阶段，构建 / 丢弃的块数计入对话指标"""
+    elapsed = 0.0
+    built, dropped = 0, 0
+    try:
+        for block in all_blocks:
+            start = time.perf_counter()
+            prepared = prepare_block(block)
+            elapsed += time.perf_counter() - start
+            built += 1
+            dropped += not prepared
+            yield from prepared
+        PHASE_TIMINGS['cleaning'].append(elapsed)
+    finally:
+        # 页面创建失败时流不会被读完，已处理的部分仍然计入
+        count_conversation_event('blocks_built', built)
+        count_conversation_event('blocks_dropped', dropped)
+
+def compact_blocks(blocks):
+    """将同一说话者的连续段落在 Notion 限制内打包成尽量少的块（每段一个 rich_text 项，生成器）"""
+    current = None  # 正在打包的段落块
+    current_chars = 0
+    current_speaker = None
+
+    for block in blocks:
+        if block.get('type') != 'paragraph':
+            if current is not None:
+                yield current
+                current = None
+            # 标题、代码、图片和 toggle 结束当前说话人的段落，之后无标签的段落不再并入
+            current_speaker = None
+            yield block
+            continue
+
+        items = block['paragraph']['rich_text']
+        label_match = SPEAKER_LABEL_PATTERN.match(items[0]['text']['content']) if items else None
+        speaker = label_match.group(0) if label_match else current_speaker
+        block_chars = sum(len(item['text']['content']) for item in items)
+
+        # 无标签的段落只接续以说话人标签开头的段落
+        if (current is not None and speaker is not None and speaker == current_speaker
+                and len(current['paragraph']['rich_text']) + len(items) <= NOTION_MAX_RICH_TEXT_ITEMS
+                and current_chars + block_chars <= COMPACT_BLOCK_MAX_CHARS):
+            # 同一说话者的新消息用空行分隔，同一消息的分片用换行分隔
+            separator = "\n\n" if label_match else "\n"
+            current['paragraph']['rich_text'][-1]['text']['content'] += separator
+            current['paragraph']['rich_text'].extend(
+                {"type": "text", "text": {"content": item['text']['content']}} for item in items
+            )
+            current_chars += block_chars + len(separator)
+        else:
+            if current is not None:
+                yield current
+            current = {
+                "type": "paragraph",
+                "paragraph": {
+                    "rich_text": [{"type": "text", "text": {"content": item['text']['content']}} for item in items]
+                }
+            }
+            current_chars = block_chars
+        current_speaker = speaker
+
+    if current is not None:
+        yield current
+
+def iter_batches(blocks, max_blocks=APPEND_BATCH_SIZE, max_chars=BATCH_PAYLOAD_LIMIT, first_max_blocks=None):
+    """按块数和 JSON 总字符数双重限制将块分批（生成器，保持顺序）
+
+    first_max_blocks：第一批使用不同的块数上限（如随页面创建一起发送的子块）。
+    """
+    limit = first_max_blocks or max_blocks
+    current, current_size = [], 0
+    for block in blocks:
+        block_size = len(json.dumps(block, ensure_ascii=False))
+        if current and (len(current) >= limit or current_size + block_size > max_chars):
+            yield current
+            current, current_size = [], 0
+            limit = max_blocks
+        current.append(block)
+        current_size += block_size
+    if current:
+        yield current
+
+def count_blocks(blocks, stats, key):
+    """原样传递块，同时把数量计入 stats[key]（流式处理中的块数统计）"""
+    stats[key] = 0
+    for block in blocks:
+        stats[key] += 1
+        yield block
+
+def append_toggle_section(page_id, label, section_blocks, headers, conversation_id, title):
+    """向页面追加一个折叠的 toggle 块，区块内容作为其子块嵌套"""
+    batches = iter_batches(section_blocks)
+    first_batch = next(batches, None)
+    if not first_batch:
         return True
+    tqdm.write(f"   - 🔀 追加区块: {label}")
+
+    toggle_block = {
+        "type": "toggle",
+        "toggle": {
+            "rich_text": [{"type": "text", "text": {"content": clean_text_content(label)}}],
+            "children": first_batch
+        }
+    }
+    page_append_url = f"{NOTION_API_BASE_URL}/blocks/{page_id}/children"
+
+    try:
+        throttle(0.5)
+        with timed_phase('append'):
+            response = notion_request(
+                'PATCH',
+                page_append_url,
+                headers=headers,
+                data=json.dumps({"children": [toggle_block]}),
+                timeout=30
+            )
+        response.raise_for_status()
+        RUN_METRICS["blocks_appended"] += len(first_batch)
+        remaining_batches = batches
+    except requests.exceptions.RequestException:
+        # 嵌套内容失败：先创建空 toggle，再逐批追加内容
+        count_conversation_event('fallbacks')
+        del toggle_block['toggle']['children']
+        try:
+            throttle(0.5)
+            with timed_phase('retry'):
+                response = notion_request(
+                    'PATCH',
+                    page_append_url,
+                    headers=headers,
+                    data=json.dumps({"children": [toggle_block]}),
+                    timeout=30
+                )
+            response.raise_for_status()
+            remaining_batches = itertools.chain([first_batch], batches)
+        except requests.exceptions.RequestException as e:
+            error_msg = e.response.text if e.response is not None else str(e)
+            tqdm.write(f"   -   ...❌ toggle 块追加失败: {error_msg}")
+            return False
+
+    toggle_append_url = f"{NOTION_API_BASE_URL}/blocks/{response.json()['results'][0]['id']}/children"
+    for batch in remaining_batches:
+        try:
+            throttle(0.5)
+            with timed_phase('append'):
+                notion_request(
+                    'PATCH',
+                    toggle_append_url,
+                    headers=headers,
+                    data=json.dumps({"children": batch}),
+                    timeout=30
+                ).raise_for_status()
+            RUN_METRICS["blocks_appended"] += len(batch)
+        except requests.exceptions.RequestException as e:
+            error_msg = e.response.text if e.response is not None else str(e)
+            count_conversation_event('fallbacks')
+            RUN_METRICS["blocks_appended"] += append_blocks_with_bisection(toggle_append_url, batch, headers, conversation_id, title, error_msg)
+    return True
 
+def import_conversation_to_notion(title, create_time, update_time, conversation_id, all_blocks, headers, database_id, db_info, sections=None):
+    """导入单个对话到Notion数据库（sections：可选的额外 toggle 区块，如其他分支）"""
     # 限制标题长度，避免Notion API错误
     if len(title) > 100:
         title = title[:97] + "..."
@@ -663,67 +2547,31 @@ def import_conversation_to_notion(title, create_time, update_time, conversation_
     # 清理标题内容
     title = clean_text_content(title)
 
-    # 验证和清理所有块内容
-    cleaned_blocks = []
-    for block in all_blocks:
-        validated_block = validate_block_content(block)
-        if validated_block:
-            # 额外检查：如果单个块的JSON表示太大，进一步分割而不是跳过
-            block_json_size = len(json.dumps(validated_block, ensure_ascii=False))
-            if block_json_size > 1000:  # 需要进一步分割的块
-                tqdm.write(f"   - 🔄 分割过大的块 ({block_json_size} 字符)")
-                
-                # 获取块的文本内容进行分割
-                if validated_block['type'] == 'paragraph':
-                    original_content = validated_block['paragraph']['rich_text'][0]['text']['content']
-                    # 将内容分割成更小的块
-                    smaller_chunks = split_long_text(original_content, max_length=800)
-                    for chunk in smaller_chunks:
-                        if chunk.strip():
-                            smaller_block = {
-                                "type": "paragraph",
-                                "paragraph": {
-                                    "rich_text": [{"type": "text", "text": {"content": chunk}}]
-                                }
-                            }
-                            cleaned_blocks.append(smaller_block)
-                elif validated_block['type'] == 'code':
-                    original_content = validated_block['code']['rich_text'][0]['text']['content']
-                    language = validated_block['code']['language']
-                    # 将代码分割成更小的块
-                    smaller_chunks = split_long_text(original_content, max_length=800)
-                    for chunk in smaller_chunks:
-                        if chunk.strip():
-                            smaller_block = {
-                                "type": "code",
-                                "code": {
-                                    "rich_text": [{"type": "text", "text": {"content": chunk}}],
-                                    "language": language
-                                }
-                            }
-                            cleaned_blocks.append(smaller_block)
-                else:
-                    # 其他类型的块直接添加，如图片块
-                    cleaned_blocks.append(validated_block)
-            else:
-                cleaned_blocks.append(validated_block)
-    
-    if not cleaned_blocks:
-        tqdm.write(f"   - 跳过空内容对话（清理后无有效块）: {title}")
+    # 块以流水线方式处理：构建 -> 验证清理 -> 打包段落（减少块数进而减少追加请求）-> 分批，内存占用以一批为上限
+    block_stats = {}
+    block_stream = count_blocks(prepare_blocks(count_blocks(all_blocks, block_stats, 'original')), block_stats, 'cleaned')
+    if COMPACT_BLOCKS:
+        block_stream = compact_blocks(block_stream)
+    block_stream = count_blocks(block_stream, block_stats, 'compacted')
+    batches = iter_batches(block_stream, first_max_blocks=INITIAL_CHILDREN_LIMIT if CREATE_PAGE_WITH_CHILDREN else None)
+
+    first_batch = next(batches, None)
+    if not first_batch:
+        if block_stats['original']:
+            tqdm.write(f"   - 跳过空内容对话（清理后无有效块）: {title}")
+        else:
+            tqdm.write(f"   - 跳过空内容对话: {title}")
         return True
 
-    # 调试信息：显示清理前后的块数量
-    tqdm.write(f"   - 调试: 原始块数 {len(all_blocks)} -> 清理后块数 {len(cleaned_blocks)}")
-
-    # ========== 新策略：先创建空页面，再追加所有块 ==========
-    # 页面创建时不携带 children，可大幅降低 400 报错概率
-    initial_blocks: list = []  # 保持空列表
-    remaining_blocks: list = cleaned_blocks  # 全量内容稍后分批追加
-
-    # 将剩余 blocks 分成更小的批次（最多 20 个/批）
-    block_chunks = [remaining_blocks[i:i + 20] for i in range(0, len(remaining_blocks), 20)]
-    initial_payload_size = 0  # 空载荷
-    tqdm.write(f"   - 分块策略: 创建空页面，后续 {len(block_chunks)} 批次追加")
+    # ========== 页面创建策略 ==========
+    # 第一批预校验过的块随页面创建一起发送，每个对话节省一次请求；
+    # 若创建时校验失败，则回退为先创建空页面、再追加全部块
+    if CREATE_PAGE_WITH_CHILDREN:
+        initial_blocks: list = first_batch
+    else:
+        initial_blocks = []
+        batches = itertools.chain([first_batch], batches)  # 剩余内容稍后分批追加（边构建边发送）
+    tqdm.write(f"   - 分块策略: 创建页面时携带 {len(initial_blocks)} 个块，其余内容边构建边分批追加")
 
     # 使用检测到的属性名称
     title_property = db_info.get('title_property', 'Title')
@@ -754,15 +2602,8 @@ def import_conversation_to_notion(title, create_time, update_time, conversation_
     # 添加对话ID属性（如果存在）
     if conversation_id_property:
         if conversation_id_type == 'number':
-            try:
-                if conversation_id.replace('-', '').isdigit():
-                    number_value = int(conversation_id.replace('-', ''))
-                else:
-                    number_value = abs(hash(conversation_id)) % (10 ** 10)
-                properties[conversation_id_property] = {"number": number_value}
-            except (ValueError, TypeError):
-                number_value = abs(hash(conversation_id)) % (10 ** 10)
-                properties[conversation_id_property] = {"number": number_value}
+            # 稳定编码（hash() 每个进程随机化），每次运行得到相同的值
+            properties[conversation_id_property] = {"number": encode_conversation_id_number(conversation_id)}
         else:
             properties[conversation_id_property] = {
                 "rich_text": [{"type": "text", "text": {"content": conversation_id}}]
@@ -772,19 +2613,41 @@ def import_conversation_to_notion(title, create_time, update_time, conversation_
         "parent": {"database_id": database_id},
         "properties": properties
     }
+    if initial_blocks:
+        create_payload["children"] = initial_blocks
 
     # 创建页面
     try:
-        response = requests.post(
-            f"{NOTION_API_BASE_URL}/pages",
-            headers=headers,
-            data=json.dumps(create_payload),
-            timeout=30
-        )
+        with timed_phase('page_create'):
+            response = notion_request(
+                'POST',
+                f"{NOTION_API_BASE_URL}/pages",
+                headers=headers,
+                data=json.dumps(create_payload),
+                timeout=30
+            )
+        # 携带内容创建时校验失败：回退为空页面，所有块稍后追加
+        if response.status_code == 400 and initial_blocks:
+            tqdm.write("   - ⚠️ 携带内容创建页面校验失败，回退为空页面+追加")
+            count_conversation_event('fallbacks')
+            debug_failed_payload(create_payload, response, title)
+            batches = itertools.chain(iter_batches(initial_blocks), batches)
+            initial_blocks = []
+            del create_payload["children"]
+            throttle(0.3)
+            with timed_phase('retry'):
+                response = notion_request(
+                    'POST',
+                    f"{NOTION_API_BASE_URL}/pages",
+                    headers=headers,
+                    data=json.dumps(create_payload),
+                    timeout=30
+                )
         response.raise_for_status()
         page_data = response.json()
         page_id = page_data["id"]
-        tqdm.write(f"   - ✅ 页面创建成功: {title}")
+        RUN_METRICS["blocks_appended"] += len(initial_blocks)
+        tqdm.write(f"   - ✅ 页面创建成功 (携带 {len(initial_blocks)} 个块): {title}")
     except requests.exceptions.RequestException as e:
         global DEBUG_FIRST_FAILURE
         error_msg = ""
@@ -827,6 +2690,7 @@ def import_conversation_to_notion(title, create_time, update_time, conversation_
             tqdm.write(f"   - 载荷大小: {len(str(create_payload))} 字符 (过长，已省略)")
             tqdm.write(f"   - 块数量: {len(initial_blocks)}")
         
+        count_conversation_event('fallbacks')
         # 尝试创建简化版本（只有标题，无内容块）
         try:
             tqdm.write(f"   - 🔄 尝试创建简化版本（仅标题）...")
@@ -846,12 +2710,14 @@ def import_conversation_to_notion(title, create_time, update_time, conversation_
                 "properties": safe_properties
             }
             
-            response = requests.post(
-                f"{NOTION_API_BASE_URL}/pages",
-                headers=headers,
-                data=json.dumps(simple_payload),
-                timeout=30
-            )
+            with timed_phase('retry'):
+                response = notion_request(
+                    'POST',
+                    f"{NOTION_API_BASE_URL}/pages",
+                    headers=headers,
+                    data=json.dumps(simple_payload),
+                    timeout=30
+                )
             response.raise_for_status()
             page_data = response.json()
             page_id = page_data["id"]
@@ -859,7 +2725,7 @@ def import_conversation_to_notion(title, create_time, update_time, conversation_
             
             # 之后再尝试更新属性（分开请求降低失败风险）
             try:
-                time.sleep(0.3)
+                throttle(0.3)
                 update_properties = {}
                 
                 # 逐个添加属性，失败了也不影响其他的
@@ -873,24 +2739,25 @@ def import_conversation_to_notion(title, create_time, update_time, conversation_
                 
                 if conversation_id_property and conversation_id_type == 'number':
                     try:
-                        number_value = abs(hash(conversation_id)) % (10**8)  # 更小的数字
-                        update_properties[conversation_id_property] = {"number": number_value}
+                        update_properties[conversation_id_property] = {"number": encode_conversation_id_number(conversation_id)}
                     except:
                         pass
                 
                 if update_properties:
-                    requests.patch(
-                        f"{NOTION_API_BASE_URL}/pages/{page_id}",
-                        headers=headers,
-                        data=json.dumps({"properties": update_properties}),
-                        timeout=30
-                    )
+                    with timed_phase('retry'):
+                        notion_request(
+                            'PATCH',
+                            f"{NOTION_API_BASE_URL}/pages/{page_id}",
+                            headers=headers,
+                            data=json.dumps({"properties": update_properties}),
+                            timeout=30
+                        )
             except:
                 pass  # 更新属性失败也没关系，至少页面创建了
             
             # 尝试添加一个简单的说明块
             try:
-                time.sleep(0.3)
+                throttle(0.3)
                 note_block = {
                     "type": "paragraph",
                     "paragraph": {
@@ -898,12 +2765,14 @@ def import_conversation_to_notion(title, create_time, update_time, conversation_
                     }
                 }
                 
-                requests.patch(
-                    f"{NOTION_API_BASE_URL}/blocks/{page_id}/children",
-                    headers=headers,
-                    data=json.dumps({"children": [note_block]}),
-                    timeout=30
-                )
+                with timed_phase('retry'):
+                    notion_request(
+                        'PATCH',
+                        f"{NOTION_API_BASE_URL}/blocks/{page_id}/children",
+                        headers=headers,
+                        data=json.dumps({"children": [note_block]}),
+                        timeout=30
+                    )
                 
             except:
                 pass  # 说明块失败也没关系
@@ -915,157 +2784,57 @@ def import_conversation_to_notion(title, create_time, update_time, conversation_
             tqdm.write(f"   - ❌ 简化版本也创建失败: {error_msg}")
             return False
 
-    # 如果还有剩余内容块，分批追加
-    if block_chunks and any(block_chunks):  # 检查是否有非空的块组
-        tqdm.write(f"   - 💬 检测到长对话，正在追加剩余内容 ({len(block_chunks)} 批次)...")
-        append_url = f"{NOTION_API_BASE_URL}/blocks/{page_id}/children"
-        
-        for i, chunk in enumerate(block_chunks):
-            if not chunk:  # 跳过空的块组
-                continue
-            
-            # 验证批次内容
-            validated_chunk = []
-            chunk_json_size = 0
-            
-            for block in chunk:
-                # 重新验证每个块
-                validated_block = validate_block_content(block)
-                if validated_block:
-                    block_size = len(json.dumps(validated_block, ensure_ascii=False))
-                    
-                    # 如果单个块太大，分割它而不是跳过
-                    if block_size > 1000:
-                        tqdm.write(f"   -   ...🔄 分割过大块 ({block_size} 字符)")
-                        
-                        # 分割逻辑
-                        if validated_block['type'] == 'paragraph':
-                            original_content = validated_block['paragraph']['rich_text'][0]['text']['content']
-                            smaller_chunks = split_long_text(original_content, max_length=600)
-                            for small_chunk in smaller_chunks:
-                                if small_chunk.strip():
-                                    smaller_block = {
-                                        "type": "paragraph",
-                                        "paragraph": {
-                                            "rich_text": [{"type": "text", "text": {"content": small_chunk}}]
-                                        }
-                                    }
-                                    smaller_size = len(json.dumps(smaller_block, ensure_ascii=False))
-                                    if (chunk_json_size + smaller_size) <= 50000:  # 进一步降低
-                                        validated_chunk.append(smaller_block)
-                                        chunk_json_size += smaller_size
-                        elif validated_block['type'] == 'code':
-                            original_content = validated_block['code']['rich_text'][0]['text']['content']
-                            language = validated_block['code']['language']
-                            smaller_chunks = split_long_text(original_content, max_length=600)
-                            for small_chunk in smaller_chunks:
-                                if small_chunk.strip():
-                                    smaller_block = {
-                                        "type": "code",
-                                        "code": {
-                                            "rich_text": [{"type": "text", "text": {"content": small_chunk}}],
-                                            "language": language
-                                        }
-                                    }
-                                    smaller_size = len(json.dumps(smaller_block, ensure_ascii=False))
-                                    if (chunk_json_size + smaller_size) <= 50000:  # 进一步降低
-                                        validated_chunk.append(smaller_block)
-                                        chunk_json_size += smaller_size
-                        else:
-                            # 其他类型（如图片）直接添加，但检查总大小
-                            if (chunk_json_size + block_size) <= 50000:  # 进一步降低
-                                validated_chunk.append(validated_block)
-                                chunk_json_size += block_size
-                    else:
-                        # 块大小合适，检查是否会超出批次限制
-                        if (chunk_json_size + block_size) <= 50000:  # 进一步降低
-                            validated_chunk.append(validated_block)
-                            chunk_json_size += block_size
+    # 剩余 blocks 边构建边分批追加（每批最多 APPEND_BATCH_SIZE 个块、BATCH_PAYLOAD_LIMIT 字符）
+    append_url = f"{NOTION_API_BASE_URL}/blocks/{page_id}/children"
+    for i, validated_chunk in enumerate(batches, 1):
+        if i == 1:
+            tqdm.write("   - 💬 检测到长对话，正在分批追加剩余内容...")
+        try:
+            throttle(0.5)  # 稍微增加延迟
+            payload = {"children": validated_chunk}
+            payload_size = len(json.dumps(payload, ensure_ascii=False))
             
-            if not validated_chunk:
-                tqdm.write(f"   -   ...⚠️ 批次 {i+1} 清理后为空，跳过")
-                continue
-                
-            try:
-                time.sleep(0.5)  # 稍微增加延迟
-                payload = {"children": validated_chunk}
-                payload_size = len(json.dumps(payload, ensure_ascii=False))
-                
-                # 🎯 进一步降低批次大小限制
-                if payload_size > 400000:  # 从2500降低到1500
-                    tqdm.write(f"   -   ...⚠️ 批次 {i+1} 载荷过大 ({payload_size} 字符)，跳过")
-                    continue
-                
-                response = requests.patch(
+            with timed_phase('append'):
+                response = notion_request(
+                    'PATCH',
                     append_url,
                     headers=headers,
                     data=json.dumps(payload),
                     timeout=30
                 )
-                response.raise_for_status()
-                tqdm.write(f"   -   ...追加批次 {i+1}/{len(block_chunks)} 成功 ({len(validated_chunk)} 个块, {payload_size} 字符)")
-            except requests.exceptions.RequestException as e:
-                error_msg = e.response.text if e.response else str(e)
-                tqdm.write(f"   -   ...❌ 追加批次 {i+1}/{len(block_chunks)} 失败: {error_msg}")
-                
-                # 🎯 新增：分析追加失败的原因
-                debug_failed_payload(payload, e.response, f"{title} - 批次{i+1}")
-                
-                # ========== 新增回退：逐块尝试插入，保留能成功的 ==========
-                tqdm.write(f"   -   ...⚙️ 回退到单块追加模式，逐块重试")
-                successful_blocks = 0
-                for k, single_block in enumerate(validated_chunk):
-                    single_payload = {"children": [single_block]}
-                    try:
-                        time.sleep(0.4)
-                        requests.patch(
-                            append_url,
-                            headers=headers,
-                            data=json.dumps(single_payload),
-                            timeout=30
-                        ).raise_for_status()
-                        successful_blocks += 1
-                    except requests.exceptions.RequestException:
-                        # ⚠️ 如果单块仍然失败，尝试将其再次分割为更小文本（300字）
-                        # 仅处理 paragraph / code
-                        try:
-                            if single_block.get('type') in ('paragraph', 'code'):
-                                txt_key = 'paragraph' if single_block['type'] == 'paragraph' else 'code'
-                                original_txt = single_block[txt_key]['rich_text'][0]['text']['content']
-                                tiny_chunks = split_long_text(original_txt, max_length=300)
-                                tiny_success = 0
-                                for tiny in tiny_chunks:
-                                    tiny_block = {
-                                        "type": single_block['type'],
-                                        txt_key: {
-                                            "rich_text": [{"type": "text", "text": {"content": tiny}}]
-                                        }
-                                    }
-                                    try:
-                                        time.sleep(0.2)
-                                        requests.patch(
-                                            append_url,
-                                            headers=headers,
-                                            data=json.dumps({"children": [tiny_block]}),
-                                            timeout=30
-                                        ).raise_for_status()
-                                        tiny_success += 1
-                                    except requests.exceptions.RequestException:
-                                        # 如果最小块还失败，就彻底放弃
-                                        pass
-                                if tiny_success:
-                                    successful_blocks += tiny_success  # 统计成功数
-                        except Exception:
-                            pass
-                        continue
-                tqdm.write(f"   -   ...单块追加完成，成功 {successful_blocks}/{len(validated_chunk)} 块")
-                # 不因单批失败而停止整体流程
-                continue
+            response.raise_for_status()
+            RUN_METRICS["blocks_appended"] += len(validated_chunk)
+            tqdm.write(f"   -   ...追加批次 {i} 成功 ({len(validated_chunk)} 个块, {payload_size} 字符)")
+        except requests.exceptions.RequestException as e:
+            error_msg = e.response.text if e.response else str(e)
+            tqdm.write(f"   -   ...❌ 追加批次 {i} 失败: {error_msg}")
+            
+            # 🎯 新增：分析追加失败的原因
+            debug_failed_payload(payload, e.response, f"{title} - 批次{i}")
+            
+            # ========== 回退：二分拆分失败批次，定位问题块 ==========
+            tqdm.write("   -   ...⚙️ 回退到二分模式，定位失败的块")
+            count_conversation_event('fallbacks')
+            successful_blocks = append_blocks_with_bisection(append_url, validated_chunk, headers, conversation_id, title, error_msg)
+            RUN_METRICS["blocks_appended"] += successful_blocks
+            tqdm.write(f"   -   ...二分追加完成，成功 {successful_blocks}/{len(validated_chunk)} 块")
+            # 不因单批失败而停止整体流程
+            continue
+
+    # 调试信息：显示清理前后的块数量（流式处理，全部追加后才知道）
+    tqdm.write(f"   - 调试: 原始块数 {block_stats['original']} -> 清理后块数 {block_stats['cleaned']} -> 打包后块数 {block_stats['compacted']}")
+
+    # 额外区块（如其他分支）放入折叠的 toggle 块，此时才构建内容
+    for label, build_section_blocks in sections or []:
+        section_blocks = prepare_blocks(build_section_blocks())
+        if COMPACT_BLOCKS:
+            section_blocks = compact_blocks(section_blocks)
+        append_toggle_section(page_id, label, section_blocks, headers, conversation_id, title)
 
     return True
 
-def clean_text_content(text):
-    """清理文本内容，移除可能导致API错误的字符"""
+def clean_text_content(text, normalize_whitespace=True):
+    """清理文本内容，移除可能导致API错误的字符（代码块传 normalize_whitespace=False，保留缩进和空行）"""
     if not isinstance(text, str):
         return str(text)
     
@@ -1132,7 +2901,7 @@ def clean_text_content(text):
     
     # 新增：移除过多的重复字符
     # 移除过多连续的相同字符（可能是错误输出）
-    cleaned = re.sub(r'(.)\1{10,}', r'\1\1\1[重复内容已清理]', cleaned)
+    cleaned = re.sub(r'(.)\1{10,}' if normalize_whitespace else r'(\S)\1{10,}', r'\1\1\1[重复内容已清理]', cleaned)
     
     # 新增：清理搜索结果内容
     # 移除ChatGPT搜索结果的特殊格式 # [0]Title - Website [url]
@@ -1207,8 +2976,9 @@ def clean_text_content(text):
     cleaned = '\n'.join(cleaned_lines)
     
     # 移除过多的连续空白字符
-    cleaned = re.sub(r'\n{3,}', '\n\n', cleaned)  # 最多保留两个连续换行
-    cleaned = re.sub(r' {3,}', '  ', cleaned)      # 最多保留两个连续空格
+    if normalize_whitespace:
+        cleaned = re.sub(r'\n{3,}', '\n\n', cleaned)  # 最多保留两个连续换行
+        cleaned = re.sub(r' {3,}', '  ', cleaned)      # 最多保留两个连续空格
     
     # 限制文本长度
     if len(cleaned) > MAX_TEXT_LENGTH:
@@ -1273,9 +3043,9 @@ def validate_block_content(block):
         
         block_type = block['type']
         
-        # 处理段落块
-        if block_type == 'paragraph' and 'paragraph' in block:
-            paragraph = block['paragraph']
+        # 处理段落块（以及标题 / 列表 / 引用等只含 rich_text 的块）
+        if block_type in TEXT_BLOCK_TYPES and block_type in block:
+            paragraph = block[block_type]
             if 'rich_text' in paragraph:
                 cleaned_rich_text = []
                 for text_obj in paragraph['rich_text']:
@@ -1294,8 +3064,8 @@ def validate_block_content(block):
                 
                 if cleaned_rich_text:
                     return {
-                        "type": "paragraph",
-                        "paragraph": {
+                        "type": block_type,
+                        block_type: {
                             "rich_text": cleaned_rich_text
                         }
                     }
@@ -1307,7 +3077,7 @@ def validate_block_content(block):
                 cleaned_rich_text = []
                 for text_obj in code['rich_text']:
                     if isinstance(text_obj, dict) and 'text' in text_obj and 'content' in text_obj['text']:
-                        content = clean_text_content(text_obj['text']['content'])
+                        content = clean_text_content(text_obj['text']['content'], normalize_whitespace=False)
                         
                         # 🎯 新增：代码块的激进清理
                         if any(pattern in content for pattern in ['[函数调用已清理]', 'open_url', 'search(', '1q43.blog']):
@@ -1342,9 +3112,13 @@ def validate_block_content(block):
                         }
                     }
         
-        # 处理图片块
-        elif block_type == 'image':
+        # 处理图片块，以及附件的文件 / PDF / 音频 / 视频块
+        elif block_type in ('image', 'file', 'pdf', 'audio', 'video'):
             return block
+
+        # 分割线
+        elif block_type == 'divider':
+            return {"type": "divider", "divider": {}}
         
         return None
         
@@ -1352,8 +3126,122 @@ def validate_block_content(block):
         print(f"   ⚠️ 警告: 清理块内容时出错: {e}")
         return None
 
+def get_payload_bytes(payload):
+    """请求体字节数（与导入时的 json.dumps 一致，ASCII 转义）"""
+    return len(json.dumps(payload))
+
+def plan_conversation(conversation):
+    """--plan: 离线计算导入一个对话会发送的请求数和字节数（使用与导入相同的块构建 / 校验 / 分批流程）"""
+    PLAN_STATE["uploads"] = []
+    tree = build_conversation_tree(conversation)
+    for reference in build_upload_plan(tree, get_conversation_path(tree)):
+        plan_file_upload(reference)
+
+    cost = {"id": conversation['id'], "title": conversation.get('title', 'Untitled'), "create": 0, "append": 0, "upload": 0,
+            "blocks": 0, "request_bytes": 0, "upload_bytes": 0, "throttle_s": 0.4}
+    block_stream = prepare_blocks(build_blocks_from_conversation(conversation, {}, tree))
+    if COMPACT_BLOCKS:
+        block_stream = compact_blocks(block_stream)
+    batches = iter_batches(block_stream, first_max_blocks=INITIAL_CHILDREN_LIMIT if CREATE_PAGE_WITH_CHILDREN else None)
+    first_batch = next(batches, None)
+    if first_batch:
+        # 页面属性只估算标题（数据库结构需要网络请求）
+        title = clean_text_content(cost["title"][:100])
+        create_payload = {"parent": {"database_id": NOTION_DATABASE_ID}, "properties": {"title": {"title": [{"type": "text", "text": {"content": title}}]}}}
+        if CREATE_PAGE_WITH_CHILDREN:
+            create_payload["children"] = first_batch
+        else:
+            batches = itertools.chain([first_batch], batches)
+        cost["create"] = 1
+        cost["blocks"] += len(first_batch) if CREATE_PAGE_WITH_CHILDREN else 0
+        cost["request_bytes"] += get_payload_bytes(create_payload)
+        for batch in batches:
+            cost["append"] += 1
+            cost["blocks"] += len(batch)
+            cost["request_bytes"] += get_payload_bytes({"children": batch})
+
+        for label, build_section_blocks in get_conversation_sections(conversation, {}, tree):
+            section_blocks = prepare_blocks(build_section_blocks())
+            if COMPACT_BLOCKS:
+                section_blocks = compact_blocks(section_blocks)
+            for i, batch in enumerate(iter_batches(section_blocks)):
+                # 第一批随 toggle 块一起发送，其余追加到 toggle 内
+                payload = {"children": batch}
+                if i == 0:
+                    payload = {"children": [{"type": "toggle", "toggle": {"rich_text": [{"type": "text", "text": {"content": clean_text_content(label)}}], "children": batch}}]}
+                cost["append"] += 1
+                cost["blocks"] += len(batch)
+                cost["request_bytes"] += get_payload_bytes(payload)
+
+    # 每个文件两个请求: 创建上传 + 发送内容
+    cost["upload"] = 2 * len(PLAN_STATE["uploads"])
+    cost["upload_bytes"] = sum(PLAN_STATE["uploads"])
+    cost["throttle_s"] += 0.5 * cost["append"]
+    cost["requests"] = cost["create"] + cost["append"] + cost["upload"]
+    cost["estimated_s"] = round(estimate_import_seconds(cost), 1)
+    return cost
+
+def estimate_import_seconds(cost):
+    """导入耗时估算: 受速率限制的下限与顺序执行（固定等待 + 请求延迟，上传并行）两者取大"""
+    sequential = cost["throttle_s"] + (cost["create"] + cost["append"] + cost["upload"] / UPLOAD_WORKERS) * PLAN_REQUEST_LATENCY
+    return max(cost["requests"] / PLAN_REQUEST_RATE, sequential)
+
+def format_duration(seconds):
+    if seconds >= 3600:
+        return f"{seconds / 3600:.1f} h"
+    return f"{seconds / 60:.1f} min" if seconds >= 60 else f"{seconds:.0f} s"
+
+def print_import_plan(costs, skipped):
+    """输出请求 / 字节总计、预计耗时和最耗时的对话，并写出每个对话的明细"""
+    totals = {key: sum(cost[key] for cost in costs) for key in ("create", "append", "upload", "requests", "blocks", "request_bytes", "upload_bytes", "throttle_s")}
+    totals["throttle_s"] = round(totals["throttle_s"], 1)
+    totals["estimated_s"] = round(estimate_import_seconds(totals), 1)
+    print("\n" + "="*50)
+    print(f"🧮 导入计划: {len(costs)} 个对话（跳过已处理 {skipped} 个）")
+    print(f"   请求: {totals['requests']}（创建页面 {totals['create']}，追加 {totals['append']}，上传 {totals['upload']}），共 {totals['blocks']} 个块")
+    print(f"   发送: 块内容 {totals['request_bytes'] / 1048576:.1f} MB，文件 {totals['upload_bytes'] / 1048576:.1f} MB")
+    print(f"   预计耗时: {format_duration(totals['estimated_s'])}（{PLAN_REQUEST_RATE} 请求/秒 下至少 {format_duration(totals['requests'] / PLAN_REQUEST_RATE)}，"
+          f"固定等待 {format_duration(totals['throttle_s'])}，假定延迟 {PLAN_REQUEST_LATENCY}s）")
+    if costs:
+        print(f"   最耗时的 {min(PLAN_TOP_N, len(costs))} 个对话:")
+        for cost in sorted(costs, key=lambda c: c["estimated_s"], reverse=True)[:PLAN_TOP_N]:
+            print(f"      {format_duration(cost['estimated_s']):>8}  {cost['requests']:5} 请求  {cost['blocks']:6} 块  "
+                  f"{(cost['request_bytes'] + cost['upload_bytes']) / 1048576:7.2f} MB  {cost['id']}  {cost['title'][:50]}")
+    if PLAN_REPORT_FILE:
+        with open(PLAN_REPORT_FILE, 'w', encoding='utf-8') as f:
+            json.dump({"rate": PLAN_REQUEST_RATE, "latency_s": PLAN_REQUEST_LATENCY, "totals": totals, "conversations": costs}, f, ensure_ascii=False, indent=2)
+        print(f"   📄 每个对话的明细: {PLAN_REPORT_FILE}")
+
+def plan_import():
+    """--plan: 不联网、不上传的试运行，构建并校验所有待导入对话的块，估算请求数、字节数和耗时"""
+    print("🧮 生成导入计划（离线，不会向 Notion 发送任何请求）...")
+    if not os.path.exists(CONVERSATIONS_JSON_PATH):
+        print(f"❌ 错误: 找不到对话文件 '{CONVERSATIONS_JSON_PATH}'")
+        sys.exit(1)
+    with open(CONVERSATIONS_JSON_PATH, 'r', encoding='utf-8') as f, timed_phase('json_load'):
+        all_conversations = json.load(f)
+    processed_ids = load_processed_ids()
+    conversations = [
+        conv for conv in all_conversations
+        if conv.get('id') not in processed_ids and 'title' in conv and 'mapping' in conv
+    ]
+
+    costs = []
+    PLAN_STATE["active"] = True
+    try:
+        for conversation in tqdm(reversed(conversations), total=len(conversations), desc="计划进度", unit="对话"):
+            try:
+                costs.append(plan_conversation(conversation))
+            except Exception as e:
+                tqdm.write(f"❌ 计划 '{conversation.get('title', '无标题')}' 时发生意外错误: {e}")
+            conversation.pop('mapping', None)
+    finally:
+        PLAN_STATE["active"] = False
+    print_import_plan(costs, len(processed_ids))
+
 def main():
     """主执行函数"""
+    run_start = time.perf_counter()
     print("🚀 启动 ChatGPT 到 Notion 导入器")
     
     # 验证配置
@@ -1400,12 +3288,13 @@ def main():
 
     # 读取对话数据
     try:
-        with open(CONVERSATIONS_JSON_PATH, 'r', encoding='utf-8') as f:
+        with open(CONVERSATIONS_JSON_PATH, 'r', encoding='utf-8') as f, timed_phase('json_load'):
             all_conversations = json.load(f)
         print(f"✅ 成功读取对话文件")
     except Exception as e:
         print(f"❌ 错误: 无法读取 conversations.json: {e}")
         sys.exit(1)
+    profile_checkpoint("JSON 加载后")
 
     # ====== 快速测试模式：仅挑选包含图片或 Canvas 的对话 ======
     if QUICK_TEST_MODE:
@@ -1474,6 +3363,7 @@ def main():
         return
 
     print(f"\n▶️ 开始处理 {total_to_process} 个新对话...")
+    start_metrics_exporters(total_to_process)
     success_count, fail_count = 0, 0
     
     # 按时间倒序处理，最新的对话优先导入
@@ -1482,11 +3372,21 @@ def main():
                            desc="导入进度", 
                            unit="对话"):
         conv_id = conversation['id']
+        profile_conversation_start(conv_id)
         conv_title = conversation.get('title', 'Untitled')
+        start_conversation_metrics(conv_id, conv_title)
+        success = False
         
         try:
-            # 构建Notion块
-            blocks = build_blocks_from_conversation(conversation, headers)
+            # 构建Notion块（紧凑对话树只构建一次，与分支区块共用）
+            tree = build_conversation_tree(conversation)
+
+            # 上传计划：对话引用的所有文件在组装页面前并行上传
+            upload_planned_files(build_upload_plan(tree, get_conversation_path(tree)), headers)
+            blocks = build_blocks_from_conversation(conversation, headers, tree)
+
+            # Canvas 文档与（全分支模式下的）其他分支以 toggle 块形式延迟追加
+            sections = get_conversation_sections(conversation, headers, tree)
             
             # 导入到Notion
             success = import_conversation_to_notion(
@@ -1497,7 +3397,8 @@ def main():
                 all_blocks=blocks,
                 headers=headers,
                 database_id=NOTION_DATABASE_ID,
-                db_info=db_info
+                db_info=db_info,
+                sections=sections
             )
 
             if success:
@@ -1511,8 +3412,15 @@ def main():
             fail_count += 1
             tqdm.write(f"❌ 处理 '{conv_title}' 时发生意外错误: {e}")
 
+        # 原始 mapping 不再需要，释放它使内存随导入进度逐步减少
+        conversation.pop('mapping', None)
+        profile_conversation_end(conv_id)
+        finish_conversation_metrics(success)
+        RUN_METRICS.update(conversations_success=success_count, conversations_failed=fail_count)
+        RUN_METRICS["conversations_pending"] -= 1
+
         # 避免API速率限制
-        time.sleep(0.4)
+        throttle(0.4)
 
     # 输出最终结果
     print("\n" + "="*50)
@@ -1522,9 +3430,18 @@ def main():
         print(f"🔴 导入失败: {fail_count} 个对话")
         print("   💡 失败的对话将在下次运行时重试")
     print(f"⏭️  跳过 (已处理): {len(processed_ids)} 个对话")
+    print_content_handler_stats()
+    print_message_filter_stats()
+    print_conversation_report()
+    print_http_trace_summary()
+    print_performance_report(time.perf_counter() - run_start, success_count, fail_count)
     
     if success_count > 0:
         print(f"\n✨ 请到你的Notion数据库查看导入的 {success_count} 个对话!")
 
 if __name__ == "__main__":
-    main() 
+    try:
+        run_profiled(plan_import if "--plan" in sys.argv[1:] else main)
+    finally:
+        # 异常和 Ctrl+C 时同样关闭指标端点，文本文件写入最终值
+        stop_metrics_exporters()
@@ -19,6 +19,23 @@ import os
 import mimetypes
 import sys
 import tempfile
+import hashlib
+import itertools
+import math
+import bisect
+import logging
+import threading
+import heapq
+import cProfile
+import pstats
+import tracemalloc
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+from urllib.parse import urlparse
 from tqdm import tqdm
 import re
 
@@ -69,70 +86,817 @@ def validate_config():
     
     return True
 
+def detect_database_properties(properties):
+    """Derive title / time / conversation ID property names from database property structure"""
+    # Find various types of properties
+    title_property = None
+    created_time_property = None
+    updated_time_property = None
+    conversation_id_property = None
+    conversation_id_type = None
+    
+    for prop_name, prop_info in properties.items():
+        prop_type = prop_info.get('type')
+        prop_name_lower = prop_name.lower()
+        
+        if prop_type == 'title':
+            title_property = prop_name
+        elif prop_type in ['date', 'created_time']:
+            if 'created' in prop_name_lower or 'create' in prop_name_lower:
+                created_time_property = prop_name
+            elif 'updated' in prop_name_lower or 'update' in prop_name_lower or 'modified' in prop_name_lower:
+                updated_time_property = prop_name
+        elif prop_type in ['rich_text', 'number']:
+            if ('conversation' in prop_name_lower and 'id' in prop_name_lower) or prop_name_lower == 'conversation id':
+                conversation_id_property = prop_name
+                conversation_id_type = prop_type
+    
+    return {
+        'title_property': title_property or 'Title',
+        'created_time_property': created_time_property,
+        'updated_time_property': updated_time_property, 
+        'conversation_id_property': conversation_id_property,
+        'conversation_id_type': conversation_id_type,
+        'properties': properties
+    }
+
+def load_database_schema_cache():
+    """Load on-disk database schema cache (database_id -> cached detection result)"""
+    if not os.path.exists(DATABASE_SCHEMA_CACHE_FILE):
+        return {}
+    try:
+        with open(DATABASE_SCHEMA_CACHE_FILE, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except Exception as e:
+        print(f"Warning: Unable to read database schema cache: {e}")
+        return {}
+
+def save_database_schema_cache(cache):
+    """Write database schema cache (write temp file then replace, safe for parallel runs)"""
+    try:
+        cache_dir = os.path.dirname(os.path.abspath(DATABASE_SCHEMA_CACHE_FILE))
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, DATABASE_SCHEMA_CACHE_FILE)
+    except Exception as e:
+        print(f"Warning: Unable to write database schema cache: {e}")
+
+def apply_database_property_overrides(db_info):
+    """Apply explicit property names from override file, taking precedence over automatic detection"""
+    if not os.path.exists(DATABASE_PROPERTY_OVERRIDES_FILE):
+        return db_info
+    try:
+        with open(DATABASE_PROPERTY_OVERRIDES_FILE, 'r', encoding='utf-8') as f:
+            overrides = json.load(f)
+    except Exception as e:
+        print(f"Warning: Unable to read property override file: {e}")
+        return db_info
+
+    db_info = dict(db_info)
+    for key in ('title_property', 'created_time_property', 'updated_time_property', 'conversation_id_property', 'conversation_id_type'):
+        if key in overrides:
+            db_info[key] = overrides[key]
+
+    # Overridden conversation ID property without explicit type: take type from database structure
+    if 'conversation_id_property' in overrides and 'conversation_id_type' not in overrides:
+        prop_info = db_info.get('properties', {}).get(db_info['conversation_id_property'] or '', {})
+        db_info['conversation_id_type'] = prop_info.get('type')
+    return db_info
+
 def get_database_info(headers, database_id):
-    """Get database information and check property structure"""
+    """Get database information and check property structure (with on-disk schema cache)"""
+    cache = load_database_schema_cache()
+    cached = cache.get(database_id)
+    force_refresh = os.getenv("REFRESH_DB_SCHEMA") == "1"
+
+    # Cache still fresh: skip network round trip entirely
+    if cached and not force_refresh and time.time() - cached.get('cached_at', 0) < DATABASE_SCHEMA_CACHE_TTL:
+        print("   📦 Using cached database structure")
+        return apply_database_property_overrides(cached['db_info'])
+
+    request_headers = dict(headers)
+    if cached and cached.get('etag') and not force_refresh:
+        request_headers['If-None-Match'] = cached['etag']
+
     try:
-        response = requests.get(
+        response = notion_request(
+            'GET',
             f"{NOTION_API_BASE_URL}/databases/{database_id}",
-            headers=headers,
+            headers=request_headers,
             timeout=30
         )
-        response.raise_for_status()
-        db_info = response.json()
-        
-        properties = db_info.get('properties', {})
-        
-        # Find various types of properties
-        title_property = None
-        created_time_property = None
-        updated_time_property = None
-        conversation_id_property = None
-        conversation_id_type = None
-        
-        for prop_name, prop_info in properties.items():
-            prop_type = prop_info.get('type')
-            prop_name_lower = prop_name.lower()
-            
-            if prop_type == 'title':
-                title_property = prop_name
-            elif prop_type in ['date', 'created_time']:
-                if 'created' in prop_name_lower or 'create' in prop_name_lower:
-                    created_time_property = prop_name
-                elif 'updated' in prop_name_lower or 'update' in prop_name_lower or 'modified' in prop_name_lower:
-                    updated_time_property = prop_name
-            elif prop_type in ['rich_text', 'number']:
-                if ('conversation' in prop_name_lower and 'id' in prop_name_lower) or prop_name_lower == 'conversation id':
-                    conversation_id_property = prop_name
-                    conversation_id_type = prop_type
-        
-        return {
-            'title_property': title_property or 'Title',
-            'created_time_property': created_time_property,
-            'updated_time_property': updated_time_property, 
-            'conversation_id_property': conversation_id_property,
-            'conversation_id_type': conversation_id_type,
-            'properties': properties
+        if response.status_code == 304 and cached:
+            db_info = cached['db_info']
+            etag = cached.get('etag')
+            last_edited_time = cached.get('last_edited_time')
+        else:
+            response.raise_for_status()
+            db_data = response.json()
+            etag = response.headers.get('ETag')
+            last_edited_time = db_data.get('last_edited_time')
+
+            # Structure unchanged: reuse previous detection result
+            if cached and not force_refresh and last_edited_time and cached.get('last_edited_time') == last_edited_time:
+                db_info = cached['db_info']
+            else:
+                db_info = detect_database_properties(db_data.get('properties', {}))
+
+        cache[database_id] = {
+            'etag': etag,
+            'last_edited_time': last_edited_time,
+            'cached_at': time.time(),
+            'db_info': db_info
         }
+        save_database_schema_cache(cache)
+        return apply_database_property_overrides(db_info)
         
     except requests.exceptions.RequestException as e:
         error_msg = e.response.text if e.response else str(e)
         print(f"⚠️ Warning: Unable to get database information: {error_msg}")
-        return {
+        if cached:
+            print("   📦 Falling back to cached database structure")
+            return apply_database_property_overrides(cached['db_info'])
+        return apply_database_property_overrides({
             'title_property': 'Title',
             'created_time_property': None,
             'updated_time_property': None,
             'conversation_id_property': None,
             'properties': {}
-        }
+        })
 
 # --- Global Variables ---
 CONVERSATIONS_JSON_PATH = os.path.join(CHATGPT_EXPORT_PATH, 'conversations.json')
-NOTION_API_BASE_URL = "https://api.notion.com/v1"
+NOTION_API_BASE_URL = os.getenv("NOTION_API_BASE_URL") or "https://api.notion.com/v1"  # Overridable via environment variable, e.g. pointing at local benchmarks/mock_notion_server.py for offline runs
 PROCESSED_LOG_FILE = 'processed_ids.log'
+CONVERSATION_ID_INDEX_FILE = 'conversation_id_index.log'  # Numbers assigned for the number-type ID property: number -> original conversation ID (resolves hash collisions across runs)
+CONVERSATION_ID_NUMBER_DIGITS = 15  # Notion numbers are doubles, 15 digits are still exact
+DATABASE_SCHEMA_CACHE_FILE = 'database_schema_cache.json'  # Detected database structure, reused across runs / parallel workers
+DATABASE_SCHEMA_CACHE_TTL = 24 * 3600  # Within this time (seconds) skip the database request; REFRESH_DB_SCHEMA=1 forces refresh
+DATABASE_PROPERTY_OVERRIDES_FILE = 'database_property_overrides.json'  # Optional: explicitly specify property names, e.g. {"title_property": "Name"}
 MAX_TEXT_LENGTH = 1000  # Maximum text block length limit for Notion (reduced to avoid 400 errors)
-MAX_TRAVERSE_DEPTH = 1000  # Maximum traversal depth to prevent infinite loops
 DEBUG_FIRST_FAILURE = True  # Debug mode: show detailed information for first failed request
 DEBUG_DETAILED_ERRORS = True  # New: detailed error analysis (disable for production, enable for debugging)
+CREATE_PAGE_WITH_CHILDREN = True  # Send first batch of blocks with page creation (falls back to empty page + append on validation failure)
+INITIAL_CHILDREN_LIMIT = 100  # Notion allows at most 100 children per request
+APPEND_BATCH_SIZE = 20  # Blocks per append batch
+BATCH_PAYLOAD_LIMIT = 50000  # Maximum total block JSON characters per batch
+QUARANTINE_FILE = 'quarantined_blocks.jsonl'  # Blocks isolated as failing during bisection fallback
+COMPACT_BLOCKS = True  # Pack consecutive paragraphs of the same speaker into one block (multiple rich_text items)
+NOTION_MAX_RICH_TEXT_ITEMS = 100  # Notion limit: rich_text items per block
+COMPACT_BLOCK_MAX_CHARS = 12000  # Maximum characters of a packed block (keeps several blocks per batch)
+RENDER_MARKDOWN = True  # Render assistant replies as markdown: native Notion heading / list / quote / code blocks
+TEXT_BLOCK_TYPES = ('paragraph', 'heading_1', 'heading_2', 'heading_3', 'bulleted_list_item', 'numbered_list_item', 'quote')  # Block types holding only rich_text
+MARKDOWN_FENCE_PATTERN = re.compile(r'^ {0,3}(`{3,}|~{3,})\s*([^\s`]*)')  # Code fence, captures fence and language
+MARKDOWN_HEADING_PATTERN = re.compile(r'^ {0,3}(#{1,6})\s+(.*)$')
+MARKDOWN_DIVIDER_PATTERN = re.compile(r'^ {0,3}([-*_])(?:\s*\1){2,}\s*$')
+MARKDOWN_BULLET_PATTERN = re.compile(r'^\s*[-*+]\s+(.*)$')
+MARKDOWN_NUMBERED_PATTERN = re.compile(r'^\s*\d{1,9}[.)]\s+(.*)$')
+MARKDOWN_QUOTE_PATTERN = re.compile(r'^ {0,3}>\s?(.*)$')
+IMPORT_ALL_BRANCHES = False  # Also import regenerated/edited alternate branches as collapsed toggle blocks (or environment variable IMPORT_ALL_BRANCHES=1)
+IMPORT_CANVAS_DOCUMENTS = True  # Rebuild the final version of Canvas documents from canmore create/update messages, imported as toggle blocks
+UPLOAD_WORKERS = 4  # Parallel file upload threads (each conversation's upload plan runs before the page is assembled)
+MAX_UPLOAD_FILE_SIZE = 20 * 1024 * 1024  # Notion single-part upload limit (20 MB), larger files are skipped
+PERFORMANCE_REPORT_FILE = 'performance_report.json'  # Per-phase timing report written at the end of a run
+NOTION_MAX_RETRIES = 5  # Retries of a rate-limited (429) request, waiting Retry-After seconds each time
+HTTP_TRACE_FILE = 'http_trace.jsonl'  # One JSON line per Notion request (endpoint, status, bytes, latency, retries); '' disables the file
+HTTP_TRACE_MAX_BYTES = 10 * 1024 * 1024  # Trace file size before rotation (http_trace.jsonl.1, .2, ...)
+HTTP_TRACE_BACKUPS = 3  # Rotated trace files kept
+HTTP_LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)  # Latency histogram bucket upper bounds (milliseconds)
+PROFILE_MODE = ''  # Profiling: 'cpu' (cProfile) / 'mem' (tracemalloc), or environment variable PROFILE=cpu|mem
+PROFILE_CONVERSATION_ID = ''  # Profile only this conversation ID (or environment variable PROFILE_CONVERSATION_ID)
+PROFILE_MEM_INTERVAL = 100  # PROFILE=mem: memory snapshot every N processed conversations
+PROFILE_TOP_N = 20  # Functions / allocation sites listed in the profiling reports
+PROFILE_OUTPUT_PREFIX = 'profile'  # Output files: profile_cpu.pstats, profile_cpu.collapsed (flamegraph input), profile_mem.txt
+METRICS_PORT = 0  # Serve Prometheus metrics at http://127.0.0.1:PORT/metrics during the import (0 = off, or environment variable METRICS_PORT)
+METRICS_TEXTFILE = ''  # Prometheus textfile collector file rewritten during the import, e.g. /var/lib/node_exporter/textfile/chatgpt_notion.prom (or environment variable METRICS_TEXTFILE)
+METRICS_TEXTFILE_INTERVAL = 15  # Seconds between textfile rewrites
+METRICS_RATE_WINDOW = 60  # Window (seconds) of the effective request rate
+PLAN_REQUEST_RATE = 3  # --plan: sustained request rate used for the estimate (requests/second, Notion's average limit)
+PLAN_REQUEST_LATENCY = 0.3  # --plan: assumed latency of a single request (seconds)
+PLAN_TOP_N = 10  # --plan: most expensive conversations listed
+PLAN_REPORT_FILE = 'import_plan.json'  # --plan: requests / bytes per conversation ('' disables the file)
+CONVERSATION_METRICS_FILE = 'conversation_metrics.jsonl'  # One metrics line per imported conversation (blocks, requests, retries, fallbacks, bytes, time); '' disables the file
+CONVERSATION_REPORT_FILE = 'conversation_report.json'  # Slowest / most problematic conversations with their metrics; '' disables the file
+CONVERSATION_REPORT_TOP_N = 10  # Conversations listed per ranking
+MESSAGE_SUMMARY_CHARS = 300  # Leading characters kept by the summarize action (max_chars of the rule takes precedence)
+MESSAGE_SUMMARY_LINKS = 10  # Maximum sources (title + link) kept by the summarize action
+MESSAGE_FILTER_POLICY_FILE = 'message_filter_policy.json'  # Optional: list of rules replacing MESSAGE_FILTER_POLICY ([] disables filtering)
+# Message filter policy: rules are checked in order, the first matching rule applies. Match keys: role / author_name / content_type
+# (single value or list), metadata (flag that must be truthy), min_chars (minimum text length); actions: skip / truncate (max_chars) / summarize
+# (keeps source titles / links, otherwise the first max_chars characters, MESSAGE_SUMMARY_CHARS by default)
+# No filtering by default (every message is imported as before). Example policy (write it to message_filter_policy.json,
+# or assign it to MESSAGE_FILTER_POLICY):
+# [
+#     {"metadata": "is_visually_hidden_from_conversation", "action": "skip"},
+#     {"role": "tool", "author_name": ["browser", "web", "web.run"], "min_chars": 500, "action": "summarize"},
+#     {"content_type": "tether_browsing_display", "min_chars": 500, "action": "summarize"},
+#     {"content_type": ["tether_quote", "execution_output"], "min_chars": 3000, "action": "truncate", "max_chars": 2000}
+# ]
+MESSAGE_FILTER_POLICY = []
+
+# Run phases measured for the performance report -> duration of each occurrence (seconds); block_build / cleaning record one sample
+# per conversation (or branch section), uploads run in parallel threads, so phases can overlap
+PERFORMANCE_PHASES = ('json_load', 'block_build', 'cleaning', 'file_lookup', 'upload', 'page_create', 'append', 'sleep', 'rate_limit', 'retry')
+PHASE_TIMINGS = {phase: array('d') for phase in PERFORMANCE_PHASES}
+PHASE_FRAMES = threading.local()  # Phases being timed on the current thread: [start time, seconds to exclude] per level
+
+def open_phase():
+    """Start timing a phase on the current thread, returns its frame"""
+    frame = [time.perf_counter(), 0.0]
+    PHASE_FRAMES.__dict__.setdefault('stack', []).append(frame)
+    return frame
+
+def close_phase(phase, frame):
+    """Record a phase started with open_phase; rate_limit waits are recorded on their own and excluded from the enclosing phases (not counted twice in the report)"""
+    elapsed = time.perf_counter() - frame[0]
+    stack = PHASE_FRAMES.stack
+    stack.pop()
+    if phase == 'rate_limit':
+        for outer in stack:
+            outer[1] += elapsed
+    PHASE_TIMINGS[phase].append(elapsed - frame[1])
+
+@contextmanager
+def timed_phase(phase):
+    """Record the duration of the with-block under a run phase"""
+    frame = open_phase()
+    try:
+        yield
+    finally:
+        close_phase(phase, frame)
+
+def throttle(seconds, phase='sleep'):
+    """Wait (time.sleep): pauses between requests are recorded as the sleep phase, 429 Retry-After waits as the rate_limit phase"""
+    with timed_phase(phase):
+        time.sleep(seconds)
+
+def percentile(ordered, fraction):
+    """Percentile of sorted samples (nearest rank)"""
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def summarize_phase_timings():
+    """Count, total, mean and p50/p95/p99/max per phase (seconds)"""
+    summary = {}
+    for phase, samples in PHASE_TIMINGS.items():
+        if not samples:
+            continue
+        ordered = sorted(samples)
+        total = sum(ordered)
+        summary[phase] = {
+            "count": len(ordered),
+            "total_s": round(total, 4),
+            "mean_s": round(total / len(ordered), 6),
+            "p50_s": round(percentile(ordered, 0.50), 6),
+            "p95_s": round(percentile(ordered, 0.95), 6),
+            "p99_s": round(percentile(ordered, 0.99), 6),
+            "max_s": round(ordered[-1], 6)
+        }
+    return summary
+
+def print_performance_report(wall_time, success_count, fail_count):
+    """Print the time breakdown per phase and write it to PERFORMANCE_REPORT_FILE"""
+    summary = summarize_phase_timings()
+    if not summary:
+        return
+    print(f"⏱️ Phase timings (wall time {wall_time:.1f}s):")
+    print(f"   {'phase':<12} {'count':>8} {'total s':>10} {'share':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for phase, stats in sorted(summary.items(), key=lambda item: item[1]['total_s'], reverse=True):
+        print(f"   {phase:<12} {stats['count']:>8} {stats['total_s']:>10.1f} {stats['total_s'] / max(wall_time, 1e-9):>6.0%} "
+              f"{stats['p50_s'] * 1000:>9.1f} {stats['p95_s'] * 1000:>9.1f} {stats['p99_s'] * 1000:>9.1f}")
+
+    report = {
+        "generated_at": datetime.datetime.now().isoformat(),
+        "wall_time_s": round(wall_time, 3),
+        "conversations": {"succeeded": success_count, "failed": fail_count},
+        "phases": summary,
+        "content_types": CONTENT_HANDLER_STATS,
+        "message_filter": {**MESSAGE_FILTER_STATS, "requests_saved": round(get_filter_requests_saved(), 1)},
+        "http": summarize_http_trace()
+    }
+    try:
+        with open(PERFORMANCE_REPORT_FILE, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"   📄 Performance report written to {PERFORMANCE_REPORT_FILE}")
+    except Exception as e:
+        print(f"Warning: Unable to write performance report: {e}")
+
+# All requests share one session (connection reuse), every call is traced: endpoint -> counters, latency samples, histogram buckets
+NOTION_SESSION = requests.Session()
+HTTP_TRACE_STATS = {}
+HTTP_RECENT_REQUESTS = deque()  # Completion times of the requests (retries included) in the last METRICS_RATE_WINDOW seconds
+HTTP_TRACE_LOCK = threading.Lock()  # Upload threads record in parallel
+HTTP_TRACE_LOGGER = None
+UUID_SEGMENT_PATTERN = re.compile(r'[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}')
+
+def get_http_trace_logger():
+    """JSONL trace logger with size-based rotation (created on the first request under HTTP_TRACE_LOCK, so upload threads never add a second handler)"""
+    global HTTP_TRACE_LOGGER
+    if HTTP_TRACE_LOGGER is None:
+        with HTTP_TRACE_LOCK:
+            if HTTP_TRACE_LOGGER is None:
+                logger = logging.getLogger('notion_http_trace')
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                if HTTP_TRACE_FILE and not logger.handlers:
+                    handler = RotatingFileHandler(HTTP_TRACE_FILE, maxBytes=HTTP_TRACE_MAX_BYTES, backupCount=HTTP_TRACE_BACKUPS, encoding='utf-8')
+                    handler.setFormatter(logging.Formatter('%(message)s'))
+                    logger.addHandler(handler)
+                HTTP_TRACE_LOGGER = logger
+    return HTTP_TRACE_LOGGER
+
+def get_endpoint(method, url):
+    """Endpoint name for statistics: method + path relative to the API, IDs replaced by {id}"""
+    path = url[len(NOTION_API_BASE_URL):] if url.startswith(NOTION_API_BASE_URL) else urlparse(url).path
+    return f"{method} {UUID_SEGMENT_PATTERN.sub('{id}', path.split('?', 1)[0])}"
+
+def get_body_size(request_kwargs):
+    """Request body size in bytes (json argument, str / bytes, streamed file objects)"""
+    if request_kwargs.get('json') is not None:
+        return len(json.dumps(request_kwargs['json']).encode('utf-8'))
+    body = request_kwargs.get('data')
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode('utf-8'))
+    if hasattr(body, '__len__'):
+        return len(body)
+    try:
+        return os.fstat(body.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+def get_retry_after(response, retries):
+    """Wait before retrying a 429: Retry-After header (seconds), otherwise exponential backoff"""
+    try:
+        return max(float(response.headers.get('Retry-After')), 0.0)
+    except (TypeError, ValueError):
+        return min(2 ** retries, 30)
+
+def rewind_body(body):
+    """Rewind a streamed request body (file upload) before resending; False if it cannot be rewound"""
+    if not hasattr(body, 'read'):
+        return True
+    try:
+        if hasattr(body, 'rewind'):
+            body.rewind()
+        else:
+            body.seek(0)
+        return True
+    except (AttributeError, OSError, ValueError):
+        return False
+
+def notion_request(method, url, **request_kwargs):
+    """Send a request through the shared session; 429 responses are retried after Retry-After (up to NOTION_MAX_RETRIES times), every call is traced"""
+    endpoint = get_endpoint(method, url)
+    body_size = get_body_size(request_kwargs)
+    response = None
+    error = None
+    latency = 0.0
+    retries = 0
+    rate_limit_wait = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                response = NOTION_SESSION.request(method, url, **request_kwargs)
+            finally:
+                latency += time.perf_counter() - start
+            if response.status_code != 429 or retries >= NOTION_MAX_RETRIES or not rewind_body(request_kwargs.get('data')):
+                return response
+            wait = get_retry_after(response, retries)
+            tqdm.write(f"   ⏳ Rate limited ({endpoint}), retrying in {wait:.1f}s")
+            throttle(wait, 'rate_limit')
+            rate_limit_wait += wait
+            retries += 1
+    except requests.exceptions.RequestException as e:
+        error = str(e)
+        raise
+    finally:
+        record_http_trace(endpoint, response, error, latency, retries, rate_limit_wait, body_size * (retries + 1))
+
+def prune_recent_requests(now):
+    """Drop request completion times older than METRICS_RATE_WINDOW (the caller holds HTTP_TRACE_LOCK)"""
+    while HTTP_RECENT_REQUESTS and HTTP_RECENT_REQUESTS[0] < now - METRICS_RATE_WINDOW:
+        HTTP_RECENT_REQUESTS.popleft()
+
+def record_http_trace(endpoint, response, error, latency, retries, rate_limit_wait, bytes_sent):
+    """Write one trace line and add it to the endpoint statistics"""
+    status = response.status_code if response is not None else None
+    bytes_received = len(response.content) if response is not None else 0
+    latency_ms = latency * 1000
+    record = {
+        "time": datetime.datetime.now().isoformat(),
+        "endpoint": endpoint,
+        "status": status,
+        "bytes_sent": bytes_sent,
+        "bytes_received": bytes_received,
+        "latency_ms": round(latency_ms, 1),
+        "retries": retries,
+        "rate_limit_wait_s": round(rate_limit_wait, 3)
+    }
+    if error:
+        record["error"] = error[:500]
+    get_http_trace_logger().info(json.dumps(record, ensure_ascii=False))
+
+    with HTTP_TRACE_LOCK:
+        stats = HTTP_TRACE_STATS.get(endpoint)
+        if stats is None:
+            stats = HTTP_TRACE_STATS[endpoint] = {
+                "count": 0, "errors": 0, "rate_limited": 0, "retries": 0, "rate_limit_wait_s": 0.0,
+                "bytes_sent": 0, "bytes_received": 0, "latencies": array('d'), "buckets": [0] * (len(HTTP_LATENCY_BUCKETS_MS) + 1)
+            }
+        stats["count"] += 1
+        stats["errors"] += status is None or status >= 400
+        stats["rate_limited"] += retries + (status == 429)
+        stats["retries"] += retries
+        stats["rate_limit_wait_s"] += rate_limit_wait
+        stats["bytes_sent"] += bytes_sent
+        stats["bytes_received"] += bytes_received
+        stats["latencies"].append(latency_ms)
+        stats["buckets"][bisect.bisect_left(HTTP_LATENCY_BUCKETS_MS, latency_ms)] += 1
+        count_conversation_event('requests', retries + 1)
+        count_conversation_event('retries', retries)
+        count_conversation_event('bytes_sent', bytes_sent)
+        now = time.monotonic()
+        HTTP_RECENT_REQUESTS.extend([now] * (retries + 1))
+        prune_recent_requests(now)
+
+def summarize_http_trace():
+    """Per endpoint: count, errors, 429s, bytes, latency p50/p95/p99 (milliseconds) and histogram"""
+    summary = {}
+    with HTTP_TRACE_LOCK:
+        for endpoint, stats in HTTP_TRACE_STATS.items():
+            ordered = sorted(stats["latencies"])
+            bucket_labels = [f"le_{bound}ms" for bound in HTTP_LATENCY_BUCKETS_MS] + ["inf"]
+            summary[endpoint] = {
+                **{key: value for key, value in stats.items() if key not in ("latencies", "buckets")},
+                "p50_ms": round(percentile(ordered, 0.50), 1),
+                "p95_ms": round(percentile(ordered, 0.95), 1),
+                "p99_ms": round(percentile(ordered, 0.99), 1),
+                "histogram": dict(zip(bucket_labels, stats["buckets"]))
+            }
+    return summary
+
+def print_http_trace_summary():
+    """Print request statistics and latency histogram per endpoint"""
+    summary = summarize_http_trace()
+    if not summary:
+        return
+    print("🌐 HTTP requests per endpoint:")
+    for endpoint, stats in sorted(summary.items(), key=lambda item: item[1]['count'], reverse=True):
+        print(f"   {endpoint}: {stats['count']} requests, {stats['errors']} errors, {stats['rate_limited']} rate limited (waited {stats['rate_limit_wait_s']:.1f}s), "
+              f"sent {stats['bytes_sent'] / 1048576:.2f} MB, received {stats['bytes_received'] / 1048576:.2f} MB, "
+              f"p50/p95/p99 {stats['p50_ms']:.0f}/{stats['p95_ms']:.0f}/{stats['p99_ms']:.0f} ms")
+        print("      " + " | ".join(f"{label}: {count}" for label, count in stats['histogram'].items() if count))
+    if HTTP_TRACE_FILE:
+        print(f"   📄 Request trace: {HTTP_TRACE_FILE}")
+
+# Profiling state (set by run_profiled; when main() is called directly all hooks are no-ops)
+PROFILE_STATE = {"mode": None, "conversation_id": None, "profiler": None, "previous_snapshot": None, "conversations": 0, "report": []}
+
+def get_profile_settings():
+    """(mode, conversation ID), configuration takes precedence over environment variables"""
+    mode = (PROFILE_MODE or os.getenv("PROFILE") or '').strip().lower()
+    return mode, PROFILE_CONVERSATION_ID or os.getenv("PROFILE_CONVERSATION_ID") or None
+
+def run_profiled(func):
+    """Run func (main) under the profiler selected by PROFILE, reports are written when it ends (also on sys.exit / Ctrl+C)"""
+    mode, conversation_id = get_profile_settings()
+    if mode not in ('cpu', 'mem'):
+        if mode:
+            print(f"⚠️ Unknown PROFILE mode '{mode}', use cpu or mem")
+        return func()
+
+    PROFILE_STATE.update(mode=mode, conversation_id=conversation_id)
+    scope = f"conversation {conversation_id}" if conversation_id else "whole import"
+    print(f"🔬 Profiling enabled: {mode} ({scope})")
+    if mode == 'cpu':
+        # cProfile only records the main thread, work in the upload thread pool is not in the profile
+        PROFILE_STATE['profiler'] = cProfile.Profile()
+        if not conversation_id:
+            PROFILE_STATE['profiler'].enable()
+    else:
+        tracemalloc.start()
+    try:
+        return func()
+    finally:
+        if mode == 'cpu':
+            PROFILE_STATE['profiler'].disable()
+            write_cpu_profile(PROFILE_STATE['profiler'])
+        else:
+            if not conversation_id:
+                take_memory_snapshot("end")
+            write_memory_report()
+            tracemalloc.stop()
+        PROFILE_STATE.update(mode=None, profiler=None, previous_snapshot=None)
+
+def profile_checkpoint(label):
+    """PROFILE=mem: memory snapshot at an import milestone (single-conversation mode only snapshots around that conversation)"""
+    if PROFILE_STATE['mode'] == 'mem' and not PROFILE_STATE['conversation_id']:
+        take_memory_snapshot(label)
+
+def profile_conversation_start(conversation_id):
+    """Single-conversation mode: start profiling the target conversation"""
+    if not PROFILE_STATE['mode'] or conversation_id != PROFILE_STATE['conversation_id']:
+        return
+    if PROFILE_STATE['mode'] == 'cpu':
+        PROFILE_STATE['profiler'].enable()
+    else:
+        take_memory_snapshot(f"before conversation {conversation_id}")
+
+def profile_conversation_end(conversation_id):
+    """Single-conversation mode: stop profiling the target conversation; otherwise snapshot memory every PROFILE_MEM_INTERVAL conversations"""
+    mode = PROFILE_STATE['mode']
+    if not mode:
+        return
+    if PROFILE_STATE['conversation_id']:
+        if conversation_id == PROFILE_STATE['conversation_id']:
+            if mode == 'cpu':
+                PROFILE_STATE['profiler'].disable()
+            else:
+                take_memory_snapshot(f"after conversation {conversation_id}")
+        return
+    PROFILE_STATE['conversations'] += 1
+    if mode == 'mem' and PROFILE_STATE['conversations'] % PROFILE_MEM_INTERVAL == 0:
+        take_memory_snapshot(f"{PROFILE_STATE['conversations']} conversations")
+
+def format_trace_frame(stat):
+    frame = stat.traceback[0]
+    return f"{frame.filename}:{frame.lineno}"
+
+def take_memory_snapshot(label):
+    """tracemalloc snapshot: current / peak memory, largest allocation sites and growth since the previous snapshot"""
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"=== {label}: current {current / 1048576:.1f} MiB, peak {peak / 1048576:.1f} MiB", "Largest allocation sites:"]
+    for stat in snapshot.statistics('lineno')[:PROFILE_TOP_N]:
+        lines.append(f"  {stat.size / 1024:10.1f} KiB {stat.count:9} blocks  {format_trace_frame(stat)}")
+    previous = PROFILE_STATE['previous_snapshot']
+    if previous is not None:
+        lines.append("Growth since previous snapshot:")
+        for stat in snapshot.compare_to(previous, 'lineno')[:PROFILE_TOP_N]:
+            lines.append(f"  {stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+9} blocks  {format_trace_frame(stat)}")
+    PROFILE_STATE['previous_snapshot'] = snapshot
+    PROFILE_STATE['report'].append(lines)
+    tqdm.write(f"   🧠 Memory snapshot ({label}): {current / 1048576:.1f} MiB (peak {peak / 1048576:.1f} MiB)")
+
+def write_memory_report():
+    """Write all memory snapshots and print the last one"""
+    report = PROFILE_STATE['report']
+    if not report:
+        print("⚠️ No memory snapshots (was the PROFILE_CONVERSATION_ID conversation processed?)")
+        return
+    path = f"{PROFILE_OUTPUT_PREFIX}_mem.txt"
+    with open(path, 'w', encoding='utf-8') as f:
+        for lines in report:
+            f.write("\n".join(lines) + "\n\n")
+    print("\n" + "\n".join(report[-1]))
+    print(f"🔬 Memory profile ({len(report)} snapshots): {path}")
+
+def function_label(func):
+    """pstats function key (file, line, name) -> flamegraph frame name"""
+    filename, lineno, name = func
+    return f"{os.path.basename(filename)}:{lineno}({name})" if lineno else name
+
+def iter_collapsed_stacks(raw_stats, max_depth=64):
+    """Collapsed stacks (flamegraph.pl / speedscope format) rebuilt from the cProfile call graph, in microseconds.
+    cProfile only records call edges, so a function's time is split over its call paths by their share of its cumulative time"""
+    callees = {}
+    for func, (_cc, _nc, _tt, _ct, callers) in raw_stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    pending = [(func, (function_label(func),), 1.0) for func, entry in raw_stats.items() if not entry[4]]
+    while pending:
+        func, path, share = pending.pop()
+        self_time = int(raw_stats[func][2] * share * 1e6)
+        if self_time > 0:
+            yield ";".join(path), self_time
+        if len(path) >= max_depth:
+            continue
+        for callee, edge_time in callees.get(func, ()):
+            callee_time = raw_stats[callee][3]
+            label = function_label(callee)
+            # Recursive calls are already counted in the first frame on the path; paths below 10µs are not expanded
+            if not callee_time or label in path or edge_time * share < 1e-5:
+                continue
+            pending.append((callee, path + (label,), share * edge_time / callee_time))
+
+def write_cpu_profile(profiler):
+    """Write the pstats file and flamegraph collapsed stacks, print the functions with the highest cumulative time"""
+    stats = pstats.Stats(profiler)
+    if not stats.stats:
+        print("⚠️ No CPU profile data (was the PROFILE_CONVERSATION_ID conversation processed?)")
+        return
+    stats_path = f"{PROFILE_OUTPUT_PREFIX}_cpu.pstats"
+    collapsed_path = f"{PROFILE_OUTPUT_PREFIX}_cpu.collapsed"
+    stats.dump_stats(stats_path)
+    with open(collapsed_path, 'w', encoding='utf-8') as f:
+        for stack, microseconds in iter_collapsed_stacks(stats.stats):
+            f.write(f"{stack} {microseconds}\n")
+    print(f"\n🔬 CPU profile: {stats_path} (pstats / snakeviz), {collapsed_path} (flamegraph.pl / speedscope)")
+    stats.sort_stats('cumulative').print_stats(PROFILE_TOP_N)
+
+# Run metrics (Prometheus format): HTTP metrics come from HTTP_TRACE_STATS, the rest is updated by the import flow in the main thread
+# (upload_bytes is added by the upload threads under HTTP_TRACE_LOCK)
+RUN_METRICS = {"conversations_success": 0, "conversations_failed": 0, "conversations_pending": 0, "blocks_appended": 0, "uploads_pending": 0,
+               "upload_bytes": 0}
+METRICS_STATE = {"server": None, "writer": None, "stop": None, "textfile": None}
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """GET /metrics -> current metrics"""
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep the progress bar intact
+
+def format_metric_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+def append_metric(lines, name, metric_type, help_text, samples):
+    """samples: [(suffix, labels, value)]"""
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {metric_type}")
+    for suffix, labels, value in samples:
+        lines.append(f"{name}{suffix}{format_metric_labels(labels)} {value}")
+
+def render_metrics():
+    """Current run metrics in the Prometheus text format"""
+    with HTTP_TRACE_LOCK:
+        http_stats = {endpoint: {**stats, "latency_sum_s": sum(stats["latencies"]) / 1000, "buckets": list(stats["buckets"])}
+                      for endpoint, stats in HTTP_TRACE_STATS.items()}
+        # Also drop entries outside the window when no requests come in, otherwise the rate sticks at its last value
+        prune_recent_requests(time.monotonic())
+        recent_requests = len(HTTP_RECENT_REQUESTS)
+        upload_bytes = RUN_METRICS["upload_bytes"]
+
+    lines = []
+    append_metric(lines, "chatgpt_notion_conversations_total", "counter", "Conversations processed, by result",
+                  [("", {"result": "success"}, RUN_METRICS["conversations_success"]),
+                   ("", {"result": "failed"}, RUN_METRICS["conversations_failed"])])
+    append_metric(lines, "chatgpt_notion_conversations_pending", "gauge", "Conversations still to be processed in this run",
+                  [("", None, RUN_METRICS["conversations_pending"])])
+    append_metric(lines, "chatgpt_notion_blocks_appended_total", "counter", "Blocks written to Notion pages (page creation and append requests)",
+                  [("", None, RUN_METRICS["blocks_appended"])])
+    append_metric(lines, "chatgpt_notion_uploads_pending", "gauge", "Planned file uploads of the current conversation not finished yet",
+                  [("", None, RUN_METRICS["uploads_pending"])])
+    append_metric(lines, "chatgpt_notion_upload_bytes_total", "counter", "File bytes sent to Notion (multipart send and pre-signed PUT uploads)",
+                  [("", None, upload_bytes)])
+    append_metric(lines, "chatgpt_notion_request_rate", "gauge", f"Notion requests per second over the last {METRICS_RATE_WINDOW}s (retries included)",
+                  [("", None, round(recent_requests / METRICS_RATE_WINDOW, 3))])
+    append_metric(lines, "chatgpt_notion_requests_total", "counter", "Notion API requests by endpoint",
+                  [("", {"endpoint": endpoint}, stats["count"]) for endpoint, stats in http_stats.items()])
+    append_metric(lines, "chatgpt_notion_request_errors_total", "counter", "Notion API requests that failed or returned an error status",
+                  [("", {"endpoint": endpoint}, stats["errors"]) for endpoint, stats in http_stats.items()])
+    append_metric(lines, "chatgpt_notion_rate_limited_total", "counter", "429 responses by endpoint",
+                  [("", {"endpoint": endpoint}, stats["rate_limited"]) for endpoint, stats in http_stats.items()])
+    append_metric(lines, "chatgpt_notion_rate_limit_wait_seconds_total", "counter", "Time spent waiting for Retry-After",
+                  [("", {"endpoint": endpoint}, round(stats["rate_limit_wait_s"], 3)) for endpoint, stats in http_stats.items()])
+    append_metric(lines, "chatgpt_notion_request_bytes_sent_total", "counter", "Request body bytes by endpoint",
+                  [("", {"endpoint": endpoint}, stats["bytes_sent"]) for endpoint, stats in http_stats.items()])
+
+    samples = []
+    for endpoint, stats in http_stats.items():
+        cumulative = 0
+        for bound, count in zip(HTTP_LATENCY_BUCKETS_MS, stats["buckets"]):
+            cumulative += count
+            samples.append(("_bucket", {"endpoint": endpoint, "le": f"{bound / 1000:g}"}, cumulative))
+        samples.append(("_bucket", {"endpoint": endpoint, "le": "+Inf"}, stats["count"]))
+        samples.append(("_sum", {"endpoint": endpoint}, round(stats["latency_sum_s"], 6)))
+        samples.append(("_count", {"endpoint": endpoint}, stats["count"]))
+    append_metric(lines, "chatgpt_notion_request_duration_seconds", "histogram", "Notion API request latency (429 retries included)", samples)
+    return "\n".join(lines) + "\n"
+
+def write_metrics_textfile(path):
+    """Rewrite the textfile atomically (temporary file + replace, the collector never reads a half-written file)"""
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(render_metrics())
+        os.replace(temp_path, path)
+    except OSError as e:
+        tqdm.write(f"   ⚠️ Warning: Unable to write metrics file {path}: {e}")
+
+def start_metrics_exporters(pending_conversations):
+    """Start the HTTP metrics endpoint and / or the textfile writer thread, as configured"""
+    RUN_METRICS["conversations_pending"] = pending_conversations
+    port = METRICS_PORT or int(os.getenv("METRICS_PORT") or 0)
+    textfile = METRICS_TEXTFILE or os.getenv("METRICS_TEXTFILE")
+    if port:
+        try:
+            server = ThreadingHTTPServer(('127.0.0.1', port), MetricsRequestHandler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+            METRICS_STATE["server"] = server
+            print(f"📈 Prometheus metrics: http://127.0.0.1:{port}/metrics")
+        except OSError as e:
+            print(f"⚠️ Warning: Unable to start metrics endpoint (port {port}): {e}")
+    if textfile:
+        stop = threading.Event()
+
+        def write_periodically():
+            while not stop.wait(METRICS_TEXTFILE_INTERVAL):
+                write_metrics_textfile(textfile)
+
+        write_metrics_textfile(textfile)
+        METRICS_STATE["writer"] = threading.Thread(target=write_periodically, name='metrics-textfile', daemon=True)
+        METRICS_STATE["writer"].start()
+        METRICS_STATE.update(stop=stop, textfile=textfile)
+        print(f"📈 Prometheus metrics file: {textfile} (updated every {METRICS_TEXTFILE_INTERVAL}s)")
+
+def stop_metrics_exporters():
+    """Stop the metrics endpoint and writer thread, the textfile gets the final values"""
+    if METRICS_STATE["server"]:
+        METRICS_STATE["server"].shutdown()
+        METRICS_STATE["server"].server_close()
+    if METRICS_STATE["stop"]:
+        METRICS_STATE["stop"].set()
+        METRICS_STATE["writer"].join()
+        write_metrics_textfile(METRICS_STATE["textfile"])
+    METRICS_STATE.update(server=None, writer=None, stop=None)
+
+# Per-conversation metrics: current holds the counters of the conversation being imported (None outside the import loop), slowest / troubled are top-N heaps for the report
+CONVERSATION_COUNTERS = ('blocks_built', 'blocks_dropped', 'requests', 'retries', 'fallbacks', 'single_block_fallbacks', 'bytes_sent')
+CONVERSATION_METRICS = {"current": None, "slowest": [], "troubled": [], "sequence": 0}
+
+def start_conversation_metrics(conversation_id, title):
+    CONVERSATION_METRICS["current"] = {"id": conversation_id, "title": title, **dict.fromkeys(CONVERSATION_COUNTERS, 0), "start": time.perf_counter()}
+
+def count_conversation_event(key, amount=1):
+    """Count into the conversation being imported (calls from upload threads are guarded by HTTP_TRACE_LOCK)"""
+    record = CONVERSATION_METRICS["current"]
+    if record is not None:
+        record[key] += amount
+
+def get_trouble_score(record):
+    """How problematic: failed conversations first, then by fallbacks, retries and dropped blocks"""
+    return (not record["success"], record["fallbacks"] + record["single_block_fallbacks"] + record["retries"] + record["blocks_dropped"])
+
+def finish_conversation_metrics(success):
+    """Close the current conversation: write its metrics line, keep the top N slowest / most problematic"""
+    record = CONVERSATION_METRICS["current"]
+    CONVERSATION_METRICS["current"] = None
+    if record is None:
+        return
+    record["wall_s"] = round(time.perf_counter() - record.pop("start"), 3)
+    record["success"] = success
+    if CONVERSATION_METRICS_FILE:
+        try:
+            with open(CONVERSATION_METRICS_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({"time": datetime.datetime.now().isoformat(), **record}, ensure_ascii=False) + "\n")
+        except Exception as e:
+            tqdm.write(f"   ⚠️ Warning: Unable to write conversation metrics file: {e}")
+
+    # Min-heaps keep only the top N, memory does not grow with the number of conversations (sequence avoids comparing dicts)
+    CONVERSATION_METRICS["sequence"] += 1
+    for heap, score in (("slowest", record["wall_s"]), ("troubled", get_trouble_score(record))):
+        entry = (score, CONVERSATION_METRICS["sequence"], record)
+        if len(CONVERSATION_METRICS[heap]) < CONVERSATION_REPORT_TOP_N:
+            heapq.heappush(CONVERSATION_METRICS[heap], entry)
+        else:
+            heapq.heappushpop(CONVERSATION_METRICS[heap], entry)
+
+def format_conversation_metrics(record):
+    status = "🟢" if record["success"] else "🔴"
+    return (f"{status} {record['wall_s']:7.1f}s  {record['requests']:4} requests  {record['retries']:3} retries  "
+            f"{record['fallbacks']} fallbacks / {record['single_block_fallbacks']} single-block  {record['blocks_built']:5} blocks ({record['blocks_dropped']} dropped)  "
+            f"{record['bytes_sent'] / 1048576:6.2f} MB  {record['id']}  {record['title'][:40]}")
+
+def print_conversation_report():
+    """Print the slowest and most problematic conversations (with IDs) and write the report file"""
+    slowest = [record for _, _, record in sorted(CONVERSATION_METRICS["slowest"], key=lambda entry: entry[:2], reverse=True)]
+    troubled = [record for score, _, record in sorted(CONVERSATION_METRICS["troubled"], key=lambda entry: entry[:2], reverse=True) if any(score)]
+    if not slowest:
+        return
+    print(f"🐢 Slowest {len(slowest)} conversations:")
+    for record in slowest:
+        print("   " + format_conversation_metrics(record))
+    if troubled:
+        print(f"🧯 Most problematic {len(troubled)} conversations (failures, fallbacks, retries, dropped blocks):")
+        for record in troubled:
+            print("   " + format_conversation_metrics(record))
+    if CONVERSATION_REPORT_FILE:
+        with open(CONVERSATION_REPORT_FILE, 'w', encoding='utf-8') as f:
+            json.dump({"slowest": slowest, "most_problematic": troubled}, f, ensure_ascii=False, indent=2)
+        print(f"   📄 Conversation report: {CONVERSATION_REPORT_FILE} (metrics of all conversations: {CONVERSATION_METRICS_FILE})")
 
 # New: Error analysis function
 def analyze_request_payload(payload, title=""):
@@ -234,6 +998,53 @@ def log_processed_id(conversation_id):
     except Exception as e:
         print(f"Warning: Unable to write to log file: {e}")
 
+# Reverse index of encoded conversation IDs (lazily loaded)
+CONVERSATION_ID_INDEX = None
+
+def load_conversation_id_index():
+    """Load reverse index of number-encoded conversation IDs (number -> conversation ID)"""
+    index = {}
+    if not os.path.exists(CONVERSATION_ID_INDEX_FILE):
+        return index
+    try:
+        with open(CONVERSATION_ID_INDEX_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.strip().split('\t')
+                if len(parts) == 2 and parts[0].isdigit():
+                    index[int(parts[0])] = parts[1]
+    except Exception as e:
+        print(f"Warning: Unable to read conversation ID index: {e}")
+    return index
+
+def encode_conversation_id_number(conversation_id):
+    """Encode conversation ID as a stable number for number-type ID properties (same value in every run)
+
+    The stable value lets users filter pages of one conversation by this property in Notion; the importer itself does not
+    query for existing pages, imported conversations are skipped through PROCESSED_LOG_FILE.
+    """
+    global CONVERSATION_ID_INDEX
+    if CONVERSATION_ID_INDEX is None:
+        CONVERSATION_ID_INDEX = load_conversation_id_index()
+
+    # Truncated SHA-256, on collision with another ID re-hash with a salt until a free number is found
+    salt = 0
+    while True:
+        seed = conversation_id if salt == 0 else f"{conversation_id}#{salt}"
+        digest = hashlib.sha256(seed.encode('utf-8')).hexdigest()
+        number_value = int(digest[:16], 16) % (10 ** CONVERSATION_ID_NUMBER_DIGITS)
+        owner = CONVERSATION_ID_INDEX.get(number_value)
+        if owner == conversation_id:
+            return number_value
+        if owner is None:
+            CONVERSATION_ID_INDEX[number_value] = conversation_id
+            try:
+                with open(CONVERSATION_ID_INDEX_FILE, 'a', encoding='utf-8') as f:
+                    f.write(f"{number_value}\t{conversation_id}\n")
+            except Exception as e:
+                print(f"Warning: Unable to write conversation ID index: {e}")
+            return number_value
+        salt += 1
+
 def split_long_text(text, max_length=MAX_TEXT_LENGTH):
     """Split long text into chunks that comply with Notion limits"""
     if len(text) <= max_length:
@@ -260,64 +1071,125 @@ def split_long_text(text, max_length=MAX_TEXT_LENGTH):
     
     return chunks
 
-def upload_file_to_notion(local_file_path, headers):
-    """Upload files to Notion, supports images and other attachments (enhanced multi-path search)"""
-
-    def find_local_file(path_or_name: str) -> str | None:
-        """Find files in common subdirectories (images/ dalle-generations/)"""
-        if os.path.isabs(path_or_name) and os.path.exists(path_or_name):
-            return path_or_name
-
-        # Remove possible prefix "./" and normalize path
-        if path_or_name.startswith("./") or path_or_name.startswith(".\\"):
-            path_or_name = path_or_name[2:]
-
-        # Use normalized name for further processing
-        abs_path = os.path.join(CHATGPT_EXPORT_PATH, path_or_name)
-        if os.path.exists(abs_path):
-            return abs_path
-
-        # Common subdirectories
-        basename_only = os.path.basename(path_or_name)
-        for sub in ["images", "assets", "dalle-generations", "dalle_generations"]:
-            candidate = os.path.join(CHATGPT_EXPORT_PATH, sub, basename_only)
+# Files under the export folder as (file name, full path), the folder is walked once per run
+EXPORT_FILE_INDEX = None
+
+def iter_export_files():
+    """All files under the export folder as (file name, full path), walked once on first use"""
+    global EXPORT_FILE_INDEX
+    if EXPORT_FILE_INDEX is None:
+        EXPORT_FILE_INDEX = [
+            (fname, os.path.join(root, fname))
+            for root, _dirs, files in os.walk(CHATGPT_EXPORT_PATH)
+            for fname in files
+        ]
+    return EXPORT_FILE_INDEX
+
+def find_local_file(path_or_name: str) -> str | None:
+    """Find files in common subdirectories (images/ dalle-generations/)"""
+    if os.path.isabs(path_or_name) and os.path.exists(path_or_name):
+        return path_or_name
+
+    # Remove possible prefix "./" and normalize path
+    if path_or_name.startswith("./") or path_or_name.startswith(".\\"):
+        path_or_name = path_or_name[2:]
+
+    # Use normalized name for further processing
+    abs_path = os.path.join(CHATGPT_EXPORT_PATH, path_or_name)
+    if os.path.exists(abs_path):
+        return abs_path
+
+    # Common subdirectories
+    basename_only = os.path.basename(path_or_name)
+    for sub in ["images", "assets", "dalle-generations", "dalle_generations"]:
+        candidate = os.path.join(CHATGPT_EXPORT_PATH, sub, basename_only)
+        if os.path.exists(candidate):
+            return candidate
+
+    # First round: general rules for file- prefix
+    if basename_only.startswith("file-"):
+        prefix = basename_only.split('.')[0]  # file-XXXXXX
+        for fname, path in iter_export_files():
+            if fname.startswith(prefix):
+                return path
+
+    # Second round: more general prefix matching (not limited to file- prefix),
+    # to handle cases like "image-XXX.png" or "pic_XXX.jpg" in root directory
+    generic_prefix = os.path.splitext(basename_only)[0]
+    if len(generic_prefix) > 3:  # Avoid too short prefixes causing mismatches
+        for fname, path in iter_export_files():
+            if fname.startswith(generic_prefix):
+                return path
+
+    # Third round: no extension -> try common image extensions
+    if '.' not in basename_only:
+        COMMON_EXTS = ['png', 'jpg', 'jpeg', 'webp', 'gif']
+        for ext in COMMON_EXTS:
+            candidate = os.path.join(CHATGPT_EXPORT_PATH, f"{basename_only}.{ext}")
             if os.path.exists(candidate):
                 return candidate
+            # Also search in common subdirectories
+            for sub in ["images", "assets", "dalle-generations", "dalle_generations"]:
+                candidate_sub = os.path.join(CHATGPT_EXPORT_PATH, sub, f"{basename_only}.{ext}")
+                if os.path.exists(candidate_sub):
+                    return candidate_sub
+    return None
+
+class MultipartFileStream:
+    """multipart/form-data body generated while the file is read (len() gives Content-Length, requests sends it chunk by chunk)"""
+
+    def __init__(self, file_obj, file_size, field_name, file_name, content_type):
+        boundary = os.urandom(16).hex()
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        safe_name = file_name.replace('"', '%22')
+        self._sources = [
+            (f'--{boundary}\r\nContent-Disposition: form-data; name="{field_name}"; filename="{safe_name}"\r\n'
+             f'Content-Type: {content_type}\r\n\r\n').encode('utf-8'),
+            file_obj,
+            f'\r\n--{boundary}--\r\n'.encode('utf-8'),
+        ]
+        self._length = len(self._sources[0]) + file_size + len(self._sources[2])
+        self._file_start = file_obj.tell()
+        self._stage = 0
+        self._offset = 0
+
+    def __len__(self):
+        return self._length
+
+    def rewind(self):
+        """Start over from the beginning, for resending (e.g. after rate limiting)"""
+        self._sources[1].seek(self._file_start)
+        self._stage = 0
+        self._offset = 0
+
+    def read(self, size=-1):
+        """Return up to size bytes of header, file content and closing boundary in turn"""
+        if size is None or size < 0:
+            size = self._length
+        chunks = []
+        while size > 0 and self._stage < len(self._sources):
+            source = self._sources[self._stage]
+            if isinstance(source, bytes):
+                data = source[self._offset:self._offset + size]
+                self._offset += len(data)
+                if self._offset >= len(source):
+                    self._stage, self._offset = self._stage + 1, 0
+            else:
+                data = source.read(size)
+                if not data:
+                    self._stage += 1
+                    continue
+            chunks.append(data)
+            size -= len(data)
+        return b"".join(chunks)
 
-        # First round: general rules for file- prefix
-        if basename_only.startswith("file-"):
-            prefix = basename_only.split('.')[0]  # file-XXXXXX
-            for root, _dirs, files in os.walk(CHATGPT_EXPORT_PATH):
-                for fname in files:
-                    if fname.startswith(prefix):
-                        return os.path.join(root, fname)
-
-        # Second round: more general prefix matching (not limited to file- prefix),
-        # to handle cases like "image-XXX.png" or "pic_XXX.jpg" in root directory
-        generic_prefix = os.path.splitext(basename_only)[0]
-        if len(generic_prefix) > 3:  # Avoid too short prefixes causing mismatches
-            for root, _dirs, files in os.walk(CHATGPT_EXPORT_PATH):
-                for fname in files:
-                    if fname.startswith(generic_prefix):
-                        return os.path.join(root, fname)
-
-        # Third round: no extension -> try common image extensions
-        if '.' not in basename_only:
-            COMMON_EXTS = ['png', 'jpg', 'jpeg', 'webp', 'gif']
-            for ext in COMMON_EXTS:
-                candidate = os.path.join(CHATGPT_EXPORT_PATH, f"{basename_only}.{ext}")
-                if os.path.exists(candidate):
-                    return candidate
-                # Also search in common subdirectories
-                for sub in ["images", "assets", "dalle-generations", "dalle_generations"]:
-                    candidate_sub = os.path.join(CHATGPT_EXPORT_PATH, sub, f"{basename_only}.{ext}")
-                    if os.path.exists(candidate_sub):
-                        return candidate_sub
-        return None
+def prepare_file_upload(local_file_path):
+    """Locate a file and determine its upload name, size and MIME type; None if it cannot be uploaded (not found, too large, unsupported type)"""
 
-    actual_path = find_local_file(local_file_path)
+    with timed_phase('file_lookup'):
+        actual_path = find_local_file(local_file_path)
     if actual_path is None:
-        tqdm.write(f"   ⚠️ Image file not found: {local_file_path}")
+        tqdm.write(f"   ⚠️ File not found: {local_file_path}")
         return None
 
     local_file_path = actual_path
@@ -325,9 +1197,8 @@ def upload_file_to_notion(local_file_path, headers):
     file_name = os.path.basename(local_file_path)
     file_size = os.path.getsize(local_file_path)
     
-    # ====== Premium version limit: 20 MB ======
-    MAX_FILE_SIZE_BYTES = 20 * 1024 * 1024  # 20MB
-    if file_size > MAX_FILE_SIZE_BYTES:
+    # ====== Premium version limit: 20 MB (only the file size is checked, content is not read) ======
+    if file_size > MAX_UPLOAD_FILE_SIZE:
         tqdm.write(f"   ⚠️ File too large (>20MB): {local_file_path}")
         return None
 
@@ -344,6 +1215,14 @@ def upload_file_to_notion(local_file_path, headers):
     }
     if not content_type and ext in EXT_MIME_MAP:
         content_type = EXT_MIME_MAP[ext]
+    # Non-standard names returned by some platforms' mimetypes (e.g. audio/x-wav on Linux)
+    MIME_ALIASES = {
+        'audio/x-wav': 'audio/wav',
+        'audio/wave': 'audio/wav',
+        'audio/mp3': 'audio/mpeg',
+        'audio/x-m4a': 'audio/mp4',
+    }
+    content_type = MIME_ALIASES.get(content_type, content_type)
     if not content_type:
         content_type = 'application/octet-stream'
 
@@ -382,7 +1261,7 @@ def upload_file_to_notion(local_file_path, headers):
         # Images
         'image/jpeg','image/jpg','image/png','image/gif','image/webp','image/svg+xml','image/tiff','image/heic','image/vnd.microsoft.icon',
         # Documents
-        'application/pdf','text/plain','application/json',
+        'application/pdf','text/plain','text/csv','application/json',
         # Audio
         'audio/mpeg','audio/mp4','audio/aac','audio/midi','audio/ogg','audio/wav','audio/x-ms-wma',
         # Video
@@ -392,6 +1271,15 @@ def upload_file_to_notion(local_file_path, headers):
         tqdm.write(f"   ⚠️ Unsupported MIME type({content_type}), skipping: {file_name}")
         return None
 
+    return local_file_path, file_name, file_size, content_type
+
+def upload_file_to_notion(local_file_path, headers):
+    """Upload files to Notion, supports images and other attachments (enhanced multi-path search)"""
+    prepared = prepare_file_upload(local_file_path)
+    if prepared is None:
+        return None
+    local_file_path, file_name, file_size, content_type = prepared
+
     # Debug: show file preparation info
     if DEBUG_IMAGE_UPLOAD or os.getenv("DEBUG_IMAGE_UPLOAD") == "1":
         tqdm.write(f"   [DEBUG] Preparing upload: {file_name} | size={round(file_size/1024,1)}KB | mime={content_type}")
@@ -403,8 +1291,9 @@ def upload_file_to_notion(local_file_path, headers):
         "content_type": content_type
     }
     
+    upload_frame = open_phase()
     try:
-        response = requests.post(upload_url, headers=headers, json=payload, timeout=30)
+        response = notion_request('POST', upload_url, headers=headers, json=payload, timeout=30)
         response.raise_for_status()
         upload_data = response.json()
         
@@ -413,9 +1302,6 @@ def upload_file_to_notion(local_file_path, headers):
             tqdm.write(f"   [DEBUG] Upload response: {json.dumps(upload_data, ensure_ascii=False)}")
         
         # Step 2: Upload file content to received URL
-        with open(local_file_path, 'rb') as f:
-            file_bytes = f.read()
-
         base_upload_headers = {
             "Content-Type": content_type,
             "Content-Length": str(file_size)
@@ -423,35 +1309,39 @@ def upload_file_to_notion(local_file_path, headers):
 
         upload_url = upload_data["upload_url"]
 
-        # If upload_url contains /send, use POST with authorization as required by Notion API
-        if "/send" in upload_url:
-            # Use multipart/form-data, requests automatically generates boundary and Content-Type
-            upload_headers = {
-                "Authorization": headers.get("Authorization", ""),
-                "Notion-Version": headers.get("Notion-Version", "2022-06-28")
-            }
-
-            files = {
-                "file": (file_name, file_bytes, content_type)
-            }
+        # File is streamed in chunks instead of being read into memory (large audio files etc.)
+        with open(local_file_path, 'rb') as f:
+            # If upload_url contains /send, use POST with authorization as required by Notion API
+            if "/send" in upload_url:
+                # multipart/form-data body is read while sending, Content-Length comes from len()
+                body = MultipartFileStream(f, file_size, "file", file_name, content_type)
+                upload_headers = {
+                    "Authorization": headers.get("Authorization", ""),
+                    "Notion-Version": headers.get("Notion-Version", "2022-06-28"),
+                    "Content-Type": body.content_type
+                }
 
-            response = requests.post(
-                upload_url,
-                headers=upload_headers,
-                files=files,
-                timeout=120
-            )
-        else:
-            # Pre-signed S3 URL, use PUT without authorization
-            response = requests.put(
-                upload_url,
-                headers=base_upload_headers,
-                data=file_bytes,
-                timeout=120
-            )
+                response = notion_request(
+                    'POST',
+                    upload_url,
+                    headers=upload_headers,
+                    data=body,
+                    timeout=120
+                )
+            else:
+                # Pre-signed S3 URL, use PUT without authorization
+                response = notion_request(
+                    'PUT',
+                    upload_url,
+                    headers=base_upload_headers,
+                    data=f,
+                    timeout=120
+                )
+        with HTTP_TRACE_LOCK:
+            RUN_METRICS["upload_bytes"] += file_size
         response.raise_for_status()
         
-        tqdm.write(f"   ✅ Image upload successful: {file_name}")
+        tqdm.write(f"   ✅ File upload successful: {file_name}")
 
         if DEBUG_IMAGE_UPLOAD or os.getenv("DEBUG_IMAGE_UPLOAD") == "1":
             tqdm.write(f"   [DEBUG] FileUpload ID: {upload_data.get('id')}")
@@ -461,202 +1351,1201 @@ def upload_file_to_notion(local_file_path, headers):
         error_msg = e.response.text if e.response else str(e)
         tqdm.write(f"   ❌ File upload failed: {error_msg}")
         return None
+    except (OSError, KeyError, ValueError) as e:
+        # File could not be read or the response lacks a field (upload_url / id)
+        tqdm.write(f"   ❌ File upload failed: {file_name}: {e!r}")
+        return None
+    finally:
+        close_phase('upload', upload_frame)
 
-def build_blocks_from_conversation(conversation_data, headers):
-    """Build Notion blocks from conversation data with added safety protection"""
-    mapping = conversation_data.get('mapping', {})
-    if not mapping:
-        return []
+# File reference (file name or file-ID in the export folder) -> Notion file upload ID, None if the upload failed; each file is uploaded once per run
+UPLOADED_FILE_IDS = {}
 
-    # Find root node
-    root_id = next((nid for nid, node in mapping.items() if not node.get('parent')), None)
-    if not root_id:
-        try:
-            # If no clear root node, find earliest message as starting point
-            root_id = min(mapping.keys(), 
-                         key=lambda k: mapping[k].get('message', {}).get('create_time', float('inf')))
-        except (ValueError, TypeError):
-            return []
+# --plan state: sizes (bytes) of the files the current conversation would upload; active is False during a real import
+PLAN_STATE = {"active": False, "uploads": []}
 
+def plan_file_upload(reference):
+    """--plan: simulated upload (no request is sent), the file is checked like a real upload; returns a placeholder upload ID"""
+    prepared = prepare_file_upload(os.path.join(CHATGPT_EXPORT_PATH, reference))
+    if prepared is None:
+        UPLOADED_FILE_IDS[reference] = None
+    else:
+        PLAN_STATE["uploads"].append(prepared[2])
+        UPLOADED_FILE_IDS[reference] = f"planned-{reference}"
+    return UPLOADED_FILE_IDS[reference]
+
+def get_file_upload_id(reference, headers):
+    """Upload ID of a file, uploaded right away if not planned yet (e.g. images in alternate branches)"""
+    if reference not in UPLOADED_FILE_IDS:
+        if PLAN_STATE["active"]:
+            return plan_file_upload(reference)
+        UPLOADED_FILE_IDS[reference] = upload_file_to_notion(os.path.join(CHATGPT_EXPORT_PATH, reference), headers)
+    return UPLOADED_FILE_IDS[reference]
+
+def get_audio_pointers(parts):
+    """Audio asset pointers of multimodal parts (voice mode), including those nested in real-time audio/video parts"""
+    pointers = []
+    for part in parts:
+        if not isinstance(part, dict):
+            continue
+        if part.get('content_type') == 'real_time_user_audio_video_asset_pointer':
+            part = part.get('audio_asset_pointer') or {}
+        if part.get('content_type') == 'audio_asset_pointer' and '://' in (part.get('asset_pointer') or ''):
+            pointers.append(part)
+    return pointers
+
+def get_asset_reference(asset_pointer):
+    """File reference of an asset pointer (file-service:// or sediment://)"""
+    return asset_pointer.split('://', 1)[-1].split('/')[-1]
+
+def get_message_file_references(message):
+    """All files referenced by a message with their known size: multimodal image and audio pointers, metadata.attachments (deduplicated, keeps order)"""
+    references = {}
+    if message.content_type == 'multimodal_text':
+        parts = message.content.get('parts') or []
+        for part in parts:
+            if isinstance(part, dict) and part.get('content_type') == 'image_asset_pointer':
+                asset_pointer = part.get('asset_pointer', '')
+                if asset_pointer.startswith('file-service://') and asset_pointer.split('/')[-1]:
+                    references.setdefault(asset_pointer.split('/')[-1], part.get('size_bytes'))
+        for pointer in get_audio_pointers(parts):
+            references.setdefault(get_asset_reference(pointer['asset_pointer']), pointer.get('size_bytes'))
+    for attachment in message.metadata.get('attachments') or []:
+        if isinstance(attachment, dict) and attachment.get('id'):
+            references.setdefault(attachment['id'], attachment.get('size'))
+    return list(references.items())
+
+def build_upload_plan(tree, nodes):
+    """Upload plan of a conversation: every file referenced on the displayed path that was not uploaded yet (deduplicated)"""
+    plan = []
+    for node in nodes:
+        message = tree.messages[node]
+        if not message or not message.content:
+            continue
+        # Messages skipped or summarized by the filter policy and Canvas tool calls render no attachments, their files need no upload
+        if message.recipient in CANVAS_TOOL_CALLS and IMPORT_CANVAS_DOCUMENTS:
+            continue
+        filter_rule = match_message_filter(message, len(get_content_text(message.content)))
+        if filter_rule and filter_rule.get('action') in ('skip', 'summarize'):
+            continue
+        for reference, size_bytes in get_message_file_references(message):
+            if reference in UPLOADED_FILE_IDS:
+                continue
+            # Known size above the upload limit: skipped without locating or reading the file
+            if isinstance(size_bytes, int) and size_bytes > MAX_UPLOAD_FILE_SIZE:
+                tqdm.write(f"   ⚠️ File too large (>20MB), skipping: {reference}")
+                UPLOADED_FILE_IDS[reference] = None
+                continue
+            plan.append(reference)
+    return list(dict.fromkeys(plan))
+
+def upload_planned_files(plan, headers):
+    """Upload the planned files in parallel (UPLOAD_WORKERS threads), results go to the upload cache"""
+    if not plan:
+        return
+    tqdm.write(f"   - 📎 Uploading {len(plan)} files ({UPLOAD_WORKERS} in parallel)...")
+    RUN_METRICS["uploads_pending"] += len(plan)
+    iter_export_files()  # Build the export file index before the workers start, they only read it
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        futures = [executor.submit(upload_file_to_notion, os.path.join(CHATGPT_EXPORT_PATH, reference), headers) for reference in plan]
+        for reference, future in zip(plan, futures):
+            # An unexpected error fails only that file, not the whole conversation
+            try:
+                UPLOADED_FILE_IDS[reference] = future.result()
+            except Exception as e:
+                tqdm.write(f"   ❌ File upload failed: {reference}: {e!r}")
+                UPLOADED_FILE_IDS[reference] = None
+            finally:
+                RUN_METRICS["uploads_pending"] -= 1
+
+# Content keys read by the content handlers, the rest (e.g. image width/height, fovea, DALL·E metadata) is dropped when the tree is built
+MESSAGE_CONTENT_KEYS = ('parts', 'text', 'language', 'result', 'summary', 'title', 'url', 'domain', 'thoughts', 'content')
+MESSAGE_PART_KEYS = ('content_type', 'text', 'asset_pointer', 'size_bytes', 'audio_asset_pointer')  # Keys kept of multimodal parts
+MESSAGE_METADATA_KEYS = ('attachments', 'canvas')  # Metadata keys named in filter rules are kept as well
+ATTACHMENT_KEYS = ('id', 'name', 'size', 'mime_type')
+
+def compact_message_part(part):
+    """Multimodal part: strings are kept as they are, dicts only keep the keys used for rendering (nested audio pointers too)"""
+    if isinstance(part, str):
+        return part
+    compact = {key: part[key] for key in MESSAGE_PART_KEYS if key in part}
+    if isinstance(compact.get('content_type'), str):
+        compact['content_type'] = sys.intern(compact['content_type'])
+    if isinstance(compact.get('audio_asset_pointer'), dict):
+        compact['audio_asset_pointer'] = compact_message_part(compact['audio_asset_pointer'])
+    return compact
+
+def compact_message_content(content):
+    """Keep only the content fields read by the content handlers"""
+    compact = {key: content[key] for key in MESSAGE_CONTENT_KEYS if key in content}
+    if isinstance(compact.get('parts'), list):
+        compact['parts'] = [compact_message_part(part) for part in compact['parts'] if isinstance(part, (str, dict))]
+    if isinstance(compact.get('thoughts'), list):
+        compact['thoughts'] = [{key: thought[key] for key in ('summary', 'content') if key in thought}
+                               for thought in compact['thoughts'] if isinstance(thought, dict)]
+    return compact
+
+def compact_message_metadata(metadata):
+    """Keep only attachments, canvas and the metadata keys referenced by filter rules"""
+    keys = MESSAGE_METADATA_KEYS + tuple(rule['metadata'] for rule in load_message_filter_policy() if rule.get('metadata'))
+    compact = {key: metadata[key] for key in keys if key in metadata}
+    if isinstance(compact.get('attachments'), list):
+        compact['attachments'] = [{key: attachment[key] for key in ATTACHMENT_KEYS if key in attachment}
+                                  for attachment in compact['attachments'] if isinstance(attachment, dict)]
+    return compact
+
+class MessageRecord:
+    """Compact message record: only the fields used for rendering, role / content_type strings interned"""
+    __slots__ = ('role', 'author_name', 'recipient', 'content_type', 'content', 'metadata', 'create_time')
+
+    def __init__(self, message):
+        author = message.get('author') or {}
+        content = message.get('content') or None
+        metadata = message.get('metadata')
+        self.role = sys.intern(author.get('role') or 'unknown')
+        self.author_name = sys.intern(author.get('name') or '')
+        self.recipient = sys.intern(message.get('recipient') or 'all')
+        self.content_type = sys.intern(content.get('content_type') or '') if content else ''
+        self.content = compact_message_content(content) if content else None
+        self.metadata = compact_message_metadata(metadata) if isinstance(metadata, dict) else {}
+        self.create_time = message.get('create_time')
+
+class ConversationTree:
+    """Conversation tree as parallel arrays indexed by integer node number (parent -1 = none)"""
+    __slots__ = ('node_ids', 'parents', 'children', 'messages', 'current')
+
+    def __init__(self, node_ids, parents, children, messages, current):
+        self.node_ids = node_ids  # Integer node number -> original node ID
+        self.parents = parents  # array('i') of parent node numbers
+        self.children = children  # Tuple of child node numbers, or None
+        self.messages = messages  # MessageRecord, or None for nodes without a message
+        self.current = current  # Number of current_node, -1 if missing
+
+    def __len__(self):
+        return len(self.node_ids)
+
+def build_conversation_tree(conversation_data):
+    """Build the compact tree from the raw export JSON once (single pass over mapping)"""
+    mapping = conversation_data.get('mapping') or {}
+    node_ids = list(mapping)
+    index_of = {node_id: n for n, node_id in enumerate(node_ids)}  # Only needed while building
+    parents = array('i', [-1]) * len(node_ids)
+    children = [None] * len(node_ids)
+    messages = [None] * len(node_ids)
+
+    for n, node_id in enumerate(node_ids):
+        node = mapping[node_id] or {}
+        parent_id = node.get('parent')
+        if parent_id in index_of:
+            parents[n] = index_of[parent_id]
+        child_ids = node.get('children')
+        if child_ids and isinstance(child_ids, list):
+            children[n] = tuple(index_of[c] for c in child_ids if c in index_of)
+        if node.get('message'):
+            messages[n] = MessageRecord(node['message'])
+
+    current = index_of.get(conversation_data.get('current_node'), -1)
+    return ConversationTree(node_ids, parents, children, messages, current)
+
+def get_conversation_path(tree):
+    """Reconstruct the displayed message path (root -> current_node) via current_node and parent pointers, returns node numbers"""
+    if not len(tree):
+        return []
+
+    path = []
+    parents = tree.parents
+
+    # Walk up from the currently displayed node, cost proportional to path length (includes edited/regenerated branch)
+    node = tree.current
+    if node >= 0:
+        # A valid path cannot be longer than the node count, this bound also stops cycles caused by corrupted data
+        while node >= 0 and len(path) < len(parents):
+            path.append(node)
+            node = parents[node]
+        path.reverse()
+        return path
+
+    # Older exports without current_node: find root node and follow the first child
+    root = next((n for n, parent in enumerate(parents) if parent < 0), -1)
+    if root < 0:
+        # If no clear root node, find earliest message as starting point
+        messages = tree.messages
+        root = min(range(len(parents)),
+                   key=lambda n: (messages[n] and messages[n].create_time) or float('inf'))
+
+    node = root
+    while node >= 0 and len(path) < len(parents):
+        path.append(node)
+        children = tree.children[node]
+        node = children[0] if children else -1
+    return path
+
+def text_to_blocks(text):
+    """Split text into validated paragraph blocks"""
     blocks = []
-    current_id = root_id
-    visited = set()  # Prevent infinite loops
-    depth = 0
-    
-    # Canvas document deduplication set (by textdoc_id)
-    seen_canvas_docs = set()
-    
-    # Safe traversal of conversation tree
-    while current_id in mapping and current_id not in visited and depth < MAX_TRAVERSE_DEPTH:
-        visited.add(current_id)
-        depth += 1
-        
-        node = mapping.get(current_id, {})
-        message = node.get('message')
+    for chunk in split_long_text(text):
+        block = {
+            "type": "paragraph",
+            "paragraph": {
+                "rich_text": [{"type": "text", "text": {"content": chunk}}]
+            }
+        }
+        validated_block = validate_block_content(block)
+        if validated_block:
+            blocks.append(validated_block)
+    return blocks
 
-        if message and isinstance(message.get('metadata'), dict) and 'canvas' in message['metadata']:
-            canvas_meta = message['metadata']['canvas']
-            textdoc_id = canvas_meta.get('textdoc_id')
-            if textdoc_id and textdoc_id not in seen_canvas_docs:
-                seen_canvas_docs.add(textdoc_id)
+def code_to_blocks(speaker_label, code_text, language):
+    """Speaker label paragraph followed by validated code blocks"""
+    blocks = text_to_blocks(speaker_label)
+    # Handle long code splitting
+    for chunk in split_long_text(code_text):
+        code_block = {
+            "type": "code",
+            "code": {
+                "rich_text": [{"type": "text", "text": {"content": chunk}}],
+                "language": get_safe_language_type(language)
+            }
+        }
+        validated_code_block = validate_block_content(code_block)
+        if validated_code_block:
+            blocks.append(validated_code_block)
+    return blocks
 
-                canvas_title = canvas_meta.get('title') or canvas_meta.get('textdoc_type', 'Canvas')
-                canvas_type = canvas_meta.get('textdoc_type', 'document')
-                canvas_version = canvas_meta.get('version')
+def render_text_content(content, speaker_label, headers):
+    """text: plain text message"""
+    full_content = "".join(part for part in content.get('parts') or [] if isinstance(part, str))
+    if not full_content.strip():
+        return []
+    return text_to_blocks(f"{speaker_label}\n{full_content}")
 
-                desc_lines = [f"Canvas Module -> Title: {canvas_title}"]
-                desc_lines.append(f"Type: {canvas_type} | Version: {canvas_version} | ID: {textdoc_id}")
+def markdown_text_blocks(block_type, lines):
+    """Blocks for collected text lines: paragraphs are split into several blocks, headings / list items / quotes into rich_text items of one block"""
+    text = "\n".join(lines).strip()
+    if not block_type or not text:
+        return []
+    if block_type == 'paragraph':
+        return [make_text_block('paragraph', chunk) for chunk in split_long_text(text)]
+    return [{
+        "type": block_type,
+        block_type: {
+            "rich_text": [{"type": "text", "text": {"content": chunk}} for chunk in split_long_text(text)[:NOTION_MAX_RICH_TEXT_ITEMS]]
+        }
+    }]
 
-                desc_text = "\n".join(filter(None, desc_lines))
+def markdown_code_blocks(lines, language):
+    """Code blocks for the content of a fenced block (keeps the fence language, split into several blocks when long)"""
+    code_text = "\n".join(lines)
+    if not code_text.strip():
+        return []
+    return [make_text_block('code', chunk, get_safe_language_type(language)) for chunk in split_long_text(code_text)]
+
+def iter_markdown_blocks(text):
+    """Single-pass markdown tokenizer: yields Notion heading / list / quote / code / divider / paragraph blocks line by line
+
+    Every line is looked at once and text lines are collected before being joined, so the cost is linear in the message length.
+    Inline formatting is kept as plain text and nested lists are flattened.
+    """
+    pending_type, pending_lines = None, []  # Text block being collected
+    fence, code_language, code_lines = None, None, []
+
+    for line in text.split('\n'):
+        if fence:
+            # Inside a code fence: only look for a closing fence of the same character and at least the same length
+            stripped = line.strip()
+            if stripped.startswith(fence) and not stripped.strip(fence[0]):
+                yield from markdown_code_blocks(code_lines, code_language)
+                fence = None
+            else:
+                code_lines.append(line)
+            continue
+
+        fence_match = MARKDOWN_FENCE_PATTERN.match(line)
+        if fence_match:
+            yield from markdown_text_blocks(pending_type, pending_lines)
+            pending_type, pending_lines = None, []
+            fence, code_language, code_lines = fence_match.group(1), fence_match.group(2), []
+            continue
+
+        if not line.strip():
+            yield from markdown_text_blocks(pending_type, pending_lines)
+            pending_type, pending_lines = None, []
+            continue
+
+        heading_match = MARKDOWN_HEADING_PATTERN.match(line)
+        divider_match = MARKDOWN_DIVIDER_PATTERN.match(line) if not heading_match else None
+        list_match = None
+        if not heading_match and not divider_match:
+            list_match = MARKDOWN_BULLET_PATTERN.match(line) or MARKDOWN_NUMBERED_PATTERN.match(line)
+        if heading_match or divider_match or list_match:
+            yield from markdown_text_blocks(pending_type, pending_lines)
+            pending_type, pending_lines = None, []
+            if heading_match:
+                level = min(len(heading_match.group(1)), 3)
+                yield from markdown_text_blocks(f"heading_{level}", [heading_match.group(2).rstrip('#').strip()])
+            elif divider_match:
+                yield {"type": "divider", "divider": {}}
+            else:
+                pending_type = 'bulleted_list_item' if list_match.re is MARKDOWN_BULLET_PATTERN else 'numbered_list_item'
+                pending_lines = [list_match.group(1)]
+            continue
+
+        quote_match = MARKDOWN_QUOTE_PATTERN.match(line)
+        if quote_match:
+            if pending_type != 'quote':
+                yield from markdown_text_blocks(pending_type, pending_lines)
+                pending_type, pending_lines = 'quote', []
+            pending_lines.append(quote_match.group(1))
+            continue
+
+        # Plain line: continues a list item or paragraph, ends a quote
+        if pending_type in (None, 'quote'):
+            yield from markdown_text_blocks(pending_type, pending_lines)
+            pending_type, pending_lines = 'paragraph', []
+        pending_lines.append(line if pending_type == 'paragraph' else line.strip())
+
+    if fence:
+        # Unclosed fence: the rest of the message is code
+        yield from markdown_code_blocks(code_lines, code_language)
+    yield from markdown_text_blocks(pending_type, pending_lines)
+
+def render_markdown_content(content, speaker_label, headers):
+    """Assistant text message: rendered as markdown (plain text when RENDER_MARKDOWN is off)"""
+    if not RENDER_MARKDOWN:
+        return render_text_content(content, speaker_label, headers)
+    full_content = "".join(part for part in content.get('parts') or [] if isinstance(part, str))
+    if not full_content.strip():
+        return []
+    return text_to_blocks(speaker_label) + list(iter_markdown_blocks(full_content))
+
+def render_multimodal_content(content, speaker_label, headers):
+    """multimodal_text: text + images + voice (images and audio are uploaded to Notion, transcripts become text)"""
+    parts = content.get('parts') or []
+    # Voice mode transcripts are rendered together with the plain text
+    text = "".join(part for part in parts if isinstance(part, str))
+    transcripts = [part['text'] for part in parts
+                   if isinstance(part, dict) and part.get('content_type') == 'audio_transcription' and part.get('text')]
+    if transcripts:
+        text = "\n".join(filter(None, [text] + [f"🎙️ {transcript}" for transcript in transcripts]))
+    blocks = text_to_blocks(f"{speaker_label}\n{text}") if text.strip() else []
+
+    # Handle image part
+    for part in parts:
+        if isinstance(part, dict) and part.get('content_type') == 'image_asset_pointer':
+            asset_pointer = part.get('asset_pointer', '')
+            if asset_pointer.startswith('file-service://'):
+                file_name = asset_pointer.split('/')[-1]
+                if file_name:
+                    file_upload_id = get_file_upload_id(file_name, headers)
+                    if file_upload_id:
+                        if DEBUG_IMAGE_UPLOAD or os.getenv("DEBUG_IMAGE_UPLOAD") == "1":
+                            tqdm.write(f"   [DEBUG] Building image block, id={file_upload_id}")
+                        blocks.append({
+                            "type": "image",
+                            "image": {
+                                "type": "file_upload",
+                                "file_upload": {"id": file_upload_id}
+                            }
+                        })
+
+    # Handle audio part
+    for pointer in get_audio_pointers(parts):
+        file_upload_id = get_file_upload_id(get_asset_reference(pointer['asset_pointer']), headers)
+        if file_upload_id:
+            blocks.append({
+                "type": "audio",
+                "audio": {
+                    "type": "file_upload",
+                    "file_upload": {"id": file_upload_id}
+                }
+            })
+    return blocks
 
-                for chunk in split_long_text(desc_text):
-                    block = {
-                        "type": "paragraph",
-                        "paragraph": {
-                            "rich_text": [{"type": "text", "text": {"content": chunk}}]
-                        }
-                    }
-                    validated_block = validate_block_content(block)
-                    if validated_block:
-                        blocks.append(validated_block)
+def get_attachment_block_type(mime_type):
+    """Notion block type for a MIME type"""
+    if mime_type == 'application/pdf':
+        return 'pdf'
+    major_type = mime_type.split('/')[0]
+    return major_type if major_type in ('image', 'audio', 'video') else 'file'
 
-        if message and message.get('content'):
-            author_role = message.get('author', {}).get('role', 'unknown')
-            
-            # Role mapping
-            speaker_map = {
-                "user": "👤 User",
-                "assistant": "🤖 Assistant", 
-                "tool": f"🛠️ Tool ({message.get('author', {}).get('name', '')})",
-                "system": "⚙️ System"
+def render_attachments(message, headers):
+    """File blocks for message attachments (metadata.attachments), uploaded through the same pipeline as images; files already rendered as image pointers are not repeated"""
+    blocks = []
+    attachments = message.metadata.get('attachments')
+    if not attachments:
+        return blocks
+    rendered = set()
+    if message.content_type == 'multimodal_text':
+        for part in message.content.get('parts') or []:
+            if isinstance(part, dict) and part.get('content_type') == 'image_asset_pointer':
+                rendered.add(part.get('asset_pointer', '').split('/')[-1])
+
+    for attachment in attachments:
+        if not isinstance(attachment, dict) or not attachment.get('id') or attachment['id'] in rendered:
+            continue
+        rendered.add(attachment['id'])
+        file_upload_id = get_file_upload_id(attachment['id'], headers)
+        if not file_upload_id:
+            continue
+        name = attachment.get('name') or attachment['id']
+        mime_type = attachment.get('mime_type') or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        block_type = get_attachment_block_type(mime_type)
+        blocks.append({
+            "type": block_type,
+            block_type: {
+                "type": "file_upload",
+                "file_upload": {"id": file_upload_id},
+                "caption": [{"type": "text", "text": {"content": clean_text_content(name)}}]
             }
-            speaker_raw = speaker_map.get(author_role, "❓ Unknown")
+        })
+    return blocks
 
-            # Convert "👤 User" format to "[👤]User:" prefix
-            def format_speaker_label(raw: str) -> str:
-                if ' ' in raw:
-                    emoji_part, name_part = raw.split(' ', 1)
-                    return f"[{emoji_part}]{name_part}:"
-                # fallback
-                return f"[{raw}]:"
+def render_code_content(content, speaker_label, headers):
+    """code: code written by the assistant (e.g. tool calls)"""
+    if not content.get('text'):
+        return []
+    return code_to_blocks(speaker_label, content['text'], content.get('language'))
 
-            speaker_label = format_speaker_label(speaker_raw)
+def render_execution_output(content, speaker_label, headers):
+    """execution_output: output of code run by the python tool"""
+    if not content.get('text'):
+        return []
+    return code_to_blocks(f"{speaker_label}\n📤 Execution output:", content['text'], 'text')
 
-            content = message['content']
-            content_type = content.get('content_type')
-            
-            # Handle plain text content
-            if content_type == 'text' and content.get('parts'):
-                full_content = "".join(part for part in content['parts'] if isinstance(part, str))
-                if full_content.strip():
-                    # Handle long text splitting
-                    text_chunks = split_long_text(f"{speaker_label}\n{full_content}")
-                    for chunk in text_chunks:
-                        block = {
-                            "type": "paragraph",
-                            "paragraph": {
-                                "rich_text": [{"type": "text", "text": {"content": chunk}}]
-                            }
-                        }
-                        validated_block = validate_block_content(block)
-                        if validated_block:
-                            blocks.append(validated_block)
-            
-            # Handle multimodal content (text + images)
-            elif content_type == 'multimodal_text':
-                # First handle text part
-                prompt_text = "".join(part for part in content['parts'] if isinstance(part, str))
-                if prompt_text.strip():
-                    text_chunks = split_long_text(f"{speaker_label}\n{prompt_text}")
-                    for chunk in text_chunks:
-                        block = {
-                            "type": "paragraph",
-                            "paragraph": {
-                                "rich_text": [{"type": "text", "text": {"content": chunk}}]
-                            }
-                        }
-                        validated_block = validate_block_content(block)
-                        if validated_block:
-                            blocks.append(validated_block)
-                
-                # Handle image part
-                for part in content['parts']:
-                    if isinstance(part, dict) and part.get('content_type') == 'image_asset_pointer':
-                        asset_pointer = part.get('asset_pointer', '')
-                        if asset_pointer.startswith('file-service://'):
-                            file_name = asset_pointer.split('/')[-1]
-                            if file_name:
-                                local_image_path = os.path.join(CHATGPT_EXPORT_PATH, file_name)
-                                file_upload_id = upload_file_to_notion(local_image_path, headers)
-                                if file_upload_id:
-                                    if DEBUG_IMAGE_UPLOAD or os.getenv("DEBUG_IMAGE_UPLOAD") == "1":
-                                        tqdm.write(f"   [DEBUG] Building image block, id={file_upload_id}")
-                                    blocks.append({
-                                        "type": "image",
-                                        "image": {
-                                            "type": "file_upload",
-                                            "file_upload": {"id": file_upload_id}
-                                        }
-                                    })
-
-            # Handle code blocks
-            elif content_type == 'code' and content.get('text'):
-                # Add speaker identification
-                speaker_block = {
-                    "type": "paragraph",
-                    "paragraph": {
-                        "rich_text": [{"type": "text", "text": {"content": speaker_label}}]
-                    }
-                }
-                validated_speaker_block = validate_block_content(speaker_block)
-                if validated_speaker_block:
-                    blocks.append(validated_speaker_block)
-                
-                # Handle long code splitting
-                code_chunks = split_long_text(content['text'])
-                for chunk in code_chunks:
-                    code_block = {
-                        "type": "code",
-                        "code": {
-                            "rich_text": [{"type": "text", "text": {"content": chunk}}],
-                            "language": get_safe_language_type(content.get('language'))
-                        }
-                    }
-                    validated_code_block = validate_block_content(code_block)
-                    if validated_code_block:
-                        blocks.append(validated_code_block)
-
-            # Handle system errors
-            elif content_type == 'system_error' and content.get('text'):
-                error_text = f"{speaker_label}\n❗️ System Error: {content.get('text')}"
-                text_chunks = split_long_text(error_text)
-                for chunk in text_chunks:
-                    error_block = {
-                        "type": "paragraph",
-                        "paragraph": {
-                            "rich_text": [{"type": "text", "text": {"content": chunk}}]
-                        }
-                    }
-                    validated_error_block = validate_block_content(error_block)
-                    if validated_error_block:
-                        blocks.append(validated_error_block)
+def render_system_error(content, speaker_label, headers):
+    """system_error: system error"""
+    if not content.get('text'):
+        return []
+    return text_to_blocks(f"{speaker_label}\n❗️ System Error: {content.get('text')}")
+
+def render_browsing_display(content, speaker_label, headers):
+    """tether_browsing_display: web browsing result shown to the model"""
+    result = content.get('result') or content.get('summary') or ''
+    if not result.strip():
+        return []
+    return text_to_blocks(f"{speaker_label}\n🌐 Browsing result:\n{result}")
+
+def render_quote(content, speaker_label, headers):
+    """tether_quote: quoted excerpt of a web page or file"""
+    source = " | ".join(filter(None, [content.get('title'), content.get('url') or content.get('domain')]))
+    quote_text = content.get('text') or ''
+    if not source and not quote_text.strip():
+        return []
+    return text_to_blocks(f"{speaker_label}\n📑 Quote: {source}\n{quote_text}")
+
+def render_thoughts(content, speaker_label, headers):
+    """thoughts: reasoning summaries of reasoning models"""
+    thoughts = []
+    for thought in content.get('thoughts') or []:
+        if isinstance(thought, dict):
+            thought_text = "\n".join(filter(None, [thought.get('summary'), thought.get('content')]))
+            if thought_text.strip():
+                thoughts.append(thought_text)
+    if not thoughts:
+        return []
+    return text_to_blocks(f"{speaker_label}\n💭 Thoughts:\n" + "\n\n".join(thoughts))
+
+def render_reasoning_recap(content, speaker_label, headers):
+    """reasoning_recap: "Thought for N seconds" note"""
+    recap = content.get('content')
+    if not isinstance(recap, str) or not recap.strip():
+        return []
+    return text_to_blocks(f"{speaker_label}\n💭 {recap}")
+
+# Content type -> render function (content, speaker label, headers) -> blocks; supporting a new export format only needs an entry here
+# (role, content type) keys take precedence over plain content type keys
+CONTENT_TYPE_HANDLERS = {
+    'text': render_text_content,
+    ('assistant', 'text'): render_markdown_content,
+    'multimodal_text': render_multimodal_content,
+    'code': render_code_content,
+    'execution_output': render_execution_output,
+    'system_error': render_system_error,
+    'tether_browsing_display': render_browsing_display,
+    'tether_quote': render_quote,
+    'thoughts': render_thoughts,
+    'reasoning_recap': render_reasoning_recap,
+}
+
+# Per content type counters: messages seen, blocks emitted, time spent (unregistered types only count messages)
+CONTENT_HANDLER_STATS = {}
+
+def print_content_handler_stats():
+    """Print render statistics per content type"""
+    if not CONTENT_HANDLER_STATS:
+        return
+    print("📊 Content types:")
+    for content_type, stats in sorted(CONTENT_HANDLER_STATS.items(), key=lambda item: item[1]['messages'], reverse=True):
+        if content_type in CONTENT_TYPE_HANDLERS:
+            print(f"   {content_type}: {stats['messages']} messages -> {stats['blocks']} blocks, {stats['seconds']:.2f}s")
+        else:
+            print(f"   {content_type}: {stats['messages']} messages (no handler, skipped)")
+
+# Loaded filter policy (lazily loaded)
+MESSAGE_FILTER_RULES = None
+# Messages handled by the filter policy, and estimated blocks / characters saved
+MESSAGE_FILTER_STATS = {"skip": 0, "truncate": 0, "summarize": 0, "blocks_saved": 0, "chars_saved": 0}
+
+def load_message_filter_policy():
+    """Filter rules from MESSAGE_FILTER_POLICY_FILE if present, otherwise MESSAGE_FILTER_POLICY"""
+    global MESSAGE_FILTER_RULES
+    if MESSAGE_FILTER_RULES is None:
+        MESSAGE_FILTER_RULES = MESSAGE_FILTER_POLICY
+        if os.path.exists(MESSAGE_FILTER_POLICY_FILE):
+            try:
+                with open(MESSAGE_FILTER_POLICY_FILE, 'r', encoding='utf-8') as f:
+                    MESSAGE_FILTER_RULES = json.load(f)
+            except Exception as e:
+                print(f"Warning: Unable to read message filter policy file: {e}")
+    return MESSAGE_FILTER_RULES
+
+def get_content_text(content):
+    """All text of a message content (used for size-based filter rules)"""
+    text = "".join(
+        part if isinstance(part, str) else part.get('text') or ''
+        for part in content.get('parts') or []
+        if isinstance(part, str) or (isinstance(part, dict) and part.get('content_type') == 'audio_transcription')
+    )
+    for key in ('text', 'result'):
+        if isinstance(content.get(key), str):
+            text += content[key]
+    return text
+
+def match_message_filter(message, text_length):
+    """First filter rule matching the message, or None"""
+    for rule in load_message_filter_policy():
+        if not all(
+            message_value in (rule[key] if isinstance(rule[key], list) else [rule[key]])
+            for key, message_value in (('role', message.role), ('author_name', message.author_name), ('content_type', message.content_type))
+            if key in rule
+        ):
+            continue
+        if rule.get('metadata') and not message.metadata.get(rule['metadata']):
+            continue
+        if text_length < rule.get('min_chars', 0):
+            continue
+        return rule
+    return None
+
+def truncate_content(content, max_chars):
+    """Copy of content with its text fields cut to max_chars characters in total"""
+    truncated = dict(content)
+    remaining = max_chars
+    if isinstance(content.get('parts'), list):
+        truncated['parts'] = []
+        for part in content['parts']:
+            if isinstance(part, str):
+                part = part[:remaining]
+                remaining -= len(part)
+            truncated['parts'].append(part)
+    for key in ('text', 'result'):
+        if isinstance(content.get(key), str):
+            truncated[key] = content[key][:remaining]
+            remaining -= len(truncated[key])
+    return truncated
+
+# Source markers in browsing results: 【index†title†link】
+BROWSING_SOURCE_PATTERN = re.compile(r'【\d+(?::\d+)?†([^†】]+)†([^†】]+)】')
+
+def summarize_content(content, text, max_chars):
+    """Digest kept by the summarize action: source titles and links of quotes / browsing results, otherwise the first max_chars characters (whitespace collapsed)"""
+    sources = []
+    if content.get('title') or content.get('url'):
+        sources.append(" | ".join(filter(None, [content.get('title'), content.get('url') or content.get('domain')])))
+    for title, link in BROWSING_SOURCE_PATTERN.findall(text):
+        source = f"{title.strip()} | {link.strip()}"
+        if source not in sources:
+            sources.append(source)
+    if sources:
+        return "\n".join(f"- {source}" for source in sources[:MESSAGE_SUMMARY_LINKS])
+    digest = " ".join(text.split())
+    return digest if len(digest) <= max_chars else digest[:max_chars].rstrip() + "…"
+
+def record_filtered_message(action, original_text, kept_text):
+    """Count a filtered message and the blocks / characters it would have produced"""
+    original_blocks = len(split_long_text(original_text)) if original_text else 0
+    kept_blocks = len(split_long_text(kept_text)) if kept_text else 0
+    MESSAGE_FILTER_STATS[action] += 1
+    MESSAGE_FILTER_STATS["blocks_saved"] += max(original_blocks - kept_blocks, 0)
+    MESSAGE_FILTER_STATS["chars_saved"] += max(len(original_text) - len(kept_text), 0)
+
+def get_filter_requests_saved():
+    """Append requests saved by the message filter: after packing, requests are limited by both block count and payload characters, take the larger estimate"""
+    return max(MESSAGE_FILTER_STATS['blocks_saved'] / APPEND_BATCH_SIZE, MESSAGE_FILTER_STATS['chars_saved'] / BATCH_PAYLOAD_LIMIT)
+
+def print_message_filter_stats():
+    """Print blocks and requests saved by the message filter policy"""
+    if not (MESSAGE_FILTER_STATS['skip'] or MESSAGE_FILTER_STATS['truncate'] or MESSAGE_FILTER_STATS['summarize']):
+        return
+    requests_saved = get_filter_requests_saved()
+    print(f"✂️ Message filter: skipped {MESSAGE_FILTER_STATS['skip']}, truncated {MESSAGE_FILTER_STATS['truncate']}, summarized {MESSAGE_FILTER_STATS['summarize']} messages")
+    print(f"   Saved about {MESSAGE_FILTER_STATS['blocks_saved']} blocks and {requests_saved:.0f} append requests ({MESSAGE_FILTER_STATS['chars_saved']} characters)")
+
+# Role -> speaker name ({name} is the tool name)
+SPEAKER_ROLES = {
+    "user": "👤 User",
+    "assistant": "🤖 Assistant",
+    "tool": "🛠️ Tool ({name})",
+    "system": "⚙️ System"
+}
+SPEAKER_UNKNOWN = "❓ Unknown"
+
+def format_speaker_label(raw):
+    """Convert "👤 User" format to "[👤]User:" prefix"""
+    if ' ' in raw:
+        emoji_part, name_part = raw.split(' ', 1)
+        return f"[{emoji_part}]{name_part}:"
+    # fallback
+    return f"[{raw}]:"
+
+def build_speaker_label_pattern():
+    """Matches only the speaker prefixes actually generated (compact_blocks uses it to find message starts), plain text like "[1] see: ..." does not match"""
+    alternatives = []
+    for raw in (*SPEAKER_ROLES.values(), SPEAKER_UNKNOWN):
+        prefix, placeholder, suffix = format_speaker_label(raw).partition('{name}')
+        alternatives.append(re.escape(prefix) + (r'[^\n]*?' + re.escape(suffix) if placeholder else ''))
+    return re.compile('^(?:' + '|'.join(alternatives) + ')')
+
+SPEAKER_LABEL_PATTERN = build_speaker_label_pattern()  # Speaker prefix like "[👤]User:"
+
+def build_blocks_from_message(message, headers, seen_canvas_docs):
+    """Render a single message (MessageRecord) as a list of Notion blocks"""
+    blocks = []
+    if not message:
+        return blocks
+
+    # Filter policy is evaluated on the raw message, before rendering and cleaning
+    content_text = get_content_text(message.content) if message.content else ""
+    filter_rule = match_message_filter(message, len(content_text))
+    filter_action = filter_rule.get('action') if filter_rule else None
+    if filter_action == 'skip':
+        record_filtered_message('skip', content_text, "")
+        return blocks
+
+    # Canvas tool calls are represented by the rebuilt document (see iter_canvas_sections), their JSON arguments are not rendered
+    if message.recipient in CANVAS_TOOL_CALLS and IMPORT_CANVAS_DOCUMENTS:
+        return blocks
+
+    if 'canvas' in message.metadata:
+        canvas_meta = message.metadata['canvas']
+        textdoc_id = canvas_meta.get('textdoc_id')
+        if textdoc_id and textdoc_id not in seen_canvas_docs:
+            seen_canvas_docs.add(textdoc_id)
+
+            canvas_title = canvas_meta.get('title') or canvas_meta.get('textdoc_type', 'Canvas')
+            canvas_type = canvas_meta.get('textdoc_type', 'document')
+            canvas_version = canvas_meta.get('version')
+
+            desc_lines = [f"Canvas Module -> Title: {canvas_title}"]
+            desc_lines.append(f"Type: {canvas_type} | Version: {canvas_version} | ID: {textdoc_id}")
+
+            desc_text = "\n".join(filter(None, desc_lines))
+
+            blocks.extend(text_to_blocks(desc_text))
+
+    if message.content:
+        author_role = message.role
+        
+        # Role mapping
+        speaker_raw = SPEAKER_ROLES.get(author_role, SPEAKER_UNKNOWN).replace('{name}', message.author_name)
+        speaker_label = format_speaker_label(speaker_raw)
+
+        # Dispatch by content type (CONTENT_TYPE_HANDLERS), counting messages, blocks and time per type
+        content_type = message.content_type or 'unknown'
+        stats = CONTENT_HANDLER_STATS.setdefault(content_type, {"messages": 0, "blocks": 0, "seconds": 0.0})
+        stats["messages"] += 1
+
+        content = message.content
+        if filter_action == 'summarize':
+            # Summary blocks are counted under the content type like rendered ones
+            start = time.perf_counter()
+            digest = summarize_content(content, content_text, filter_rule.get('max_chars', MESSAGE_SUMMARY_CHARS))
+            summary = f"{speaker_label}\n✂️ {content_type} summarized ({len(content_text)} characters):\n{digest}"
+            record_filtered_message('summarize', content_text, summary)
+            summary_blocks = text_to_blocks(summary)
+            stats["seconds"] += time.perf_counter() - start
+            stats["blocks"] += len(summary_blocks)
+            blocks.extend(summary_blocks)
+            return blocks
+        if filter_action == 'truncate':
+            content = truncate_content(content, filter_rule.get('max_chars', MAX_TEXT_LENGTH))
+            kept_text = get_content_text(content)
+            record_filtered_message('truncate', content_text, kept_text)
+
+        handler = CONTENT_TYPE_HANDLERS.get((message.role, content_type)) or CONTENT_TYPE_HANDLERS.get(content_type)
+        if handler:
+            start = time.perf_counter()
+            content_blocks = handler(content, speaker_label, headers)
+            stats["seconds"] += time.perf_counter() - start
+            stats["blocks"] += len(content_blocks)
+            blocks.extend(content_blocks)
+            if filter_action == 'truncate' and len(kept_text) < len(content_text):
+                notice_blocks = text_to_blocks(f"✂️ {len(content_text) - len(kept_text)} characters truncated")
+                stats["blocks"] += len(notice_blocks)
+                blocks.extend(notice_blocks)
+
+        # Attachments follow the message content as file blocks
+        blocks.extend(render_attachments(message, headers))
 
-        # Move to next node
-        children = node.get('children', [])
-        current_id = children[0] if children and isinstance(children, list) else None
-    
-    # Warning: if maximum depth reached
-    if depth >= MAX_TRAVERSE_DEPTH:
-        tqdm.write(f"   ⚠️ Warning: Reached maximum traversal depth ({MAX_TRAVERSE_DEPTH}), conversation may be incomplete")
-    
     return blocks
 
-def import_conversation_to_notion(title, create_time, update_time, conversation_id, all_blocks, headers, database_id, db_info):
-    """Import single conversation to Notion database"""
-    if not all_blocks:
-        tqdm.write(f"   - Skipping empty conversation: {title}")
+def build_blocks_from_nodes(tree, nodes, headers, seen_canvas_docs=None):
+    """Render messages of a sequence of nodes in order (generator, yields blocks message by message)"""
+    if seen_canvas_docs is None:
+        seen_canvas_docs = set()  # Canvas document deduplication set (by textdoc_id)
+    messages = tree.messages
+    elapsed = 0.0  # Rendering only, time spent downstream consuming the blocks is excluded
+    for node in nodes:
+        start = time.perf_counter()
+        # The page already exists once the first batch is sent: a message that fails to render becomes a notice block instead of failing the conversation (a rerun would create a duplicate page)
+        try:
+            blocks = build_blocks_from_message(messages[node], headers, seen_canvas_docs)
+        except Exception as e:
+            content_type = messages[node].content_type if messages[node] else ''
+            tqdm.write(f"   ⚠️ Warning: Unable to render message ({content_type or 'unknown'}): {e!r}")
+            count_conversation_event('fallbacks')
+            blocks = text_to_blocks(f"⚠️ This message could not be rendered ({content_type or 'unknown'}: {type(e).__name__})")
+        elapsed += time.perf_counter() - start
+        yield from blocks
+    PHASE_TIMINGS['block_build'].append(elapsed)
+
+def get_message_preview(message, limit=50):
+    """Short one-line preview of a message's text (used in branch labels)"""
+    content = (message.content if message else None) or {}
+    text = "".join(part for part in content.get('parts') or [] if isinstance(part, str)) or content.get('text') or ""
+    text = " ".join(text.split())
+    return text[:limit] + "..." if len(text) > limit else text
+
+def iter_alternate_branches(tree, path):
+    """Iteratively walk the tree outside the displayed path, yields (divergence node number, branch node number list)
+
+    Only the part after the divergence point is yielded, the prefix shared with the displayed path is not repeated.
+    """
+    seen = bytearray(len(tree))  # Visited flag per node number
+    for node in path:
+        seen[node] = 1
+
+    # Stack instead of recursion: (divergence node, branch start node), first branch of the path is processed first
+    stack = []
+    for node in reversed(path):
+        for child in reversed(tree.children[node] or ()):
+            if not seen[child]:
+                stack.append((node, child))
+
+    while stack:
+        parent, node = stack.pop()
+        branch = []
+        while not seen[node]:
+            seen[node] = 1
+            branch.append(node)
+            children = [c for c in tree.children[node] or () if not seen[c]]
+            if not children:
+                break
+            # Follow the latest child, the other children become branches of their own
+            for alt in reversed(children[:-1]):
+                stack.append((node, alt))
+            node = children[-1]
+        if branch:
+            yield parent, branch
+
+def iter_branch_sections(conversation_data, headers, tree=None):
+    """Alternate branches as toggle sections: yields (label, function building the branch blocks), built lazily on append"""
+    if tree is None:
+        tree = build_conversation_tree(conversation_data)
+    path = get_conversation_path(tree)
+    for n, (parent, branch) in enumerate(iter_alternate_branches(tree, path), 1):
+        preview = get_message_preview(tree.messages[parent])
+        label = f"🔀 Alternate branch {n} ({len(branch)} messages, after: {preview or 'start of conversation'})"
+        yield label, (lambda branch=branch: build_blocks_from_nodes(tree, branch, headers))
+
+# Tool calls creating / updating Canvas documents (JSON arguments), the matching tool response carries the textdoc_id
+CANVAS_TOOL_CALLS = ('canmore.create_textdoc', 'canmore.update_textdoc')
+
+def parse_canvas_call(message):
+    """Parse the JSON arguments of a canmore tool call, None if not parseable"""
+    try:
+        arguments = json.loads(message.content.get('text') or '')
+    except (ValueError, TypeError, AttributeError):
+        return None
+    return arguments if isinstance(arguments, dict) else None
+
+def is_canvas_rewrite(update):
+    """Whether an update rewrites the whole document (pattern .* replaces the entire text)"""
+    return update.get('pattern') in ('.*', '^.*$', '(?s).*')
+
+def apply_canvas_updates(content, updates):
+    """Apply the regex replacements of canmore updates in order (replacement is taken literally)"""
+    for update in updates:
+        pattern = update.get('pattern')
+        replacement = update.get('replacement') or ''
+        if not isinstance(pattern, str):
+            continue
+        try:
+            content = re.sub(pattern, lambda match: replacement, content, count=0 if update.get('multiple') else 1)
+        except re.error:
+            # Invalid pattern: skip this update
+            continue
+    return content
+
+def collect_canvas_documents(tree, path):
+    """Collect the final version of every Canvas document in one pass over the displayed path: textdoc_id -> title, type, version, content
+
+    A whole-document rewrite discards earlier content and updates, only updates after the last rewrite are applied at the end,
+    intermediate versions are never resolved one by one.
+    """
+    documents = {}
+    pending = None  # Waiting for the tool response carrying the textdoc_id: (tool name, arguments)
+    for node in path:
+        message = tree.messages[node]
+        if not message:
+            continue
+        if message.recipient in CANVAS_TOOL_CALLS:
+            pending = (message.recipient, parse_canvas_call(message))
+            continue
+
+        canvas_meta = message.metadata.get('canvas')
+        if not (pending and isinstance(canvas_meta, dict) and canvas_meta.get('textdoc_id')):
+            continue
+        tool_name, arguments = pending
+        pending = None
+        if not arguments:
+            continue
+
+        textdoc_id = canvas_meta['textdoc_id']
+        if tool_name == 'canmore.create_textdoc':
+            documents[textdoc_id] = {
+                "title": arguments.get('name') or canvas_meta.get('title'),
+                "type": arguments.get('type') or canvas_meta.get('textdoc_type') or 'document',
+                "version": canvas_meta.get('version'),
+                "content": arguments.get('content') or '',
+                "updates": []
+            }
+        elif textdoc_id in documents:
+            document = documents[textdoc_id]
+            document['version'] = canvas_meta.get('version', document['version'])
+            for update in arguments.get('updates') or []:
+                if not isinstance(update, dict):
+                    continue
+                if is_canvas_rewrite(update):
+                    document['content'] = update.get('replacement') or ''
+                    document['updates'] = []
+                else:
+                    document['updates'].append(update)
+
+    for document in documents.values():
+        document['content'] = apply_canvas_updates(document['content'], document.pop('updates'))
+    return documents
+
+def canvas_to_blocks(document):
+    """Render Canvas document content as blocks: code blocks for code documents, markdown otherwise (paragraphs when RENDER_MARKDOWN is off)"""
+    content = document['content']
+    if not content.strip():
+        return []
+    if document['type'].startswith('code/'):
+        language = get_safe_language_type(document['type'].split('/', 1)[1])
+        return [make_text_block('code', chunk, language) for chunk in split_long_text(content)]
+    if RENDER_MARKDOWN:
+        return list(iter_markdown_blocks(content))
+    return text_to_blocks(content)
+
+def iter_canvas_sections(tree):
+    """Canvas documents as toggle sections: yields (label, function building the document blocks)"""
+    documents = collect_canvas_documents(tree, get_conversation_path(tree))
+    for textdoc_id, document in documents.items():
+        label = f"📄 Canvas: {document['title'] or textdoc_id} (version {document['version']})"
+        yield label, (lambda document=document: canvas_to_blocks(document))
+
+def get_conversation_sections(conversation, headers, tree):
+    """Toggle sections appended at the end of the page: Canvas documents and (in full branch mode) alternate branches"""
+    sections = iter_canvas_sections(tree) if IMPORT_CANVAS_DOCUMENTS else iter(())
+    if IMPORT_ALL_BRANCHES or os.getenv("IMPORT_ALL_BRANCHES") == "1":
+        sections = itertools.chain(sections, iter_branch_sections(conversation, headers, tree))
+    return sections
+
+def build_blocks_from_conversation(conversation_data, headers, tree=None):
+    """Build Notion blocks from conversation data with added safety protection (returns a generator, blocks are built as the append stage consumes them)"""
+    if tree is None:
+        tree = build_conversation_tree(conversation_data)
+
+    # Traverse the displayed path of the conversation
+    return build_blocks_from_nodes(tree, get_conversation_path(tree), headers)
+
+def quarantine_block(conversation_id, title, block, error_msg):
+    """Record a block that could not be appended, for later inspection"""
+    record = {
+        "time": datetime.datetime.now().isoformat(),
+        "conversation_id": conversation_id,
+        "title": title,
+        "error": error_msg,
+        "block": block
+    }
+    try:
+        with open(QUARANTINE_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except Exception as e:
+        tqdm.write(f"   ⚠️ Warning: Unable to write quarantine file: {e}")
+
+def append_blocks_with_bisection(append_url, blocks, headers, conversation_id, title, error_msg=""):
+    """Re-append a failed batch by splitting it in halves recursively, isolating bad blocks in O(log n) requests (keeps order)"""
+    if len(blocks) == 1:
+        return append_single_failed_block(append_url, blocks[0], headers, conversation_id, title, error_msg)
+
+    successful_blocks = 0
+    mid = len(blocks) // 2
+    # Left half first, then right half, so block order on the page is preserved
+    for half in (blocks[:mid], blocks[mid:]):
+        try:
+            throttle(0.4)
+            with timed_phase('retry'):
+                notion_request(
+                    'PATCH',
+                    append_url,
+                    headers=headers,
+                    data=json.dumps({"children": half}),
+                    timeout=30
+                ).raise_for_status()
+            successful_blocks += len(half)
+        except requests.exceptions.RequestException as e:
+            half_error = e.response.text if e.response is not None else str(e)
+            successful_blocks += append_blocks_with_bisection(append_url, half, headers, conversation_id, title, half_error)
+    return successful_blocks
+
+def append_single_failed_block(append_url, block, headers, conversation_id, title, error_msg=""):
+    """Last attempt for an isolated bad block: split text into 300-char pieces sent in one request, otherwise quarantine"""
+    count_conversation_event('single_block_fallbacks')
+    block_type = block.get('type')
+    if block_type in ('paragraph', 'code'):
+        original_txt = "".join(t['text']['content'] for t in block[block_type]['rich_text'])
+        tiny_chunks = split_long_text(original_txt, max_length=300)
+        if len(tiny_chunks) > 1:
+            tiny_blocks = []
+            for tiny in tiny_chunks:
+                tiny_block = {"type": block_type, block_type: {"rich_text": [{"type": "text", "text": {"content": tiny}}]}}
+                if block_type == 'code':
+                    tiny_block['code']['language'] = block['code'].get('language', 'text')
+                tiny_blocks.append(tiny_block)
+            try:
+                throttle(0.4)
+                with timed_phase('retry'):
+                    notion_request(
+                        'PATCH',
+                        append_url,
+                        headers=headers,
+                        data=json.dumps({"children": tiny_blocks}),
+                        timeout=30
+                    ).raise_for_status()
+                return 1
+            except requests.exceptions.RequestException as e:
+                error_msg = e.response.text if e.response is not None else str(e)
+
+    tqdm.write(f"   -   ...🚫 Block quarantined ({block_type}), see {QUARANTINE_FILE}")
+    quarantine_block(conversation_id, title, block, error_msg)
+    count_conversation_event('blocks_dropped')
+    return 0
+
+def make_text_block(block_type, content, language=None):
+    """Build a paragraph / code block with a single rich_text item"""
+    block = {
+        "type": block_type,
+        block_type: {
+            "rich_text": [{"type": "text", "text": {"content": content}}]
+        }
+    }
+    if block_type == 'code':
+        block['code']['language'] = language or 'text'
+    return block
+
+def prepare_block(block):
+    """Validate and clean one block, returns the resulting blocks; blocks whose JSON is too large are split further instead of skipped"""
+    validated_block = validate_block_content(block)
+    if not validated_block:
+        return []
+
+    block_type = validated_block['type']
+    block_json_size = len(json.dumps(validated_block, ensure_ascii=False))
+    if block_json_size <= 1000 or block_type not in ('paragraph', 'code'):
+        # Size is appropriate, or other types like image blocks are added directly
+        return [validated_block]
+
+    tqdm.write(f"   - 🔄 Splitting oversized block ({block_json_size} characters)")
+    language = validated_block['code']['language'] if block_type == 'code' else None
+    original_content = validated_block[block_type]['rich_text'][0]['text']['content']
+    pieces = []
+    for chunk in split_long_text(original_content, max_length=800):
+        if not chunk.strip():
+            continue
+        smaller_block = make_text_block(block_type, chunk, language)
+        # Still too large after splitting (many escaped characters): split once more
+        if len(json.dumps(smaller_block, ensure_ascii=False)) > 1000:
+            for small_chunk in split_long_text(chunk, max_length=600):
+                if small_chunk.strip():
+                    pieces.append(make_text_block(block_type, small_chunk, language))
+        else:
+            pieces.append(smaller_block)
+    return pieces
+
+def prepare_blocks(all_blocks):
+    """Validate and clean all blocks (generator), cleaning time is recorded per conversation as the cleaning phase, built / dropped blocks in the conversation metrics"""
+    elapsed = 0.0
+    built, dropped = 0, 0
+    try:
+        for block in all_blocks:
+            start = time.perf_counter()
+            prepared = prepare_block(block)
+            elapsed += time.perf_counter() - start
+            built += 1
+            dropped += not prepared
+            yield from prepared
+        PHASE_TIMINGS['cleaning'].append(elapsed)
+    finally:
+        # If page creation fails the stream is not read to the end, the processed part is still counted
+        count_conversation_event('blocks_built', built)
+        count_conversation_event('blocks_dropped', dropped)
+
+def compact_blocks(blocks):
+    """Pack consecutive paragraphs of the same speaker into as few blocks as Notion limits allow (one rich_text item each, generator)"""
+    current = None  # Paragraph block currently being packed
+    current_chars = 0
+    current_speaker = None
+
+    for block in blocks:
+        if block.get('type') != 'paragraph':
+            if current is not None:
+                yield current
+                current = None
+            # Headings, code, images and toggles end the speaker's run, later unlabelled paragraphs are not attached to it
+            current_speaker = None
+            yield block
+            continue
+
+        items = block['paragraph']['rich_text']
+        label_match = SPEAKER_LABEL_PATTERN.match(items[0]['text']['content']) if items else None
+        speaker = label_match.group(0) if label_match else current_speaker
+        block_chars = sum(len(item['text']['content']) for item in items)
+
+        # Unlabelled paragraphs only continue a run that started with a speaker label
+        if (current is not None and speaker is not None and speaker == current_speaker
+                and len(current['paragraph']['rich_text']) + len(items) <= NOTION_MAX_RICH_TEXT_ITEMS
+                and current_chars + block_chars <= COMPACT_BLOCK_MAX_CHARS):
+            # New message of the same speaker is separated by an empty line, split pieces of one message by a line break
+            separator = "\n\n" if label_match else "\n"
+            current['paragraph']['rich_text'][-1]['text']['content'] += separator
+            current['paragraph']['rich_text'].extend(
+                {"type": "text", "text": {"content": item['text']['content']}} for item in items
+            )
+            current_chars += block_chars + len(separator)
+        else:
+            if current is not None:
+                yield current
+            current = {
+                "type": "paragraph",
+                "paragraph": {
+                    "rich_text": [{"type": "text", "text": {"content": item['text']['content']}} for item in items]
+                }
+            }
+            current_chars = block_chars
+        current_speaker = speaker
+
+    if current is not None:
+        yield current
+
+def iter_batches(blocks, max_blocks=APPEND_BATCH_SIZE, max_chars=BATCH_PAYLOAD_LIMIT, first_max_blocks=None):
+    """Group blocks into batches limited by both block count and total JSON characters (generator, keeps order)
+
+    first_max_blocks: different block limit for the first batch (e.g. children sent with page creation).
+    """
+    limit = first_max_blocks or max_blocks
+    current, current_size = [], 0
+    for block in blocks:
+        block_size = len(json.dumps(block, ensure_ascii=False))
+        if current and (len(current) >= limit or current_size + block_size > max_chars):
+            yield current
+            current, current_size = [], 0
+            limit = max_blocks
+        current.append(block)
+        current_size += block_size
+    if current:
+        yield current
+
+def count_blocks(blocks, stats, key):
+    """Pass blocks through while counting them into stats[key] (block counts of the streamed pipeline)"""
+    stats[key] = 0
+    for block in blocks:
+        stats[key] += 1
+        yield block
+
+def append_toggle_section(page_id, label, section_blocks, headers, conversation_id, title):
+    """Append a collapsed toggle block to the page, section content is nested as its children"""
+    batches = iter_batches(section_blocks)
+    first_batch = next(batches, None)
+    if not first_batch:
         return True
+    tqdm.write(f"   - 🔀 Appending section: {label}")
+
+    toggle_block = {
+        "type": "toggle",
+        "toggle": {
+            "rich_text": [{"type": "text", "text": {"content": clean_text_content(label)}}],
+            "children": first_batch
+        }
+    }
+    page_append_url = f"{NOTION_API_BASE_URL}/blocks/{page_id}/children"
+
+    try:
+        throttle(0.5)
+        with timed_phase('append'):
+            response = notion_request(
+                'PATCH',
+                page_append_url,
+                headers=headers,
+                data=json.dumps({"children": [toggle_block]}),
+                timeout=30
+            )
+        response.raise_for_status()
+        RUN_METRICS["blocks_appended"] += len(first_batch)
+        remaining_batches = batches
+    except requests.exceptions.RequestException:
+        # Nested content failed: create empty toggle first, then append content batch by batch
+        count_conversation_event('fallbacks')
+        del toggle_block['toggle']['children']
+        try:
+            throttle(0.5)
+            with timed_phase('retry'):
+                response = notion_request(
+                    'PATCH',
+                    page_append_url,
+                    headers=headers,
+                    data=json.dumps({"children": [toggle_block]}),
+                    timeout=30
+                )
+            response.raise_for_status()
+            remaining_batches = itertools.chain([first_batch], batches)
+        except requests.exceptions.RequestException as e:
+            error_msg = e.response.text if e.response is not None else str(e)
+            tqdm.write(f"   -   ...❌ Toggle block append failed: {error_msg}")
+            return False
+
+    toggle_append_url = f"{NOTION_API_BASE_URL}/blocks/{response.json()['results'][0]['id']}/children"
+    for batch in remaining_batches:
+        try:
+            throttle(0.5)
+            with timed_phase('append'):
+                notion_request(
+                    'PATCH',
+                    toggle_append_url,
+                    headers=headers,
+                    data=json.dumps({"children": batch}),
+                    timeout=30
+                ).raise_for_status()
+            RUN_METRICS["blocks_appended"] += len(batch)
+        except requests.exceptions.RequestException as e:
+            error_msg = e.response.text if e.response is not None else str(e)
+            count_conversation_event('fallbacks')
+            RUN_METRICS["blocks_appended"] += append_blocks_with_bisection(toggle_append_url, batch, headers, conversation_id, title, error_msg)
+    return True
 
+def import_conversation_to_notion(title, create_time, update_time, conversation_id, all_blocks, headers, database_id, db_info, sections=None):
+    """Import single conversation to Notion database (sections: optional extra toggle sections, e.g. alternate branches)"""
     # Limit title length to avoid Notion API errors
     if len(title) > 100:
         title = title[:97] + "..."
@@ -664,67 +2553,32 @@ def import_conversation_to_notion(title, create_time, update_time, conversation_
     # Clean title content
     title = clean_text_content(title)
 
-    # Validate and clean all block content
-    cleaned_blocks = []
-    for block in all_blocks:
-        validated_block = validate_block_content(block)
-        if validated_block:
-            # Additional check: if single block JSON representation is too large, split further instead of skipping
-            block_json_size = len(json.dumps(validated_block, ensure_ascii=False))
-            if block_json_size > 1000:  # Blocks that need further splitting
-                tqdm.write(f"   - 🔄 Splitting oversized block ({block_json_size} characters)")
-                
-                # Get block text content for splitting
-                if validated_block['type'] == 'paragraph':
-                    original_content = validated_block['paragraph']['rich_text'][0]['text']['content']
-                    # Split content into smaller blocks
-                    smaller_chunks = split_long_text(original_content, max_length=800)
-                    for chunk in smaller_chunks:
-                        if chunk.strip():
-                            smaller_block = {
-                                "type": "paragraph",
-                                "paragraph": {
-                                    "rich_text": [{"type": "text", "text": {"content": chunk}}]
-                                }
-                            }
-                            cleaned_blocks.append(smaller_block)
-                elif validated_block['type'] == 'code':
-                    original_content = validated_block['code']['rich_text'][0]['text']['content']
-                    language = validated_block['code']['language']
-                    # Split code into smaller blocks
-                    smaller_chunks = split_long_text(original_content, max_length=800)
-                    for chunk in smaller_chunks:
-                        if chunk.strip():
-                            smaller_block = {
-                                "type": "code",
-                                "code": {
-                                    "rich_text": [{"type": "text", "text": {"content": chunk}}],
-                                    "language": language
-                                }
-                            }
-                            cleaned_blocks.append(smaller_block)
-                else:
-                    # Other types like image blocks are added directly
-                    cleaned_blocks.append(validated_block)
-            else:
-                cleaned_blocks.append(validated_block)
-    
-    if not cleaned_blocks:
-        tqdm.write(f"   - Skipping empty conversation (no valid blocks after cleaning): {title}")
+    # Blocks are processed as a stream: build -> validate/clean -> pack paragraphs (fewer blocks, fewer append requests) -> batch,
+    # memory is bounded by one batch
+    block_stats = {}
+    block_stream = count_blocks(prepare_blocks(count_blocks(all_blocks, block_stats, 'original')), block_stats, 'cleaned')
+    if COMPACT_BLOCKS:
+        block_stream = compact_blocks(block_stream)
+    block_stream = count_blocks(block_stream, block_stats, 'compacted')
+    batches = iter_batches(block_stream, first_max_blocks=INITIAL_CHILDREN_LIMIT if CREATE_PAGE_WITH_CHILDREN else None)
+
+    first_batch = next(batches, None)
+    if not first_batch:
+        if block_stats['original']:
+            tqdm.write(f"   - Skipping empty conversation (no valid blocks after cleaning): {title}")
+        else:
+            tqdm.write(f"   - Skipping empty conversation: {title}")
         return True
 
-    # Debug info: show block count before and after cleaning
-    tqdm.write(f"   - Debug: Original blocks {len(all_blocks)} -> Cleaned blocks {len(cleaned_blocks)}")
-
-    # ========== New strategy: Create empty page first, then append all blocks ==========
-    # No children when creating page, greatly reduces 400 error probability
-    initial_blocks: list = []  # Keep empty list
-    remaining_blocks: list = cleaned_blocks  # All content to be appended later in batches
-
-    # Split remaining blocks into smaller batches (max 20 per batch)
-    block_chunks = [remaining_blocks[i:i + 20] for i in range(0, len(remaining_blocks), 20)]
-    initial_payload_size = 0  # Empty payload
-    tqdm.write(f"   - Chunking strategy: Create empty page, then {len(block_chunks)} batches to append")
+    # ========== Page creation strategy ==========
+    # First batch of pre-validated blocks is sent with page creation, saving one request per conversation;
+    # if creation fails validation, fall back to creating an empty page and appending all blocks
+    if CREATE_PAGE_WITH_CHILDREN:
+        initial_blocks: list = first_batch
+    else:
+        initial_blocks = []
+        batches = itertools.chain([first_batch], batches)  # Content appended later in batches (sent while being built)
+    tqdm.write(f"   - Chunking strategy: {len(initial_blocks)} blocks with page creation, the rest appended in batches as it is built")
 
     # Use detected property names
     title_property = db_info.get('title_property', 'Title')
@@ -755,15 +2609,8 @@ def import_conversation_to_notion(title, create_time, update_time, conversation_
     # Add conversation ID property (if exists)
     if conversation_id_property:
         if conversation_id_type == 'number':
-            try:
-                if conversation_id.replace('-', '').isdigit():
-                    number_value = int(conversation_id.replace('-', ''))
-                else:
-                    number_value = abs(hash(conversation_id)) % (10 ** 10)
-                properties[conversation_id_property] = {"number": number_value}
-            except (ValueError, TypeError):
-                number_value = abs(hash(conversation_id)) % (10 ** 10)
-                properties[conversation_id_property] = {"number": number_value}
+            # Stable encoding (hash() is randomized per process), same value in every run
+            properties[conversation_id_property] = {"number": encode_conversation_id_number(conversation_id)}
         else:
             properties[conversation_id_property] = {
                 "rich_text": [{"type": "text", "text": {"content": conversation_id}}]
@@ -773,19 +2620,41 @@ def import_conversation_to_notion(title, create_time, update_time, conversation_
         "parent": {"database_id": database_id},
         "properties": properties
     }
+    if initial_blocks:
+        create_payload["children"] = initial_blocks
 
     # Create page
     try:
-        response = requests.post(
-            f"{NOTION_API_BASE_URL}/pages",
-            headers=headers,
-            data=json.dumps(create_payload),
-            timeout=30
-        )
+        with timed_phase('page_create'):
+            response = notion_request(
+                'POST',
+                f"{NOTION_API_BASE_URL}/pages",
+                headers=headers,
+                data=json.dumps(create_payload),
+                timeout=30
+            )
+        # Creation with content failed validation: fall back to empty page, all blocks appended later
+        if response.status_code == 400 and initial_blocks:
+            tqdm.write("   - ⚠️ Page creation with content failed validation, falling back to empty page + append")
+            count_conversation_event('fallbacks')
+            debug_failed_payload(create_payload, response, title)
+            batches = itertools.chain(iter_batches(initial_blocks), batches)
+            initial_blocks = []
+            del create_payload["children"]
+            throttle(0.3)
+            with timed_phase('retry'):
+                response = notion_request(
+                    'POST',
+                    f"{NOTION_API_BASE_URL}/pages",
+                    headers=headers,
+                    data=json.dumps(create_payload),
+                    timeout=30
+                )
         response.raise_for_status()
         page_data = response.json()
         page_id = page_data["id"]
-        tqdm.write(f"   - ✅ Page created successfully: {title}")
+        RUN_METRICS["blocks_appended"] += len(initial_blocks)
+        tqdm.write(f"   - ✅ Page created successfully ({len(initial_blocks)} blocks included): {title}")
     except requests.exceptions.RequestException as e:
         global DEBUG_FIRST_FAILURE
         error_msg = ""
@@ -828,6 +2697,7 @@ def import_conversation_to_notion(title, create_time, update_time, conversation_
             tqdm.write(f"   - Payload size: {len(str(create_payload))} characters (too long, omitted)")
             tqdm.write(f"   - Block count: {len(initial_blocks)}")
         
+        count_conversation_event('fallbacks')
         # Try creating simplified version (title only, no content blocks)
         try:
             tqdm.write(f"   - 🔄 Trying to create simplified version (title only)...")
@@ -847,12 +2717,14 @@ def import_conversation_to_notion(title, create_time, update_time, conversation_
                 "properties": safe_properties
             }
             
-            response = requests.post(
-                f"{NOTION_API_BASE_URL}/pages",
-                headers=headers,
-                data=json.dumps(simple_payload),
-                timeout=30
-            )
+            with timed_phase('retry'):
+                response = notion_request(
+                    'POST',
+                    f"{NOTION_API_BASE_URL}/pages",
+                    headers=headers,
+                    data=json.dumps(simple_payload),
+                    timeout=30
+                )
             response.raise_for_status()
             page_data = response.json()
             page_id = page_data["id"]
@@ -860,7 +2732,7 @@ def import_conversation_to_notion(title, create_time, update_time, conversation_
             
             # Then try updating properties (separate request reduces failure risk)
             try:
-                time.sleep(0.3)
+                throttle(0.3)
                 update_properties = {}
                 
                 # Add properties one by one, failure doesn't affect others
@@ -874,24 +2746,25 @@ def import_conversation_to_notion(title, create_time, update_time, conversation_
                 
                 if conversation_id_property and conversation_id_type == 'number':
                     try:
-                        number_value = abs(hash(conversation_id)) % (10**8)  # Smaller number
-                        update_properties[conversation_id_property] = {"number": number_value}
+                        update_properties[conversation_id_property] = {"number": encode_conversation_id_number(conversation_id)}
                     except:
                         pass
                 
                 if update_properties:
-                    requests.patch(
-                        f"{NOTION_API_BASE_URL}/pages/{page_id}",
-                        headers=headers,
-                        data=json.dumps({"properties": update_properties}),
-                        timeout=30
-                    )
+                    with timed_phase('retry'):
+                        notion_request(
+                            'PATCH',
+                            f"{NOTION_API_BASE_URL}/pages/{page_id}",
+                            headers=headers,
+                            data=json.dumps({"properties": update_properties}),
+                            timeout=30
+                        )
             except:
                 pass  # Property update failure is ok, at least page was created
             
             # Try adding a simple note block
             try:
-                time.sleep(0.3)
+                throttle(0.3)
                 note_block = {
                     "type": "paragraph",
                     "paragraph": {
@@ -899,12 +2772,14 @@ def import_conversation_to_notion(title, create_time, update_time, conversation_
                     }
                 }
                 
-                requests.patch(
-                    f"{NOTION_API_BASE_URL}/blocks/{page_id}/children",
-                    headers=headers,
-                    data=json.dumps({"children": [note_block]}),
-                    timeout=30
-                )
+                with timed_phase('retry'):
+                    notion_request(
+                        'PATCH',
+                        f"{NOTION_API_BASE_URL}/blocks/{page_id}/children",
+                        headers=headers,
+                        data=json.dumps({"children": [note_block]}),
+                        timeout=30
+                    )
                 
             except:
                 pass  # Note block failure is ok too
@@ -916,157 +2791,57 @@ def import_conversation_to_notion(title, create_time, update_time, conversation_
             tqdm.write(f"   - ❌ Simplified version also failed: {error_msg}")
             return False
 
-    # If there are remaining content blocks, append in batches
-    if block_chunks and any(block_chunks):  # Check if there are non-empty block groups
-        tqdm.write(f"   - 💬 Detected long conversation, appending remaining content ({len(block_chunks)} batches)...")
-        append_url = f"{NOTION_API_BASE_URL}/blocks/{page_id}/children"
-        
-        for i, chunk in enumerate(block_chunks):
-            if not chunk:  # Skip empty block groups
-                continue
-            
-            # Validate batch content
-            validated_chunk = []
-            chunk_json_size = 0
-            
-            for block in chunk:
-                # Re-validate each block
-                validated_block = validate_block_content(block)
-                if validated_block:
-                    block_size = len(json.dumps(validated_block, ensure_ascii=False))
-                    
-                    # If single block too large, split it instead of skipping
-                    if block_size > 1000:
-                        tqdm.write(f"   -   ...🔄 Splitting oversized block ({block_size} characters)")
-                        
-                        # Splitting logic
-                        if validated_block['type'] == 'paragraph':
-                            original_content = validated_block['paragraph']['rich_text'][0]['text']['content']
-                            smaller_chunks = split_long_text(original_content, max_length=600)
-                            for small_chunk in smaller_chunks:
-                                if small_chunk.strip():
-                                    smaller_block = {
-                                        "type": "paragraph",
-                                        "paragraph": {
-                                            "rich_text": [{"type": "text", "text": {"content": small_chunk}}]
-                                        }
-                                    }
-                                    smaller_size = len(json.dumps(smaller_block, ensure_ascii=False))
-                                    if (chunk_json_size + smaller_size) <= 50000:  # Further reduced
-                                        validated_chunk.append(smaller_block)
-                                        chunk_json_size += smaller_size
-                        elif validated_block['type'] == 'code':
-                            original_content = validated_block['code']['rich_text'][0]['text']['content']
-                            language = validated_block['code']['language']
-                            smaller_chunks = split_long_text(original_content, max_length=600)
-                            for small_chunk in smaller_chunks:
-                                if small_chunk.strip():
-                                    smaller_block = {
-                                        "type": "code",
-                                        "code": {
-                                            "rich_text": [{"type": "text", "text": {"content": small_chunk}}],
-                                            "language": language
-                                        }
-                                    }
-                                    smaller_size = len(json.dumps(smaller_block, ensure_ascii=False))
-                                    if (chunk_json_size + smaller_size) <= 50000:  # Further reduced
-                                        validated_chunk.append(smaller_block)
-                                        chunk_json_size += smaller_size
-                        else:
-                            # Other types (like images) add directly, but check total size
-                            if (chunk_json_size + block_size) <= 50000:  # Further reduced
-                                validated_chunk.append(validated_block)
-                                chunk_json_size += block_size
-                    else:
-                        # Block size is appropriate, check if it would exceed batch limit
-                        if (chunk_json_size + block_size) <= 50000:  # Further reduced
-                            validated_chunk.append(validated_block)
-                            chunk_json_size += block_size
+    # Remaining blocks are appended in batches while being built (max APPEND_BATCH_SIZE blocks and BATCH_PAYLOAD_LIMIT characters per batch)
+    append_url = f"{NOTION_API_BASE_URL}/blocks/{page_id}/children"
+    for i, validated_chunk in enumerate(batches, 1):
+        if i == 1:
+            tqdm.write("   - 💬 Detected long conversation, appending remaining content in batches...")
+        try:
+            throttle(0.5)  # Slightly increase delay
+            payload = {"children": validated_chunk}
+            payload_size = len(json.dumps(payload, ensure_ascii=False))
             
-            if not validated_chunk:
-                tqdm.write(f"   -   ...⚠️ Batch {i+1} empty after cleaning, skipping")
-                continue
-                
-            try:
-                time.sleep(0.5)  # Slightly increase delay
-                payload = {"children": validated_chunk}
-                payload_size = len(json.dumps(payload, ensure_ascii=False))
-                
-                # 🎯 Further reduce batch size limit
-                if payload_size > 400000:  # Reduced from 2500 to 1500
-                    tqdm.write(f"   -   ...⚠️ Batch {i+1} payload too large ({payload_size} characters), skipping")
-                    continue
-                
-                response = requests.patch(
+            with timed_phase('append'):
+                response = notion_request(
+                    'PATCH',
                     append_url,
                     headers=headers,
                     data=json.dumps(payload),
                     timeout=30
                 )
-                response.raise_for_status()
-                tqdm.write(f"   -   ...Batch {i+1}/{len(block_chunks)} appended successfully ({len(validated_chunk)} blocks, {payload_size} characters)")
-            except requests.exceptions.RequestException as e:
-                error_msg = e.response.text if e.response else str(e)
-                tqdm.write(f"   -   ...❌ Batch {i+1}/{len(block_chunks)} append failed: {error_msg}")
-                
-                # 🎯 New: Analyze append failure reason
-                debug_failed_payload(payload, e.response, f"{title} - Batch{i+1}")
-                
-                # ========== New fallback: try inserting block by block, keep successful ones ==========
-                tqdm.write(f"   -   ...⚙️ Fallback to single-block append mode, retrying block by block")
-                successful_blocks = 0
-                for k, single_block in enumerate(validated_chunk):
-                    single_payload = {"children": [single_block]}
-                    try:
-                        time.sleep(0.4)
-                        requests.patch(
-                            append_url,
-                            headers=headers,
-                            data=json.dumps(single_payload),
-                            timeout=30
-                        ).raise_for_status()
-                        successful_blocks += 1
-                    except requests.exceptions.RequestException:
-                        # ⚠️ If single block still fails, try splitting it into even smaller text (300 chars)
-                        # Only handle paragraph / code
-                        try:
-                            if single_block.get('type') in ('paragraph', 'code'):
-                                txt_key = 'paragraph' if single_block['type'] == 'paragraph' else 'code'
-                                original_txt = single_block[txt_key]['rich_text'][0]['text']['content']
-                                tiny_chunks = split_long_text(original_txt, max_length=300)
-                                tiny_success = 0
-                                for tiny in tiny_chunks:
-                                    tiny_block = {
-                                        "type": single_block['type'],
-                                        txt_key: {
-                                            "rich_text": [{"type": "text", "text": {"content": tiny}}]
-                                        }
-                                    }
-                                    try:
-                                        time.sleep(0.2)
-                                        requests.patch(
-                                            append_url,
-                                            headers=headers,
-                                            data=json.dumps({"children": [tiny_block]}),
-                                            timeout=30
-                                        ).raise_for_status()
-                                        tiny_success += 1
-                                    except requests.exceptions.RequestException:
-                                        # If minimal block still fails, give up completely
-                                        pass
-                                if tiny_success:
-                                    successful_blocks += tiny_success  # Count successes
-                        except Exception:
-                            pass
-                        continue
-                tqdm.write(f"   -   ...Single-block append completed, successful {successful_blocks}/{len(validated_chunk)} blocks")
-                # Don't stop overall flow because of single batch failure
-                continue
+            response.raise_for_status()
+            RUN_METRICS["blocks_appended"] += len(validated_chunk)
+            tqdm.write(f"   -   ...Batch {i} appended successfully ({len(validated_chunk)} blocks, {payload_size} characters)")
+        except requests.exceptions.RequestException as e:
+            error_msg = e.response.text if e.response else str(e)
+            tqdm.write(f"   -   ...❌ Batch {i} append failed: {error_msg}")
+            
+            # 🎯 New: Analyze append failure reason
+            debug_failed_payload(payload, e.response, f"{title} - Batch{i}")
+            
+            # ========== Fallback: bisect the failed batch to isolate bad blocks ==========
+            tqdm.write("   -   ...⚙️ Fallback to bisection mode, isolating failing blocks")
+            count_conversation_event('fallbacks')
+            successful_blocks = append_blocks_with_bisection(append_url, validated_chunk, headers, conversation_id, title, error_msg)
+            RUN_METRICS["blocks_appended"] += successful_blocks
+            tqdm.write(f"   -   ...Bisection append completed, successful {successful_blocks}/{len(validated_chunk)} blocks")
+            # Don't stop overall flow because of single batch failure
+            continue
+
+    # Debug info: show block count before and after cleaning (streamed, known only after everything was appended)
+    tqdm.write(f"   - Debug: Original blocks {block_stats['original']} -> Cleaned blocks {block_stats['cleaned']} -> Compacted blocks {block_stats['compacted']}")
+
+    # Extra sections (such as alternate branches) go into collapsed toggle blocks, content is built only now
+    for label, build_section_blocks in sections or []:
+        section_blocks = prepare_blocks(build_section_blocks())
+        if COMPACT_BLOCKS:
+            section_blocks = compact_blocks(section_blocks)
+        append_toggle_section(page_id, label, section_blocks, headers, conversation_id, title)
 
     return True
 
-def clean_text_content(text):
-    """Clean text content, remove characters that might cause API errors"""
+def clean_text_content(text, normalize_whitespace=True):
+    """Clean text content, remove characters that might cause API errors (code blocks pass normalize_whitespace=False to keep indentation and blank lines)"""
     if not isinstance(text, str):
         return str(text)
     
@@ -1127,7 +2902,7 @@ def clean_text_content(text):
     
     # New: Remove too many repeated characters
     # Remove excessive consecutive same characters (might be error output)
-    cleaned = re.sub(r'(.)\1{10,}', r'\1\1\1[Repeated content cleaned]', cleaned)
+    cleaned = re.sub(r'(.)\1{10,}' if normalize_whitespace else r'(\S)\1{10,}', r'\1\1\1[Repeated content cleaned]', cleaned)
     
     # New: Clean search result content
     # Remove ChatGPT search result special format # [0]Title - Website [url]
@@ -1202,8 +2977,9 @@ def clean_text_content(text):
     cleaned = '\n'.join(cleaned_lines)
     
     # Remove excessive consecutive whitespace
-    cleaned = re.sub(r'\n{3,}', '\n\n', cleaned)  # Keep max two consecutive newlines
-    cleaned = re.sub(r' {3,}', '  ', cleaned)      # Keep max two consecutive spaces
+    if normalize_whitespace:
+        cleaned = re.sub(r'\n{3,}', '\n\n', cleaned)  # Keep max two consecutive newlines
+        cleaned = re.sub(r' {3,}', '  ', cleaned)      # Keep max two consecutive spaces
     
     # Limit text length
     if len(cleaned) > MAX_TEXT_LENGTH:
@@ -1268,9 +3044,9 @@ def validate_block_content(block):
         
         block_type = block['type']
         
-        # Handle paragraph blocks
-        if block_type == 'paragraph' and 'paragraph' in block:
-            paragraph = block['paragraph']
+        # Handle paragraph blocks (and headings / list items / quotes, which only hold rich_text)
+        if block_type in TEXT_BLOCK_TYPES and block_type in block:
+            paragraph = block[block_type]
             if 'rich_text' in paragraph:
                 cleaned_rich_text = []
                 for text_obj in paragraph['rich_text']:
@@ -1289,8 +3065,8 @@ def validate_block_content(block):
                 
                 if cleaned_rich_text:
                     return {
-                        "type": "paragraph",
-                        "paragraph": {
+                        "type": block_type,
+                        block_type: {
                             "rich_text": cleaned_rich_text
                         }
                     }
@@ -1302,7 +3078,7 @@ def validate_block_content(block):
                 cleaned_rich_text = []
                 for text_obj in code['rich_text']:
                     if isinstance(text_obj, dict) and 'text' in text_obj and 'content' in text_obj['text']:
-                        content = clean_text_content(text_obj['text']['content'])
+                        content = clean_text_content(text_obj['text']['content'], normalize_whitespace=False)
                         
                         # 🎯 New: Aggressive cleaning for code blocks
                         if any(pattern in content for pattern in ['[Function call cleaned]', 'open_url', 'search(', '1q43.blog']):
@@ -1337,9 +3113,13 @@ def validate_block_content(block):
                         }
                     }
         
-        # Handle image blocks
-        elif block_type == 'image':
+        # Handle image blocks, and file / PDF / audio / video blocks of attachments
+        elif block_type in ('image', 'file', 'pdf', 'audio', 'video'):
             return block
+
+        # Divider
+        elif block_type == 'divider':
+            return {"type": "divider", "divider": {}}
         
         return None
         
@@ -1347,8 +3127,122 @@ def validate_block_content(block):
         print(f"   ⚠️ Warning: Error while cleaning block content: {e}")
         return None
 
+def get_payload_bytes(payload):
+    """Request body size in bytes (same json.dumps as the import, ASCII escaped)"""
+    return len(json.dumps(payload))
+
+def plan_conversation(conversation):
+    """--plan: requests and bytes an import of the conversation would send, computed offline with the import's block building / validation / batching"""
+    PLAN_STATE["uploads"] = []
+    tree = build_conversation_tree(conversation)
+    for reference in build_upload_plan(tree, get_conversation_path(tree)):
+        plan_file_upload(reference)
+
+    cost = {"id": conversation['id'], "title": conversation.get('title', 'Untitled'), "create": 0, "append": 0, "upload": 0,
+            "blocks": 0, "request_bytes": 0, "upload_bytes": 0, "throttle_s": 0.4}
+    block_stream = prepare_blocks(build_blocks_from_conversation(conversation, {}, tree))
+    if COMPACT_BLOCKS:
+        block_stream = compact_blocks(block_stream)
+    batches = iter_batches(block_stream, first_max_blocks=INITIAL_CHILDREN_LIMIT if CREATE_PAGE_WITH_CHILDREN else None)
+    first_batch = next(batches, None)
+    if first_batch:
+        # Page properties are estimated with the title only (the database structure needs a request)
+        title = clean_text_content(cost["title"][:100])
+        create_payload = {"parent": {"database_id": NOTION_DATABASE_ID}, "properties": {"title": {"title": [{"type": "text", "text": {"content": title}}]}}}
+        if CREATE_PAGE_WITH_CHILDREN:
+            create_payload["children"] = first_batch
+        else:
+            batches = itertools.chain([first_batch], batches)
+        cost["create"] = 1
+        cost["blocks"] += len(first_batch) if CREATE_PAGE_WITH_CHILDREN else 0
+        cost["request_bytes"] += get_payload_bytes(create_payload)
+        for batch in batches:
+            cost["append"] += 1
+            cost["blocks"] += len(batch)
+            cost["request_bytes"] += get_payload_bytes({"children": batch})
+
+        for label, build_section_blocks in get_conversation_sections(conversation, {}, tree):
+            section_blocks = prepare_blocks(build_section_blocks())
+            if COMPACT_BLOCKS:
+                section_blocks = compact_blocks(section_blocks)
+            for i, batch in enumerate(iter_batches(section_blocks)):
+                # The first batch is sent with the toggle block, the rest is appended inside the toggle
+                payload = {"children": batch}
+                if i == 0:
+                    payload = {"children": [{"type": "toggle", "toggle": {"rich_text": [{"type": "text", "text": {"content": clean_text_content(label)}}], "children": batch}}]}
+                cost["append"] += 1
+                cost["blocks"] += len(batch)
+                cost["request_bytes"] += get_payload_bytes(payload)
+
+    # Two requests per file: create the upload + send the content
+    cost["upload"] = 2 * len(PLAN_STATE["uploads"])
+    cost["upload_bytes"] = sum(PLAN_STATE["uploads"])
+    cost["throttle_s"] += 0.5 * cost["append"]
+    cost["requests"] = cost["create"] + cost["append"] + cost["upload"]
+    cost["estimated_s"] = round(estimate_import_seconds(cost), 1)
+    return cost
+
+def estimate_import_seconds(cost):
+    """Estimated import time: the larger of the rate-limited minimum and sequential execution (fixed waits + request latency, uploads in parallel)"""
+    sequential = cost["throttle_s"] + (cost["create"] + cost["append"] + cost["upload"] / UPLOAD_WORKERS) * PLAN_REQUEST_LATENCY
+    return max(cost["requests"] / PLAN_REQUEST_RATE, sequential)
+
+def format_duration(seconds):
+    if seconds >= 3600:
+        return f"{seconds / 3600:.1f} h"
+    return f"{seconds / 60:.1f} min" if seconds >= 60 else f"{seconds:.0f} s"
+
+def print_import_plan(costs, skipped):
+    """Print request / byte totals, estimated duration and the most expensive conversations, write the per-conversation details"""
+    totals = {key: sum(cost[key] for cost in costs) for key in ("create", "append", "upload", "requests", "blocks", "request_bytes", "upload_bytes", "throttle_s")}
+    totals["throttle_s"] = round(totals["throttle_s"], 1)
+    totals["estimated_s"] = round(estimate_import_seconds(totals), 1)
+    print("\n" + "="*50)
+    print(f"🧮 Import plan: {len(costs)} conversations ({skipped} already processed, skipped)")
+    print(f"   Requests: {totals['requests']} (page creation {totals['create']}, append {totals['append']}, upload {totals['upload']}), {totals['blocks']} blocks")
+    print(f"   Sent: block content {totals['request_bytes'] / 1048576:.1f} MB, files {totals['upload_bytes'] / 1048576:.1f} MB")
+    print(f"   Estimated duration: {format_duration(totals['estimated_s'])} (at least {format_duration(totals['requests'] / PLAN_REQUEST_RATE)} at {PLAN_REQUEST_RATE} requests/s, "
+          f"fixed waits {format_duration(totals['throttle_s'])}, assumed latency {PLAN_REQUEST_LATENCY}s)")
+    if costs:
+        print(f"   Top {min(PLAN_TOP_N, len(costs))} most expensive conversations:")
+        for cost in sorted(costs, key=lambda c: c["estimated_s"], reverse=True)[:PLAN_TOP_N]:
+            print(f"      {format_duration(cost['estimated_s']):>8}  {cost['requests']:5} requests  {cost['blocks']:6} blocks  "
+                  f"{(cost['request_bytes'] + cost['upload_bytes']) / 1048576:7.2f} MB  {cost['id']}  {cost['title'][:50]}")
+    if PLAN_REPORT_FILE:
+        with open(PLAN_REPORT_FILE, 'w', encoding='utf-8') as f:
+            json.dump({"rate": PLAN_REQUEST_RATE, "latency_s": PLAN_REQUEST_LATENCY, "totals": totals, "conversations": costs}, f, ensure_ascii=False, indent=2)
+        print(f"   📄 Per-conversation details: {PLAN_REPORT_FILE}")
+
+def plan_import():
+    """--plan: dry run without network or uploads, builds and validates the blocks of all pending conversations and estimates requests, bytes and duration"""
+    print("🧮 Planning import (offline, nothing is sent to Notion)...")
+    if not os.path.exists(CONVERSATIONS_JSON_PATH):
+        print(f"❌ Error: Cannot find conversation file '{CONVERSATIONS_JSON_PATH}'")
+        sys.exit(1)
+    with open(CONVERSATIONS_JSON_PATH, 'r', encoding='utf-8') as f, timed_phase('json_load'):
+        all_conversations = json.load(f)
+    processed_ids = load_processed_ids()
+    conversations = [
+        conv for conv in all_conversations
+        if conv.get('id') not in processed_ids and 'title' in conv and 'mapping' in conv
+    ]
+
+    costs = []
+    PLAN_STATE["active"] = True
+    try:
+        for conversation in tqdm(reversed(conversations), total=len(conversations), desc="Planning", unit="conversations"):
+            try:
+                costs.append(plan_conversation(conversation))
+            except Exception as e:
+                tqdm.write(f"❌ Unexpected error while planning '{conversation.get('title', 'Untitled')}': {e}")
+            conversation.pop('mapping', None)
+    finally:
+        PLAN_STATE["active"] = False
+    print_import_plan(costs, len(processed_ids))
+
 def main():
     """Main execution function"""
+    run_start = time.perf_counter()
     print("🚀 Starting ChatGPT to Notion Importer...")
     
     # Validate configuration
@@ -1395,12 +3289,13 @@ def main():
 
     # Read conversation data
     try:
-        with open(CONVERSATIONS_JSON_PATH, 'r', encoding='utf-8') as f:
+        with open(CONVERSATIONS_JSON_PATH, 'r', encoding='utf-8') as f, timed_phase('json_load'):
             all_conversations = json.load(f)
         print(f"✅ Successfully read conversation file")
     except Exception as e:
         print(f"❌ Error: Unable to read conversations.json: {e}")
         sys.exit(1)
+    profile_checkpoint("after JSON load")
 
     # ====== Quick test mode: only select conversations with images or Canvas ======
     if QUICK_TEST_MODE:
@@ -1469,6 +3364,7 @@ def main():
         return
 
     print(f"\n▶️ Starting to process {total_to_process} new conversations...")
+    start_metrics_exporters(total_to_process)
     success_count, fail_count = 0, 0
     
     # Process in reverse chronological order, newest conversations imported first
@@ -1477,11 +3373,21 @@ def main():
                            desc="Import Progress", 
                            unit="conversations"):
         conv_id = conversation['id']
+        profile_conversation_start(conv_id)
         conv_title = conversation.get('title', 'Untitled')
+        start_conversation_metrics(conv_id, conv_title)
+        success = False
         
         try:
-            # Build Notion blocks
-            blocks = build_blocks_from_conversation(conversation, headers)
+            # Build Notion blocks (the compact conversation tree is built once and shared with branch sections)
+            tree = build_conversation_tree(conversation)
+
+            # Upload plan: all files referenced by the conversation are uploaded in parallel before the page is assembled
+            upload_planned_files(build_upload_plan(tree, get_conversation_path(tree)), headers)
+            blocks = build_blocks_from_conversation(conversation, headers, tree)
+
+            # Canvas documents and (in full branch mode) alternate branches are appended lazily as toggle blocks
+            sections = get_conversation_sections(conversation, headers, tree)
             
             # Import to Notion
             success = import_conversation_to_notion(
@@ -1492,7 +3398,8 @@ def main():
                 all_blocks=blocks,
                 headers=headers,
                 database_id=NOTION_DATABASE_ID,
-                db_info=db_info
+                db_info=db_info,
+                sections=sections
             )
 
             if success:
@@ -1506,8 +3413,15 @@ def main():
             fail_count += 1
             tqdm.write(f"❌ Unexpected error while processing '{conv_title}': {e}")
 
+        # The raw mapping is no longer needed, release it so memory shrinks as the import progresses
+        conversation.pop('mapping', None)
+        profile_conversation_end(conv_id)
+        finish_conversation_metrics(success)
+        RUN_METRICS.update(conversations_success=success_count, conversations_failed=fail_count)
+        RUN_METRICS["conversations_pending"] -= 1
+
         # Avoid API rate limiting
-        time.sleep(0.4)
+        throttle(0.4)
 
     # Output final results
     print("\n" + "="*50)
@@ -1517,9 +3431,18 @@ def main():
         print(f"🔴 Import failed: {fail_count} conversations")
         print("   💡 Failed conversations will be retried in next run")
     print(f"⏭️  Skipped (already processed): {len(processed_ids)} conversations")
+    print_content_handler_stats()
+    print_message_filter_stats()
+    print_conversation_report()
+    print_http_trace_summary()
+    print_performance_report(time.perf_counter() - run_start, success_count, fail_count)
     
     if success_count > 0:
         print(f"\n✨ Please check your Notion database to view the imported {success_count} conversations!")
 
 if __name__ == "__main__":
-    main() 
+    try:
+        run_profiled(plan_import if "--plan" in sys.argv[1:] else main)
+    finally:
+        # Also on errors and Ctrl+C: the metrics endpoint is closed and the textfile gets the final values
+        stop_metrics_exporters()